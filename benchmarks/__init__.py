@@ -0,0 +1,4 @@
+"""Performance benchmarks for WDRAX.
+
+Each module can be run as a script, e.g. ``python -m benchmarks.cache_codec``.
+"""
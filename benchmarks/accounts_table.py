@@ -0,0 +1,182 @@
+"""Benchmark the native accounts table engine against the DOACCOUNTSTABLE script.
+
+Usage::
+
+    python -m benchmarks.accounts_table [-n N [N ...]] [--workers W] [--skip-shell]
+
+For each number of Tweets, writes a JSON array of synthetic Tweets and a
+users cache containing every account, then times ``main.sh``, the native
+engine and the native engine mapping shards of the Tweets in ``W``
+processes, and checks that their output files are identical.  The users
+cache means no version needs to look up users from the Twitter API.
+"""
+
+import argparse
+import filecmp
+import json
+import os
+import pathlib
+import random
+import subprocess
+import tempfile
+import time
+
+from wdra_extender.app import app
+from wdra_extender.extract.accounts_table import (AccountsTablePlugin,
+                                                  write_account_files,
+                                                  write_accounts_table)
+from wdra_extender.extract.mapreduce import map_shards
+from wdra_extender.extract.tweet_store import TweetView, iter_tweets_file, write_ndjson
+
+from .synthetic import make_tweets, make_user
+
+BIN_DIR = pathlib.Path(__file__).resolve().parents[1].joinpath(
+    'plugins', 'DOACCOUNTSTABLE')
+
+
+def write_inputs(n_tweets: int, n_users: int, dir_path: pathlib.Path) -> None:
+    """Write the Tweets file and users cache for a benchmark run."""
+    rand = random.Random(0)
+    users = {}
+    with open(dir_path.joinpath('tweets.json'), mode='w',
+              encoding='utf-8') as tweets_out:
+        tweets_out.write('[')
+        for i, tweet in enumerate(make_tweets(n_tweets, n_users=n_users)):
+            if i:
+                tweets_out.write(',')
+            json.dump(tweet, tweets_out, ensure_ascii=False)
+
+            for obj in (tweet, tweet.get('retweeted_status')):
+                if obj:
+                    users.setdefault(obj['user']['id'], obj['user'])
+                    for mention in obj['entities']['user_mentions']:
+                        if mention['id'] not in users:
+                            users[mention['id']] = make_user(mention['id'], rand)
+
+        tweets_out.write(']')
+
+    with open(dir_path.joinpath('users.jsonl'), mode='w',
+              encoding='utf-8') as users_out:
+        for user in users.values():
+            users_out.write(
+                json.dumps(user, ensure_ascii=False, separators=(',', ':')))
+            users_out.write('\n')
+
+
+def run_shell(dir_path: pathlib.Path, work_dir: pathlib.Path) -> float:
+    """Run the DOACCOUNTSTABLE script and return its wall time."""
+    env = os.environ.copy()
+    env.update({
+        'BIN': str(BIN_DIR),
+        'USERS_CACHE': str(dir_path.joinpath('users.jsonl')),
+    })
+
+    start = time.perf_counter()
+    subprocess.run(['sh', BIN_DIR.joinpath('main.sh'),
+                    dir_path.joinpath('tweets.json')],
+                   cwd=work_dir,
+                   env=env,
+                   check=True)
+    return time.perf_counter() - start
+
+
+def run_native(dir_path: pathlib.Path, work_dir: pathlib.Path,
+               tweets=None) -> float:
+    """Run the native engine and return its wall time."""
+    if tweets is None:
+        tweets = iter_tweets_file(dir_path.joinpath('tweets.json'))
+
+    start = time.perf_counter()
+    write_accounts_table(tweets,
+                         work_dir,
+                         BIN_DIR,
+                         users_cache=dir_path.joinpath('users.jsonl'),
+                         lookup=lambda names: [])
+    return time.perf_counter() - start
+
+
+def run_sharded(dir_path: pathlib.Path, work_dir: pathlib.Path,
+                workers: int) -> float:
+    """Run the native engine on shards of the Tweets and return its wall time."""
+    ndjson_path = dir_path.joinpath('tweets.jsonl')
+    if not ndjson_path.exists():
+        write_ndjson(iter_tweets_file(dir_path.joinpath('tweets.json')),
+                     ndjson_path)
+
+    start = time.perf_counter()
+    with app.app_context():
+        partials = map_shards(AccountsTablePlugin.map_shard,
+                              TweetView(ndjson_path),
+                              max_workers=workers,
+                              min_shard_bytes=1024**2)
+        table, rows = AccountsTablePlugin.reduce(partials)
+        work_dir.joinpath('00TMP').write_text(''.join(rows), encoding='utf-8')
+        write_account_files(table,
+                            work_dir,
+                            BIN_DIR,
+                            users_cache=dir_path.joinpath('users.jsonl'),
+                            lookup=lambda names: [])
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='Numbers of Tweets to benchmark')
+    parser.add_argument('--users', type=int, default=50000,
+                        help='Number of distinct synthetic users')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of processes in which to map shards')
+    parser.add_argument('--skip-shell', action='store_true',
+                        help='Only run the native engine')
+    args = parser.parse_args()
+
+    for n_tweets in args.n:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dir_path = pathlib.Path(tmp_dir)
+            write_inputs(n_tweets, args.users, dir_path)
+            native_dir = dir_path.joinpath('native')
+            native_dir.mkdir()
+
+            native_time = run_native(dir_path, native_dir)
+            print(f'{n_tweets} Tweets: native {native_time:.2f}s '
+                  f'(parsing tweets.json included)')
+
+            tweets = list(iter_tweets_file(dir_path.joinpath('tweets.json')))
+            parsed_dir = dir_path.joinpath('parsed')
+            parsed_dir.mkdir()
+            parsed_time = run_native(dir_path, parsed_dir, tweets=tweets)
+            print(f'{n_tweets} Tweets: native {parsed_time:.2f}s '
+                  f'(already parsed, as for an in-process plugin)')
+            del tweets
+
+            sharded_dir = dir_path.joinpath('sharded')
+            sharded_dir.mkdir()
+            sharded_time = run_sharded(dir_path, sharded_dir, args.workers)
+            files = sorted(p.name for p in native_dir.iterdir())
+            _, mismatch, errors = filecmp.cmpfiles(native_dir, sharded_dir,
+                                                   files, shallow=False)
+            print(f'{n_tweets} Tweets: sharded in {args.workers} processes '
+                  f'{sharded_time:.2f}s (parsing tweets.jsonl included), '
+                  f'differing files {mismatch + errors or "none"}')
+
+            if args.skip_shell:
+                continue
+
+            shell_dir = dir_path.joinpath('shell')
+            shell_dir.mkdir()
+            shell_time = run_shell(dir_path, shell_dir)
+
+            files = sorted(p.name for p in shell_dir.iterdir())
+            _, mismatch, errors = filecmp.cmpfiles(shell_dir, native_dir,
+                                                   files, shallow=False)
+            print(f'{n_tweets} Tweets: main.sh {shell_time:.2f}s, '
+                  f'speed-up {shell_time / native_time:.1f}x '
+                  f'({shell_time / parsed_time:.1f}x already parsed), '
+                  f'differing files {mismatch + errors or "none"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark cache codecs for size and encode/decode throughput.
+
+Usage::
+
+    python -m benchmarks.cache_codec [--tweets FILE] [-n N]
+
+Reports the mean number of bytes stored per Tweet and the number of Tweets
+encoded and decoded per second for each available codec, with and without a
+shared compression dictionary.
+
+With ``--write-dictionary FILE`` the dictionary trained from the given Tweets
+is saved for use as ``TWEET_CACHE_DICTIONARY``.
+"""
+
+import argparse
+import itertools
+import pathlib
+import time
+
+from wdra_extender.extract import cache_codec
+
+from .synthetic import load_tweets, make_tweets
+
+CODECS = [
+    'json+none',
+    'json+zlib',
+    'json+zstd',
+    'msgpack+none',
+    'msgpack+zlib',
+    'msgpack+zstd',
+]
+
+
+def benchmark(codec: cache_codec.CacheCodec, tweets):
+    """Measure a single codec against a list of Tweets."""
+    start = time.perf_counter()
+    encoded = [codec.encode(tweet) for tweet in tweets]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for value in encoded:
+        codec.decode(value)
+    decode_time = time.perf_counter() - start
+
+    n_bytes = sum(map(len, encoded))
+    return (n_bytes / len(tweets), len(tweets) / encode_time,
+            len(tweets) / decode_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tweets', type=pathlib.Path,
+                        help='JSON or NDJSON file of Tweets - synthetic if not given')
+    parser.add_argument('-n', type=int, default=10000,
+                        help='Number of Tweets to use')
+    parser.add_argument('--write-dictionary', type=pathlib.Path,
+                        help='Save the trained compression dictionary to this file')
+    args = parser.parse_args()
+
+    source = load_tweets(args.tweets) if args.tweets else make_tweets(args.n)
+    tweets = list(itertools.islice(source, args.n))
+
+    # Train the dictionary on different Tweets to those measured
+    dictionary = cache_codec.build_dictionary(
+        make_tweets(2000, seed=1) if not args.tweets else tweets[::10])
+    if args.write_dictionary:
+        args.write_dictionary.write_bytes(dictionary)
+
+    print(f'{"codec":<24} {"bytes/tweet":>12} {"encode/s":>12} {"decode/s":>12}')
+    for name in CODECS:
+        for use_dictionary in (False, True):
+            try:
+                codec = cache_codec.CacheCodec(
+                    name, dictionary=dictionary if use_dictionary else None)
+
+            except ImportError as exc:
+                print(f'{name:<24} skipped: {exc}')
+                break
+
+            if use_dictionary and not codec.dictionary:
+                continue
+
+            label = name + (' +dict' if use_dictionary else '')
+            size, encode_rate, decode_rate = benchmark(codec, tweets)
+            print(f'{label:<24} {size:>12.0f} {encode_rate:>12.0f} {decode_rate:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark concurrent Bundle downloads.
+
+Usage::
+
+    python -m benchmarks.downloads [--size MB] [--clients N [N ...]] [--requests R]
+
+Serves a Bundle of the given size from a local threaded WSGI server and
+downloads it from ``N`` concurrent clients, ``R`` times each, using:
+
+* ``send_from_directory`` - the previous implementation of `download_extract`
+* ``app`` - `download_extract` sending the file from the app worker
+* ``x-accel-redirect`` - `download_extract` handing the file to a front-end
+  web server; there is none here, so this measures how long a worker is
+  occupied by each download rather than the transfer itself
+
+Resumed downloads are checked to return the rest of the file.
+"""
+
+import argparse
+from concurrent import futures
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+
+from flask import send_from_directory
+from werkzeug.serving import make_server
+
+from wdra_extender.app import app
+
+EXTRACT_UUID = uuid.UUID('00000000-0000-4000-8000-000000000000')
+
+
+def legacy_download(extract_uuid):
+    """Previous implementation of `download_extract`."""
+    return send_from_directory(app.config['OUTPUT_DIR'],
+                               f'{extract_uuid}.zip',
+                               as_attachment=True)
+
+
+def fetch(url: str, headers=None) -> int:
+    """Download a URL and return the number of bytes received."""
+    received = 0
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as response:
+        while True:
+            chunk = response.read(1024**2)
+            if not chunk:
+                return received
+
+            received += len(chunk)
+
+
+def run_clients(url: str, n_clients: int, n_requests: int) -> (float, int):
+    """Download a URL from concurrent clients and return the wall time and bytes received."""
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=n_clients) as pool:
+        received = sum(pool.map(lambda _: fetch(url), range(n_clients * n_requests)))
+
+    return time.perf_counter() - start, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=200, help='Size of the Bundle in MB')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16],
+                        help='Numbers of concurrent clients')
+    parser.add_argument('--requests', type=int, default=2,
+                        help='Number of downloads by each client')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = pathlib.Path(tmp_dir)
+        bundle_path = output_dir.joinpath(f'{EXTRACT_UUID}.zip')
+        with open(bundle_path, mode='wb') as bundle_out:
+            for _ in range(args.size):
+                bundle_out.write(os.urandom(1024**2))
+
+        app.config['OUTPUT_DIR'] = output_dir
+        app.add_url_rule('/benchmark/<uuid:extract_uuid>/fetch',
+                         view_func=legacy_download)
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+        # Resume the second half of the download
+        offset = bundle_path.stat().st_size // 2
+        received = fetch(f'{base_url}/extracts/{EXTRACT_UUID}/fetch',
+                         headers={'Range': f'bytes={offset}-'})
+        print(f'Resumed download received {received} of {offset} bytes expected')
+
+        for mode, path in [
+            ('send_from_directory', '/benchmark'),
+            ('app', '/extracts'),
+            ('x-accel-redirect', '/extracts'),
+        ]:
+            app.config['DOWNLOAD_OFFLOAD'] = mode if mode == 'x-accel-redirect' else ''
+            for n_clients in args.clients:
+                wall_time, received = run_clients(
+                    f'{base_url}{path}/{EXTRACT_UUID}/fetch', n_clients, args.requests)
+                n_downloads = n_clients * args.requests
+                print(f'{mode}: {n_clients} clients - {n_downloads} downloads in '
+                      f'{wall_time:.2f}s, {received / 1024**2 / wall_time:.0f} MB/s, '
+                      f'{wall_time / n_downloads * n_clients * 1000:.1f}ms '
+                      f'per download per worker')
+
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
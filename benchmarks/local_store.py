@@ -0,0 +1,74 @@
+"""Benchmark lookups in the local on-disk Tweet store.
+
+Usage::
+
+    python -m benchmarks.local_store [-n N] [--batch-size B] [--path FILE]
+
+Fills a store with N encoded synthetic Tweets then reports the rate of
+keyed lookups for batches of IDs of which half are present in the store.
+"""
+
+import argparse
+import itertools
+import pathlib
+import random
+import tempfile
+import time
+
+from wdra_extender.extract.cache_codec import CacheCodec, build_dictionary
+from wdra_extender.extract.local_store import LocalTweetStore
+
+from .synthetic import make_tweets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=1000000,
+                        help='Number of Tweets in the store')
+    parser.add_argument('--lookups', type=int, default=200000,
+                        help='Number of IDs to look up')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Number of IDs per lookup request')
+    parser.add_argument('--path', type=pathlib.Path,
+                        help='Store file to use - temporary if not given')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.path or pathlib.Path(tmp_dir).joinpath('tweets.sqlite3')
+        store = LocalTweetStore(path, max_bytes=2**62)
+
+        # Encoding a million distinct Tweets dominates the set-up time,
+        # so reuse a pool of encoded Tweets under different IDs
+        templates = list(make_tweets(1000))
+        codec = CacheCodec('json+zlib', dictionary=build_dictionary(templates))
+        values = [codec.encode(tweet) for tweet in templates]
+
+        start = time.perf_counter()
+        store.put_many((i, values[i % len(values)]) for i in range(args.n))
+        fill_time = time.perf_counter() - start
+        print(f'Filled {args.n} Tweets in {fill_time:.1f}s '
+              f'({args.n / fill_time:.0f}/s, {store.used_bytes() / 2**20:.0f} MiB)')
+
+        rand = random.Random(0)
+        ids = [rand.randrange(2 * args.n) for _ in range(args.lookups)]
+
+        start = time.perf_counter()
+        found = 0
+        for batch_start in range(0, len(ids), args.batch_size):
+            batch = ids[batch_start:batch_start + args.batch_size]
+            found += sum(1 for _ in store.get_many(batch))
+        lookup_time = time.perf_counter() - start
+
+        print(f'Looked up {len(ids)} IDs in batches of {args.batch_size}: '
+              f'{len(ids) / lookup_time:.0f} lookups/s, {found} found')
+
+        start = time.perf_counter()
+        for tweet_id, value in itertools.islice(store.get_many(ids), 10000):
+            codec.decode(value)
+        decode_time = time.perf_counter() - start
+        print(f'Lookup and decode: {10000 / decode_time:.0f} Tweets/s')
+        print(store.stats())
+
+
+if __name__ == '__main__':
+    main()
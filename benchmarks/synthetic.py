@@ -0,0 +1,129 @@
+"""Generate synthetic Tweets resembling Twitter API v1.1 extended Tweets."""
+
+import json
+import pathlib
+import random
+import typing
+
+WORDS = ('the data research twitter science social network analysis web '
+         'archive history people university open public policy health '
+         'climate election news media story today week great new').split()
+
+MONTHS = 'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split()
+DAYS = 'Mon Tue Wed Thu Fri Sat Sun'.split()
+
+
+def _created_at(rand: random.Random) -> str:
+    return (f'{rand.choice(DAYS)} {rand.choice(MONTHS)} '
+            f'{rand.randint(1, 28):02d} {rand.randint(0, 23):02d}:'
+            f'{rand.randint(0, 59):02d}:{rand.randint(0, 59):02d} +0000 '
+            f'{rand.randint(2010, 2020)}')
+
+
+def make_user(user_id: int, rand: random.Random) -> typing.Dict:
+    """Make a synthetic user object."""
+    return {
+        'id': user_id,
+        'id_str': str(user_id),
+        'name': f'User {user_id}',
+        'screen_name': f'user{user_id}',
+        'location': rand.choice(['London', 'Southampton', '', 'Paris']),
+        'description': ' '.join(rand.choices(WORDS, k=12)),
+        'url': None,
+        'entities': {'description': {'urls': []}},
+        'protected': False,
+        'followers_count': rand.randint(0, 100000),
+        'friends_count': rand.randint(0, 5000),
+        'listed_count': rand.randint(0, 100),
+        'created_at': _created_at(rand),
+        'favourites_count': rand.randint(0, 10000),
+        'verified': False,
+        'statuses_count': rand.randint(0, 100000),
+        'lang': None,
+        'profile_image_url_https':
+        f'https://pbs.twimg.com/profile_images/{user_id}/photo_normal.jpg',
+        'default_profile': True,
+    }
+
+
+def make_tweet(tweet_id: int, rand: random.Random,
+               n_users: int = 1000,
+               retweet: typing.Optional[bool] = None) -> typing.Dict:
+    """Make a synthetic Tweet, possibly a retweet of another synthetic Tweet."""
+    if retweet is None:
+        retweet = rand.random() < 0.4
+
+    user = make_user(rand.randrange(n_users), rand)
+    mentions = [
+        make_user(rand.randrange(n_users), rand)
+        for _ in range(rand.randint(0, 2))
+    ]
+    hashtags = rand.sample(WORDS, rand.randint(0, 2))
+    text = ' '.join(rand.choices(WORDS, k=rand.randint(5, 30)))
+    text = ' '.join([f'@{m["screen_name"]}' for m in mentions] + [text] +
+                    [f'#{h}' for h in hashtags])
+
+    tweet = {
+        'created_at': _created_at(rand),
+        'id': tweet_id,
+        'id_str': str(tweet_id),
+        'full_text': text,
+        'truncated': False,
+        'display_text_range': [0, len(text)],
+        'entities': {
+            'hashtags': [{'text': h, 'indices': [0, 0]} for h in hashtags],
+            'symbols': [],
+            'user_mentions': [{
+                'screen_name': m['screen_name'],
+                'name': m['name'],
+                'id': m['id'],
+                'id_str': m['id_str'],
+                'indices': [0, 0],
+            } for m in mentions],
+            'urls': [],
+        },
+        'source': '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>',
+        'in_reply_to_status_id': None,
+        'in_reply_to_user_id': None,
+        'in_reply_to_screen_name': None,
+        'user': user,
+        'geo': None,
+        'coordinates': None,
+        'place': None,
+        'is_quote_status': False,
+        'retweet_count': rand.randint(0, 100),
+        'favorite_count': rand.randint(0, 100),
+        'favorited': False,
+        'retweeted': False,
+        'lang': 'en',
+    }
+
+    if retweet:
+        original = make_tweet(tweet_id + 10**15, rand, n_users, retweet=False)
+        tweet['retweeted_status'] = original
+        tweet['full_text'] = f'RT @{original["user"]["screen_name"]}: ' + original['full_text']
+
+    return tweet
+
+
+def make_tweets(n_tweets: int, seed: int = 0,
+                n_users: int = 1000) -> typing.Iterator[typing.Dict]:
+    """Generate a reproducible stream of synthetic Tweets."""
+    rand = random.Random(seed)
+    for tweet_id in range(1, n_tweets + 1):
+        yield make_tweet(tweet_id, rand, n_users)
+
+
+def load_tweets(path: pathlib.Path) -> typing.Iterator[typing.Dict]:
+    """Load Tweets from a JSON array or newline-delimited JSON file."""
+    with open(path, encoding='utf-8') as tweets_in:
+        first = tweets_in.read(1)
+        tweets_in.seek(0)
+
+        if first == '[':
+            yield from json.load(tweets_in)
+
+        else:
+            for line in tweets_in:
+                if line.strip():
+                    yield json.loads(line)
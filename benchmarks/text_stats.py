@@ -0,0 +1,183 @@
+"""Benchmark the native text statistics engine against the DOTEXTTABLE script.
+
+Usage::
+
+    python -m benchmarks.text_stats [-n N [N ...]] [--workers W] [--skip-shell]
+
+For each number of Tweets, writes a JSON array of synthetic Tweets with
+varied text, then times ``main.sh``, the native engine and the native engine
+mapping shards of the Tweets in ``W`` processes, and checks that their
+``language.csv`` files are identical.  The text passed to the word cloud is
+timed and compared in the same way.
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import random
+import subprocess
+import tempfile
+import time
+
+from wdra_extender.app import app
+from wdra_extender.extract.mapreduce import map_shards
+from wdra_extender.extract.text_stats import (TextStats, TextTablePlugin,
+                                              write_language_table)
+from wdra_extender.extract.tweet_store import TweetView, iter_tweets_file, write_ndjson
+
+from .synthetic import WORDS, make_tweets
+
+PLUGIN_DIR = pathlib.Path(__file__).resolve().parents[1].joinpath('plugins')
+TEXT_DIR = PLUGIN_DIR.joinpath('DOTEXTTABLE')
+CLOUD_DIR = PLUGIN_DIR.joinpath('DOWORDCLOUD')
+
+#: Extra words so that many words appear only once
+EXTRA_WORDS = [f'word{i}' for i in range(5000)] + [
+    'Data', 'RESEARCH', "isn't", 'café', 'naïve', 'data,', 'science!', '...'
+]
+
+
+def write_inputs(n_tweets: int, dir_path: pathlib.Path) -> None:
+    """Write the Tweets file for a benchmark run."""
+    rand = random.Random(0)
+    with open(dir_path.joinpath('tweets.json'), mode='w',
+              encoding='utf-8') as tweets_out:
+        tweets_out.write('[')
+        for i, tweet in enumerate(make_tweets(n_tweets)):
+            original = tweet.get('retweeted_status', tweet)
+            words = rand.choices(EXTRA_WORDS, k=rand.randint(0, 8))
+            if rand.random() < 0.3:
+                words.append(f'https://t.co/{rand.getrandbits(40):x}')
+            if rand.random() < 0.2:
+                words.append(f'#{rand.choice(WORDS).title()}')
+                original['entities']['hashtags'].append(
+                    {'text': words[-1][1:], 'indices': [0, 0]})
+
+            original['full_text'] += ' ' + ' '.join(words)
+            if i:
+                tweets_out.write(',')
+            json.dump(tweet, tweets_out, ensure_ascii=False)
+
+        tweets_out.write(']')
+
+
+def run_shell(dir_path: pathlib.Path, work_dir: pathlib.Path) -> float:
+    """Run the DOTEXTTABLE script and return its wall time."""
+    env = os.environ.copy()
+    env.update({'BIN': str(TEXT_DIR), 'LC_ALL': 'C.UTF-8'})
+
+    start = time.perf_counter()
+    subprocess.run(['sh', TEXT_DIR.joinpath('main.sh'),
+                    dir_path.joinpath('tweets.json')],
+                   cwd=work_dir,
+                   env=env,
+                   check=True)
+    return time.perf_counter() - start
+
+
+def run_shell_cloud(dir_path: pathlib.Path) -> (float, str):
+    """Prepare the word cloud text as the DOWORDCLOUD script does."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        f"jq -r -M -f {CLOUD_DIR}/sanitised.jq {dir_path.joinpath('tweets.json')}"
+        " | tr -cd '\t-~' | sed -e 's/[^A-Za-z0-9 ]/ /'",
+        shell=True,
+        env=dict(os.environ, LC_ALL='C.UTF-8'),
+        capture_output=True,
+        check=True)
+    return time.perf_counter() - start, proc.stdout.decode()
+
+
+def run_native(tweets, work_dir: pathlib.Path) -> float:
+    """Run the native engine and return its wall time."""
+    start = time.perf_counter()
+    stats = TextStats()
+    stats.update(tweets)
+    write_language_table(stats, work_dir, TEXT_DIR)
+    return time.perf_counter() - start
+
+
+def run_sharded(dir_path: pathlib.Path, work_dir: pathlib.Path,
+                workers: int) -> float:
+    """Run the native engine on shards of the Tweets and return its wall time."""
+    ndjson_path = dir_path.joinpath('tweets.jsonl')
+    write_ndjson(iter_tweets_file(dir_path.joinpath('tweets.json')), ndjson_path)
+
+    start = time.perf_counter()
+    with app.app_context():
+        partials = map_shards(TextTablePlugin.map_shard,
+                              TweetView(ndjson_path),
+                              max_workers=workers,
+                              min_shard_bytes=1024**2)
+        write_language_table(TextTablePlugin.reduce(partials), work_dir,
+                             TEXT_DIR)
+
+    return time.perf_counter() - start
+
+
+def same_table(left: pathlib.Path, right: pathlib.Path) -> bool:
+    return (left.joinpath('language.csv').read_bytes() ==
+            right.joinpath('language.csv').read_bytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='Numbers of Tweets to benchmark')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of processes in which to map shards')
+    parser.add_argument('--skip-shell', action='store_true',
+                        help='Only run the native engine')
+    args = parser.parse_args()
+
+    for n_tweets in args.n:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dir_path = pathlib.Path(tmp_dir)
+            write_inputs(n_tweets, dir_path)
+            native_dir = dir_path.joinpath('native')
+            native_dir.mkdir()
+
+            native_time = run_native(
+                iter_tweets_file(dir_path.joinpath('tweets.json')), native_dir)
+            print(f'{n_tweets} Tweets: native {native_time:.2f}s '
+                  f'(parsing tweets.json included)')
+
+            tweets = list(iter_tweets_file(dir_path.joinpath('tweets.json')))
+            parsed_time = run_native(tweets, native_dir)
+            print(f'{n_tweets} Tweets: native {parsed_time:.2f}s '
+                  f'(already parsed, as for an in-process plugin)')
+
+            start = time.perf_counter()
+            cloud = TextStats(hashtags=False, words=False, cloud=True)
+            cloud.update(tweets)
+            cloud_time = time.perf_counter() - start
+            del tweets
+
+            sharded_dir = dir_path.joinpath('sharded')
+            sharded_dir.mkdir()
+            sharded_time = run_sharded(dir_path, sharded_dir, args.workers)
+            print(f'{n_tweets} Tweets: sharded in {args.workers} processes '
+                  f'{sharded_time:.2f}s (parsing tweets.jsonl included), '
+                  f'same output {same_table(native_dir, sharded_dir)}')
+
+            if args.skip_shell:
+                continue
+
+            shell_dir = dir_path.joinpath('shell')
+            shell_dir.mkdir()
+            shell_time = run_shell(dir_path, shell_dir)
+            print(f'{n_tweets} Tweets: main.sh {shell_time:.2f}s, '
+                  f'speed-up {shell_time / native_time:.1f}x '
+                  f'({shell_time / parsed_time:.1f}x already parsed), '
+                  f'same output {same_table(native_dir, shell_dir)}')
+
+            shell_cloud_time, shell_text = run_shell_cloud(dir_path)
+            print(f'{n_tweets} Tweets: word cloud text {cloud_time:.2f}s '
+                  f'already parsed, shell {shell_cloud_time:.2f}s, '
+                  f'same output {shell_text == cloud.text()}')
+
+
+if __name__ == '__main__':
+    main()
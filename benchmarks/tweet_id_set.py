@@ -0,0 +1,72 @@
+"""Benchmark the compact Tweet ID set against a Python set of ints.
+
+Usage::
+
+    python -m benchmarks.tweet_id_set [-n N [N ...]] [--providers P]
+
+For each number of Tweet IDs, measures the memory used by the set of IDs
+still to be found, and the time taken to build it and to remove the IDs
+found by each of ``P`` providers - each finding half of those remaining -
+as `iter_tweets` does.
+"""
+
+import argparse
+import array
+import random
+import time
+import tracemalloc
+
+from wdra_extender.extract.tweet_ids import TYPECODE, TweetIdSet
+
+#: Smallest Tweet ID of the synthetic IDs - roughly those of 2020
+FIRST_ID = 1212000000000000000
+
+
+def make_ids(n_ids: int) -> array.array:
+    rand = random.Random(0)
+    return array.array(TYPECODE, (FIRST_ID + rand.getrandbits(56) for _ in range(n_ids)))
+
+
+def run(kind, tweet_ids: array.array, n_providers: int) -> (float, float, int):
+    """Build a set of Tweet IDs then remove the IDs found by each provider.
+
+    :return: Time to build the set, time to remove found IDs and peak memory used.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    remaining = kind(tweet_ids)
+    build_time = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+
+    remove_time = 0.0
+    for _ in range(n_providers):
+        # Found Tweets arrive one at a time from the provider
+        found = array.array(TYPECODE, list(remaining)[::2])
+
+        start = time.perf_counter()
+        remaining -= kind(found)
+        remove_time += time.perf_counter() - start
+
+    tracemalloc.stop()
+    return build_time, remove_time, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, nargs='+',
+                        default=[1000000, 3000000, 10000000],
+                        help='Numbers of Tweet IDs to benchmark')
+    parser.add_argument('--providers', type=int, default=3,
+                        help='Number of providers each finding half of the remaining Tweets')
+    args = parser.parse_args()
+
+    for n_ids in args.n:
+        tweet_ids = make_ids(n_ids)
+        for name, kind in [('set', set), ('TweetIdSet', TweetIdSet)]:
+            build_time, remove_time, size = run(kind, tweet_ids, args.providers)
+            print(f'{n_ids} IDs: {name} {size / n_ids:.1f} bytes per ID, '
+                  f'build {build_time:.2f}s, remove found {remove_time:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,8 @@ EDGES=/tmp/net.$$
 D3NODES=/tmp/nodes.$$
 D3EDGES=/tmp/edges.$$
 ACTIV=/tmp/pass.$$
+CACHED=/tmp/cached.$$
+MISSING=/tmp/missing.$$
 
 PRE=$BIN/network_pre.htx
 POST=$BIN/network_post.htx
@@ -70,7 +72,21 @@ echo "Account	Author	Author+Retweets	Mentions	Mentions+Retweets	Name	Description
 # but not for the non-authors. So we're getting all the data for all the accounts from scratch
 # using twarc.
 
-  test -f 00USERS.json && cat 00USERS.json>$UJS || twarc --config $BIN/TWARC.config --log $BIN/TWARC.log users $OUT0 > $UJS
+# WDRAX passes the users it already knows about in $USERS_CACHE (one JSON object per line)
+# so we only need to ask twarc for the rest
+# Screen names are not case sensitive and mentions often differ in case from the user's
+# own screen name, so compare them in lower case or cached users are looked up again
+  if test -f 00USERS.json; then
+    cat 00USERS.json > $UJS
+  elif test -n "$USERS_CACHE" && test -f "$USERS_CACHE"; then
+    jq -r '.screen_name' $USERS_CACHE | tr A-Z a-z | sort -u > $CACHED
+    tr A-Z a-z < $OUT0 | sort -u | join -v 1 - $CACHED > $MISSING
+    cat $USERS_CACHE > $UJS
+    test -s $MISSING && twarc --config $BIN/TWARC.config --log $BIN/TWARC.log users $MISSING >> $UJS
+    rm -f $CACHED $MISSING
+  else
+    twarc --config $BIN/TWARC.config --log $BIN/TWARC.log users $OUT0 > $UJS
+  fi
   jq -r -f $BIN/users.jq $UJS | sed -e 's/"/``/g' | sort > $TABR
 
 # now $TABR contains all the extra data for each account to be pasted onto the original $TABL
@@ -0,0 +1,6 @@
+"""In-process DOACCOUNTSTABLE plugin.
+
+This produces the same files as ``main.sh``, which is kept for reference.
+"""
+
+from wdra_extender.extract.accounts_table import AccountsTablePlugin  # pylint: disable=unused-import
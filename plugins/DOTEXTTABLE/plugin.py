@@ -0,0 +1,6 @@
+"""In-process DOTEXTTABLE plugin.
+
+This produces the same files as ``main.sh``, which is kept for reference.
+"""
+
+from wdra_extender.extract.text_stats import TextTablePlugin  # pylint: disable=unused-import
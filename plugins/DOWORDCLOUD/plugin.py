@@ -0,0 +1,7 @@
+"""In-process DOWORDCLOUD plugin.
+
+This produces a word cloud from the same word frequencies as ``main.sh``,
+which is kept for reference.
+"""
+
+from wdra_extender.extract.text_stats import WordCloudPlugin  # pylint: disable=unused-import
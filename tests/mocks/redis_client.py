@@ -0,0 +1,97 @@
+"""In-memory fake of the parts of the Redis client used by the Tweet cache."""
+
+import threading
+import time
+import typing
+
+
+class FakeRedis:
+    """Minimal thread-safe Redis client storing values in a dictionary.
+
+    Supports the string commands used by the cache code, with expiry, and
+    non-transactional pipelines of them.
+    """
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.RLock()
+
+        #: Source of the current time in seconds - may be replaced to expire keys in tests
+        self.clock = time.monotonic
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _expire(self, key: str) -> None:
+        if key in self.expires and self.expires[key] <= self.clock():
+            del self.data[key]
+            del self.expires[key]
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        with self.lock:
+            self._expire(key)
+            return self.data.get(key)
+
+    def mget(self, keys: typing.Iterable[str]) -> typing.List[typing.Optional[bytes]]:
+        with self.lock:
+            return [self.get(key) for key in keys]
+
+    def exists(self, *keys: str) -> int:
+        with self.lock:
+            return sum(1 for key in keys if self.get(key) is not None)
+
+    def set(self, key: str, value, nx: bool = False, px: typing.Optional[int] = None):
+        with self.lock:
+            self._expire(key)
+            if nx and key in self.data:
+                return None
+
+            self.data[key] = self._encode(value)
+            self.expires.pop(key, None)
+            if px is not None:
+                self.expires[key] = self.clock() + px / 1000
+
+            return True
+
+    def setex(self, key: str, seconds, value):
+        return self.set(key, value, px=int(seconds * 1000)
+                        if isinstance(seconds, (int, float))
+                        else int(seconds.total_seconds() * 1000))
+
+    def delete(self, *keys: str) -> int:
+        with self.lock:
+            deleted = 0
+            for key in keys:
+                self._expire(key)
+                if key in self.data:
+                    del self.data[key]
+                    self.expires.pop(key, None)
+                    deleted += 1
+
+            return deleted
+
+    def pipeline(self, transaction: bool = True) -> 'FakePipeline':
+        # pylint: disable=unused-argument
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Queue of commands executed together against a :class:`FakeRedis`."""
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name: str):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self) -> typing.List:
+        commands, self.commands = self.commands, []
+        return [
+            getattr(self.client, name)(*args, **kwargs)
+            for name, args, kwargs in commands
+        ]
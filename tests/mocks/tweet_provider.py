@@ -14,7 +14,9 @@ TEST_TWEETS = [
 
 
 def tweet_provider(
-    tweet_ids: typing.Iterable[int]
-) -> typing.Tuple[typing.List[int], typing.List[typing.Mapping]]:
-    """Mock tweet provider which just returns a static response."""
-    return (TEST_TWEET_IDS, TEST_TWEETS)
+        tweet_ids: typing.Iterable[int]) -> typing.Iterator[typing.Mapping]:
+    """Mock tweet provider which yields the requested Tweets from a static set."""
+    tweet_ids = set(tweet_ids)
+    for tweet in TEST_TWEETS:
+        if tweet['id'] in tweet_ids:
+            yield tweet
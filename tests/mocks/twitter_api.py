@@ -0,0 +1,100 @@
+"""Fake Twitter API Tweet lookup endpoint for testing hydration."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+import typing
+import urllib.parse
+
+
+class FakeTwitterApi:
+    """Local HTTP server implementing the Tweet lookup endpoint.
+
+    Each access token has a quota of lookups per window, after which it is
+    refused with status 429 until the window resets.  Unknown tokens are
+    refused with status 401 and deleted Tweets are left out of responses.
+
+    :param quotas: Mapping of access token to number of lookups per window.
+    :param window: Seconds until the quota of each token resets.
+    :param deleted: Tweet IDs which are not returned.
+    """
+    def __init__(self,
+                 quotas: typing.Mapping[str, int],
+                 window: float = 60,
+                 deleted: typing.Collection[int] = (),
+                 delay: float = 0):
+        self.quotas = dict(quotas)
+        self.window = window
+        self.deleted = set(deleted)
+        self.delay = delay
+        self.used = {token: 0 for token in quotas}
+        self.resets = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):  # pylint: disable=invalid-name
+                length = int(self.headers['Content-Length'])
+                form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+                match = re.search(r'oauth_token="([^"]*)"',
+                                  self.headers.get('Authorization', ''))
+                token = urllib.parse.unquote(match.group(1)) if match else None
+                ids = [int(i) for i in form['id'][0].split(',')]
+
+                status, headers, body = api.lookup(token, ids)
+                time.sleep(api.delay)
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(body).encode())
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/1.1/statuses/lookup.json'
+
+    def lookup(self, token: str, ids: typing.List[int]):
+        with self.lock:
+            if token not in self.quotas:
+                return 401, {}, {'errors': [{'code': 89}]}
+
+            now = time.time()
+            if self.resets.get(token, 0) <= now:
+                self.resets[token] = now + self.window
+                self.used[token] = 0
+
+            headers = {
+                'x-rate-limit-limit': str(self.quotas[token]),
+                'x-rate-limit-reset': str(self.resets[token]),
+            }
+            if self.used[token] >= self.quotas[token]:
+                headers['x-rate-limit-remaining'] = '0'
+                return 429, headers, {'errors': [{'code': 88}]}
+
+            self.used[token] += 1
+            self.requests.append((token, ids))
+            headers['x-rate-limit-remaining'] = str(self.quotas[token] - self.used[token])
+
+        return 200, headers, [{
+            'id': i,
+            'id_str': str(i),
+            'full_text': f'Tweet {i}'
+        } for i in ids if i not in self.deleted]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever,
+                         kwargs={'poll_interval': 0.05},
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,188 @@
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from wdra_extender.extract import accounts_table
+
+BIN_DIR = pathlib.Path(__file__).resolve().parents[1].joinpath(
+    'plugins', 'DOACCOUNTSTABLE')
+
+
+def has_mawk():
+    """Is awk mawk, as on Debian, whose number formatting the engine matches?"""
+    try:
+        proc = subprocess.run(['awk', '-W', 'version'],
+                              capture_output=True,
+                              text=True,
+                              check=False)
+
+    except FileNotFoundError:
+        return False
+
+    return proc.stdout.startswith('mawk')
+
+
+def make_user(screen_name, followers=10, description='A user'):
+    return {
+        'id': sum(map(ord, screen_name)),
+        'id_str': str(sum(map(ord, screen_name))),
+        'screen_name': screen_name,
+        'name': screen_name.title(),
+        'description': description,
+        'location': 'Southampton',
+        'followers_count': followers,
+        'friends_count': 5,
+        'statuses_count': 100,
+        'created_at': 'Wed Oct 10 20:19:24 +0000 2018',
+    }
+
+
+def make_tweet(user, mentions=(), reply_to=None, retweets=0, favorites=0):
+    return {
+        'user': user,
+        'in_reply_to_screen_name': reply_to,
+        'entities': {
+            'user_mentions': [{'screen_name': m} for m in mentions]
+        },
+        'retweet_count': retweets,
+        'favorite_count': favorites,
+    }
+
+
+USERS = [
+    make_user('alice', followers=2**31),
+    make_user('bob', description='Says "hello"\tand\nwaves \\o/'),
+    make_user('carol'),
+]
+
+TWEETS = [
+    make_tweet(USERS[0], mentions=['bob', 'carol'], retweets=3),
+    make_tweet(USERS[1], mentions=['alice', 'bob'], reply_to='alice'),
+    # Retweets are attributed to the original author
+    {'user': USERS[2], 'retweeted_status': make_tweet(
+        USERS[0], mentions=['dave'], retweets=2**31, favorites=1)},
+    # All-digit screen names are excluded from the table but not the edges
+    make_tweet(USERS[2], mentions=['12345', '0123', '123']),
+    make_tweet(USERS[1], retweets=None, favorites=None),
+]
+
+
+class AccountsTableTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self._dir.name)
+
+        self.users_cache = self.dir_path.joinpath('users.jsonl')
+        with open(self.users_cache, 'w', encoding='utf-8') as users_out:
+            for user in USERS:
+                users_out.write(json.dumps(user) + '\n')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def run_native(self, lookup=lambda names: [], tweets=TWEETS):
+        work_dir = self.dir_path.joinpath('native')
+        work_dir.mkdir()
+        accounts_table.write_accounts_table(tweets,
+                                            work_dir,
+                                            BIN_DIR,
+                                            users_cache=self.users_cache,
+                                            lookup=lookup)
+        return work_dir
+
+    def test_accounts(self):
+        work_dir = self.run_native()
+        rows = work_dir.joinpath('accounts.csv').read_text().splitlines()
+
+        self.assertEqual(accounts_table.ACCOUNTS_HEADER, rows[0])
+        self.assertEqual(['alice', '2', '2.14748e+09', '1', '1'],
+                         rows[1].split('\t')[:5])
+        self.assertIn('Says ``hello``\\tand\\nwaves \\\\o/', rows[2])
+        # Unknown users are padded
+        self.assertEqual('dave\t\t\t1\t2.14748e+09' + '\t-' * 8, rows[4])
+        self.assertNotIn('12345', work_dir.joinpath('accounts.csv').read_text())
+
+    def test_edges(self):
+        work_dir = self.run_native()
+
+        self.assertEqual([
+            'Source,Target,Weight',
+            'alice,bob,1',
+            'alice,carol,1',
+            'alice,dave,1',
+            'bob,alice,1',
+            'carol,0123,1',
+            'carol,123,1',
+            'carol,12345,1',
+        ], work_dir.joinpath('edges.csv').read_text().splitlines())
+
+    def test_lookup_missing_users(self):
+        looked_up = []
+
+        def lookup(names):
+            looked_up.extend(names)
+            return [make_user('dave')]
+
+        work_dir = self.run_native(lookup=lookup)
+        users = work_dir.joinpath('00USERS.json').read_text().splitlines()
+
+        self.assertEqual(['dave'], looked_up)
+        self.assertEqual(len(USERS) + 1, len(users))
+        self.assertEqual('dave', json.loads(users[-1])['screen_name'])
+
+    def test_cached_users_ignore_case(self):
+        looked_up = []
+
+        def lookup(names):
+            looked_up.extend(names)
+            return [make_user('dave')]
+
+        users_path = self.dir_path.joinpath('00USERS.json')
+        users = accounts_table.write_users(users_path, ['ALICE', 'Bob', 'Dave', 'dave'],
+                                           self.users_cache, lookup)
+
+        # Each account is looked up once, however it was written
+        self.assertEqual(['dave'], looked_up)
+        self.assertEqual(len(USERS) + 1, len(users))
+
+    def assert_matches_shell_plugin(self, tweets):
+        tweets_file = self.dir_path.joinpath('tweets.json')
+        tweets_file.write_text(json.dumps(tweets))
+
+        # Stand in for twarc so missing users are not looked up
+        fake_bin = self.dir_path.joinpath('bin')
+        fake_bin.mkdir()
+        fake_bin.joinpath('twarc').write_text('#!/bin/sh\nexit 0\n')
+        fake_bin.joinpath('twarc').chmod(0o755)
+
+        shell_dir = self.dir_path.joinpath('shell')
+        shell_dir.mkdir()
+        env = os.environ.copy()
+        env.update({
+            'BIN': str(BIN_DIR),
+            'USERS_CACHE': str(self.users_cache),
+            'PATH': f'{fake_bin}{os.pathsep}{env["PATH"]}',
+        })
+        subprocess.run(['sh', BIN_DIR.joinpath('main.sh'), tweets_file],
+                       cwd=shell_dir,
+                       env=env,
+                       check=True)
+
+        work_dir = self.run_native(tweets=tweets)
+        for path in sorted(shell_dir.iterdir()):
+            with self.subTest(path.name):
+                self.assertEqual(path.read_bytes(),
+                                 work_dir.joinpath(path.name).read_bytes())
+
+    @unittest.skipUnless(shutil.which('jq') and has_mawk(), 'requires jq and mawk')
+    def test_matches_shell_plugin(self):
+        self.assert_matches_shell_plugin(TWEETS)
+
+    @unittest.skipUnless(shutil.which('jq') and has_mawk(), 'requires jq and mawk')
+    def test_matches_shell_plugin_mixed_case(self):
+        self.assert_matches_shell_plugin(
+            TWEETS + [make_tweet(USERS[0], mentions=['Bob', 'CAROL', 'Dave'])])
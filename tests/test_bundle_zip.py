@@ -0,0 +1,102 @@
+import pathlib
+import tempfile
+import unittest
+import zipfile
+
+from wdra_extender.app import app
+from wdra_extender.extract import bundle_zip, plugins, scheduler
+from .test_output_cache import writing_plugin
+
+
+class StreamingZipWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self.tmp_dir.name)
+        self.src_dir = self.dir_path.joinpath('src')
+        self.src_dir.joinpath('sub').mkdir(parents=True)
+        self.src_dir.joinpath('a.csv').write_text('a,b\n' * 1000)
+        self.src_dir.joinpath('sub', 'b.PNG').write_bytes(b'\x89PNG' * 1000)
+        self.zip_path = self.dir_path.joinpath('bundle.zip')
+        self.compression = bundle_zip.parse_compression('.png:store,*:deflate:9')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_compression(self):
+        self.assertEqual(
+            {
+                '.png': bundle_zip.Compression(zipfile.ZIP_STORED),
+                '*': bundle_zip.Compression(zipfile.ZIP_DEFLATED, 9),
+            }, self.compression)
+
+        for spec in ['.png', '.png:gzip', '.png:deflate:1:2', '.png:deflate:x']:
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                bundle_zip.parse_compression(spec)
+
+    def test_compression_by_type(self):
+        with bundle_zip.StreamingZipWriter(self.zip_path, self.compression) as writer:
+            writer.add_files(self.src_dir, ['a.csv'])
+            writer.add_directory(self.src_dir)
+
+        with zipfile.ZipFile(self.zip_path) as zip_file:
+            self.assertEqual(['a.csv', 'sub/b.PNG'], zip_file.namelist())
+            self.assertEqual(zipfile.ZIP_DEFLATED,
+                             zip_file.getinfo('a.csv').compress_type)
+            self.assertEqual(zipfile.ZIP_STORED,
+                             zip_file.getinfo('sub/b.PNG').compress_type)
+            self.assertEqual('a,b\n' * 1000, zip_file.read('a.csv').decode())
+
+        self.assertEqual([self.zip_path], list(self.dir_path.glob('bundle.zip*')))
+
+    def test_failure_keeps_existing_zip(self):
+        self.zip_path.write_bytes(b'old')
+
+        with self.assertRaises(KeyError):
+            with bundle_zip.StreamingZipWriter(self.zip_path) as writer:
+                writer.add_directory(self.src_dir)
+                raise KeyError
+
+        with self.assertRaises(FileNotFoundError):
+            with bundle_zip.StreamingZipWriter(self.zip_path) as writer:
+                writer.add(self.src_dir.joinpath('missing'), 'missing')
+
+        self.assertEqual(b'old', self.zip_path.read_bytes())
+        self.assertEqual([self.zip_path], list(self.dir_path.glob('bundle.zip*')))
+
+
+class StreamedSchedulerTest(unittest.TestCase):
+    def test_output_released_after_dependents(self):
+        calls = []
+        released = []
+        plugin_map = {
+            pathlib.Path('A'): writing_plugin(calls, 'A', reads='B.txt'),
+            pathlib.Path('B'): writing_plugin(calls, 'B'),
+            pathlib.Path('C'): writing_plugin(calls, 'C'),
+        }
+        manifests = {
+            pathlib.Path('A'): plugins.PluginManifest('A', depends=('B', )),
+            pathlib.Path('C'): plugins.PluginManifest('C', max_parallel=1),
+        }
+
+        def on_output(name, files):
+            released.append((name, files, sorted(calls)))
+
+        with tempfile.TemporaryDirectory() as tmp_dir, app.app_context():
+            work_dir = pathlib.Path(tmp_dir)
+            results = scheduler.PluginScheduler(plugin_map,
+                                                manifests,
+                                                max_workers=2,
+                                                on_output=on_output).run(
+                                                    None, work_dir)
+
+            self.assertEqual('AB', work_dir.joinpath('A.txt').read_text())
+            self.assertFalse(work_dir.joinpath(scheduler.PRIVATE_DIR).exists())
+
+        self.assertEqual(['ok', 'ok', 'ok'], [r.status for r in results])
+        self.assertEqual([None, None, None], [r.cache for r in results])
+        # B's output is only released once A, which reads it, has run
+        released = {name: (files, done) for name, files, done in released}
+        self.assertEqual(['B.txt'], released['B'][0])
+        self.assertIn('A', released['B'][1])
+        self.assertEqual(['A.txt'], released['A'][0])
+        self.assertEqual(['C.txt'], released['C'][0])
@@ -0,0 +1,62 @@
+import json
+import unittest
+
+from wdra_extender.extract import cache_codec
+from .mocks.tweet_provider import TEST_TWEETS
+
+TWEET = {
+    'id': 1,
+    'full_text': 'Hello World ☃',
+    'user': {'id': 2, 'screen_name': 'test'},
+    'entities': {'hashtags': []},
+}
+
+
+class CacheCodecTest(unittest.TestCase):
+    def assert_round_trip(self, codec):
+        self.assertEqual(TWEET, codec.decode(codec.encode(TWEET)))
+
+    def test_json_zlib(self):
+        self.assert_round_trip(cache_codec.CacheCodec('json+zlib'))
+
+    def test_json_none(self):
+        self.assert_round_trip(cache_codec.CacheCodec('json+none'))
+
+    @unittest.skipIf(cache_codec.zstandard is None, 'zstandard not installed')
+    def test_json_zstd(self):
+        self.assert_round_trip(cache_codec.CacheCodec('json+zstd'))
+
+    @unittest.skipIf(cache_codec.msgpack is None, 'msgpack not installed')
+    def test_msgpack_zlib(self):
+        self.assert_round_trip(cache_codec.CacheCodec('msgpack+zlib'))
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            cache_codec.CacheCodec('json+lzma')
+
+    def test_decode_legacy_json(self):
+        codec = cache_codec.CacheCodec('json+zlib')
+
+        self.assertEqual(TWEET, codec.decode(json.dumps(TWEET).encode()))
+
+    def test_decode_other_codec(self):
+        writer = cache_codec.CacheCodec('json+none')
+        reader = cache_codec.CacheCodec('json+zlib')
+
+        self.assertEqual(TWEET, reader.decode(writer.encode(TWEET)))
+
+    def test_dictionary(self):
+        dictionary = cache_codec.build_dictionary(TEST_TWEETS * 10)
+        codec = cache_codec.CacheCodec('json+zlib', dictionary=dictionary)
+
+        self.assert_round_trip(codec)
+        self.assertLess(len(codec.encode(TEST_TWEETS[0])),
+                        len(cache_codec.CacheCodec('json+zlib').encode(
+                            TEST_TWEETS[0])))
+
+    def test_unknown_dictionary(self):
+        writer = cache_codec.CacheCodec('json+zlib', dictionary=b'"id":')
+        reader = cache_codec.CacheCodec('json+zlib')
+
+        with self.assertRaises(cache_codec.CacheDecodeError):
+            reader.decode(writer.encode(TWEET))
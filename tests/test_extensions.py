@@ -0,0 +1,48 @@
+import unittest
+from unittest import mock
+
+import redis
+
+from wdra_extender import extensions
+from wdra_extender.app import app
+
+
+class FlaskRedisTest(unittest.TestCase):
+    def test_timed_records_latency(self):
+        redis_pool = extensions.FlaskRedis()
+
+        with redis_pool.timed('mget'):
+            pass
+
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            with redis_pool.timed('mget'):
+                raise redis.exceptions.ConnectionError
+
+        stats = redis_pool._stats['mget'].as_dict()
+        self.assertEqual(2, stats['count'])
+        self.assertEqual(1, stats['errors'])
+
+    def test_client_requires_init(self):
+        with self.assertRaises(RuntimeError):
+            extensions.FlaskRedis().client
+
+    def test_pool_counts_connections(self):
+        pool = extensions.CountingConnectionPool(max_connections=2)
+        pool.make_connection()
+        pool.make_connection()
+        self.assertEqual(2, pool.created_connections)
+
+        pool.reset()
+        self.assertEqual(0, pool.created_connections)
+
+
+class HealthTest(unittest.TestCase):
+    def test_status(self):
+        client = app.test_client()
+        for healthy, status_code in [(True, 200), (False, 503)]:
+            with mock.patch.object(extensions.redis_pool, 'health',
+                                   return_value={'healthy': healthy}):
+                response = client.get('/health')
+
+            self.assertEqual(status_code, response.status_code)
+            self.assertEqual({'redis': {'healthy': healthy}}, response.get_json())
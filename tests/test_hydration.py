@@ -0,0 +1,88 @@
+import collections
+import json
+import pathlib
+import tempfile
+import time
+import unittest
+
+from wdra_extender.app import app
+from wdra_extender.extract import hydration
+from .mocks.twitter_api import FakeTwitterApi
+
+
+def credentials(token: str) -> hydration.Credentials:
+    return hydration.Credentials('key', 'secret', token, f'{token}-secret')
+
+
+class HydratorTest(unittest.TestCase):
+    def hydrate(self, api, tokens, tweet_ids, concurrency=2):
+        hydrator = hydration.Hydrator([credentials(t) for t in tokens],
+                                      lookup_url=api.url,
+                                      concurrency=concurrency)
+        with app.app_context():
+            return list(hydrator.hydrate(tweet_ids))
+
+    def test_spreads_across_tokens(self):
+        with FakeTwitterApi({'a': 100, 'b': 100}, deleted={5, 250},
+                            delay=0.05) as api:
+            start = time.perf_counter()
+            tweets = self.hydrate(api, ['a', 'b'], range(1000))
+            duration = time.perf_counter() - start
+
+        self.assertEqual([i for i in range(1000) if i not in {5, 250}],
+                         [tweet['id'] for tweet in tweets])
+        used = collections.Counter(token for token, _ in api.requests)
+        self.assertEqual(10, sum(used.values()))
+        self.assertTrue(used['a'] and used['b'])
+        # Four lookups in progress at once rather than one
+        self.assertLess(duration, 10 * 0.05 * 0.75)
+
+    def test_reroutes_when_exhausted(self):
+        with FakeTwitterApi({'a': 2, 'b': 100}) as api:
+            tweets = self.hydrate(api, ['a', 'b', 'revoked'], range(2000))
+
+        self.assertEqual(2000, len(tweets))
+        used = collections.Counter(token for token, _ in api.requests)
+        self.assertEqual(20, sum(used.values()))
+        # The quota of a is respected and the revoked token is not retried
+        self.assertLessEqual(used['a'], 2)
+        self.assertNotIn('revoked', used)
+
+    def test_waits_for_reset(self):
+        with FakeTwitterApi({'a': 2}, window=0.5) as api:
+            start = time.perf_counter()
+            tweets = self.hydrate(api, ['a'], range(500), concurrency=1)
+            duration = time.perf_counter() - start
+
+        self.assertEqual(500, len(tweets))
+        self.assertEqual(5, len(api.requests))
+        # Two windows of two lookups each were exhausted
+        self.assertGreater(duration, 0.9)
+
+    def test_no_valid_credentials(self):
+        with FakeTwitterApi({'a': 2}) as api:
+            with self.assertRaises(ConnectionError):
+                self.hydrate(api, ['revoked'], range(10))
+
+            with self.assertRaises(ConnectionError):
+                self.hydrate(api, [], range(10))
+
+
+class GetCredentialsTest(unittest.TestCase):
+    def test_get_credentials(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = pathlib.Path(tmp_dir, 'credentials.json')
+            path.write_text(json.dumps([credentials('b')._asdict()]))
+            config = {
+                'TWITTER_CONSUMER_KEY': 'key',
+                'TWITTER_CONSUMER_SECRET': 'secret',
+                'TWITTER_ACCESS_TOKEN': 'a',
+                'TWITTER_ACCESS_TOKEN_SECRET': 'a-secret',
+                'TWITTER_CREDENTIALS_FILE': path,
+            }
+
+            self.assertEqual([credentials('a'), credentials('b')],
+                             hydration.get_credentials(config))
+
+            config['TWITTER_ACCESS_TOKEN'] = None
+            self.assertEqual([credentials('b')], hydration.get_credentials(config))
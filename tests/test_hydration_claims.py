@@ -0,0 +1,229 @@
+import collections
+import threading
+import time
+import typing
+import unittest
+from unittest import mock
+
+from wdra_extender import extensions
+from wdra_extender.app import app
+from wdra_extender.extract import hydration_claims, tweet_providers
+from .mocks.redis_client import FakeRedis
+
+PROVIDER = 'tests.test_hydration_claims.slow_provider'
+
+#: Tweet IDs requested from `slow_provider`, by thread
+requested = collections.defaultdict(list)
+
+#: Set once `slow_provider` has been called by any thread
+provider_called = threading.Event()
+
+DELETED_IDS = {7, 77}
+
+
+def slow_provider(tweet_ids: typing.Iterable[int]) -> typing.Iterator[typing.Mapping]:
+    """Tweet provider standing in for the Twitter API."""
+    tweet_ids = list(tweet_ids)
+    requested[threading.current_thread().name].extend(tweet_ids)
+    provider_called.set()
+    time.sleep(0.2)
+
+    for tweet_id in tweet_ids:
+        if tweet_id not in DELETED_IDS:
+            yield {'id': tweet_id, 'text': f'Tweet {tweet_id}'}
+
+
+class HydrationClaimsTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(extensions.FlaskRedis, 'client',
+                                    new_callable=mock.PropertyMock,
+                                    return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+        requested.clear()
+        provider_called.clear()
+
+    def test_claim_and_release(self):
+        first = hydration_claims.HydrationClaims(60)
+        second = hydration_claims.HydrationClaims(60)
+
+        self.assertEqual(({1, 2, 3}, set()), first.claim([1, 2, 3]))
+        self.assertEqual(({4}, {2, 3}), second.claim([2, 3, 4]))
+        # Claims already held by a build are still its own
+        self.assertEqual(({1, 2}, set()), first.claim([1, 2]))
+        self.assertEqual({1, 2, 3}, second.held_by_others([1, 2, 3, 4]))
+
+        first.release()
+        self.assertEqual(set(), second.held_by_others([1, 2, 3, 4]))
+        self.assertEqual(({2, 3, 4}, set()), second.claim([2, 3, 4]))
+
+    def test_expiry(self):
+        first = hydration_claims.HydrationClaims(0.05)
+        second = hydration_claims.HydrationClaims(60)
+
+        first.claim([1, 2])
+        self.assertEqual((set(), {1, 2}), second.claim([1, 2]))
+
+        time.sleep(0.1)
+        self.assertEqual(({1, 2}, set()), second.claim([1, 2]))
+
+        # Only claims still held by this build are released
+        first.release()
+        self.assertEqual({1, 2}, hydration_claims.HydrationClaims(60).held_by_others([1, 2]))
+
+    def build(self, tweet_ids, stats, claims=None):
+        """Hydrate and cache Tweets as `Extract.hydrate` does."""
+        if claims is None:
+            claims = self.claims()
+
+        tweets = list(
+            tweet_providers.iter_tweets(tweet_ids, [PROVIDER],
+                                        stats=stats,
+                                        claims=claims))
+        tweet_providers.save_to_redis(
+            tweet for tweet in tweets if tweet['id'] not in claims.cached)
+        claims.release()
+        return tweets
+
+    @staticmethod
+    def claims(max_wait=None):
+        return hydration_claims.HydrationClaims(
+            60,
+            poll_interval=0.01,
+            max_wait=max_wait,
+            cache_writers=[tweet_providers.save_to_redis])
+
+    def test_release_some(self):
+        claims = hydration_claims.HydrationClaims(60)
+        claims.claim([1, 2, 3])
+
+        claims.release([2, 3, 4])
+        self.assertEqual({1}, claims.held)
+        self.assertEqual({1}, hydration_claims.HydrationClaims(60).held_by_others([1, 2, 3]))
+
+    def test_single_flight(self):
+        results = {}
+        stats = collections.Counter()
+
+        def first_build():
+            with app.app_context():
+                results['first'] = self.build(range(100), collections.Counter())
+
+        with mock.patch.dict(app.config, {'SINGLE_FLIGHT_PROVIDERS': [PROVIDER]}):
+            thread = threading.Thread(target=first_build, name='first')
+            thread.start()
+            provider_called.wait(5)
+
+            results['second'] = self.build(range(50, 150), stats)
+            thread.join()
+
+        self.assertEqual(list(range(100)), requested['first'])
+        # Tweets looked up by the first build are not looked up again
+        self.assertEqual(list(range(100, 150)),
+                         requested[threading.current_thread().name])
+
+        tweet_ids = [tweet['id'] for tweet in results['second']]
+        self.assertEqual(
+            sorted(set(range(50, 150)) - DELETED_IDS), sorted(tweet_ids))
+        self.assertEqual(len(tweet_ids), len(set(tweet_ids)))
+        # Including the deleted Tweet recorded as missing by the first build
+        self.assertEqual(50, stats['shared'])
+        self.assertEqual(1, stats['skipped'])
+        self.assertEqual(0, stats['not_found'])
+
+    def test_overlapping_claims(self):
+        """Builds each holding claims on Tweets the other needs do not wait on each other."""
+        first_claims = self.claims()
+        second_claims = self.claims()
+        first_claims.claim(range(50, 75))
+        second_claims.claim(range(75, 100))
+
+        results = {}
+        stats = {'first': collections.Counter(), 'second': collections.Counter()}
+
+        def run_build(name, tweet_ids, claims):
+            with app.app_context():
+                results[name] = self.build(tweet_ids, stats[name], claims)
+
+        start = time.perf_counter()
+        with mock.patch.dict(app.config, {'SINGLE_FLIGHT_PROVIDERS': [PROVIDER]}):
+            threads = [
+                threading.Thread(target=run_build,
+                                 name='first',
+                                 args=('first', range(100), first_claims)),
+                threading.Thread(target=run_build,
+                                 name='second',
+                                 args=('second', range(50, 150), second_claims)),
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+
+        self.assertLess(time.perf_counter() - start, 5)
+        # Each Tweet in the overlap is looked up only by the build which claimed it
+        self.assertEqual(list(range(75)), sorted(requested['first']))
+        self.assertEqual(list(range(75, 150)), sorted(requested['second']))
+
+        self.assertEqual(sorted(set(range(100)) - DELETED_IDS),
+                         sorted(tweet['id'] for tweet in results['first']))
+        self.assertEqual(sorted(set(range(50, 150)) - DELETED_IDS),
+                         sorted(tweet['id'] for tweet in results['second']))
+        # Including the deleted Tweet recorded as missing by the other build
+        self.assertEqual(25, stats['first']['shared'])
+        self.assertEqual(25, stats['second']['shared'])
+
+    def test_max_wait(self):
+        stats = collections.Counter()
+        stalled = hydration_claims.HydrationClaims(60)
+        stalled.claim(range(10))
+
+        start = time.perf_counter()
+        with mock.patch.dict(app.config, {'SINGLE_FLIGHT_PROVIDERS': [PROVIDER]}):
+            tweets = self.build(range(20), stats, self.claims(max_wait=0.1))
+
+        # Tweets still claimed by a stalled build are looked up once the wait is over
+        self.assertLess(time.perf_counter() - start, 5)
+        name = threading.current_thread().name
+        self.assertEqual(list(range(10, 20)) + list(range(10)), requested[name])
+        self.assertEqual(19, len(tweets))
+        self.assertEqual(0, stats['shared'])
+
+    def test_takes_over_released_claims(self):
+        stats = collections.Counter()
+        abandoned = hydration_claims.HydrationClaims(60)
+        abandoned.claim(range(10))
+
+        def abandon():
+            time.sleep(0.1)
+            with app.app_context():
+                abandoned.release()
+
+        thread = threading.Thread(target=abandon)
+        thread.start()
+        with mock.patch.dict(app.config, {'SINGLE_FLIGHT_PROVIDERS': [PROVIDER]}):
+            tweets = self.build(range(20), stats)
+        thread.join()
+
+        # Claimed Tweets were never cached, so are looked up once released
+        name = threading.current_thread().name
+        self.assertEqual(list(range(10, 20)) + list(range(10)), requested[name])
+        self.assertEqual(19, len(tweets))
+        self.assertEqual(0, stats['shared'])
+
+    def test_disabled(self):
+        self.assertIsNone(
+            hydration_claims.get_claims({'HYDRATION_CLAIM_TIME': 0}))
+        self.assertEqual(
+            30,
+            hydration_claims.get_claims({
+                'HYDRATION_CLAIM_TIME': 30,
+                'HYDRATION_CLAIM_POLL_INTERVAL': 1,
+                'HYDRATION_CLAIM_MAX_WAIT': 30,
+            }).claim_time)
@@ -0,0 +1,78 @@
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from wdra_extender.extract import local_store
+
+
+class LocalTweetStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmp_dir.name).joinpath('tweets.sqlite3')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_and_get(self):
+        store = local_store.LocalTweetStore(self.path, max_bytes=10**9)
+        store.put_many((i, f'tweet {i}'.encode()) for i in range(2000))
+
+        found = dict(store.get_many(range(1990, 2010)))
+
+        self.assertEqual(list(range(1990, 2000)), sorted(found))
+        self.assertEqual(b'tweet 1995', found[1995])
+
+        stats = store.stats()
+        self.assertEqual(10, stats['hits'])
+        self.assertEqual(10, stats['misses'])
+        self.assertEqual(0.5, stats['hit_ratio'])
+        self.assertEqual(2000, stats['tweets'])
+
+    def test_reads_do_not_write(self):
+        store = local_store.LocalTweetStore(self.path, max_bytes=10**9)
+        store.put_many((i, b'tweet') for i in range(10))
+        accessed = self.read_accessed()
+
+        with mock.patch.object(local_store, 'STATS_FLUSH_INTERVAL', 60):
+            self.assertEqual(5, len(list(store.get_many(range(5, 15)))))
+
+        # Accessed recently enough, and the hits are not yet written
+        self.assertEqual(accessed, self.read_accessed())
+        with sqlite3.connect(str(self.path)) as conn:
+            hits = conn.execute("SELECT value FROM stats WHERE name = 'hits'").fetchall()
+        self.assertEqual([(0, )], hits)
+
+        self.assertEqual(5, store.stats()['hits'])
+
+    def test_stale_access_updated(self):
+        store = local_store.LocalTweetStore(self.path, max_bytes=10**9, access_resolution=60)
+        store.put_many((i, b'tweet') for i in range(10))
+        with sqlite3.connect(str(self.path)) as conn:
+            conn.execute('UPDATE tweets SET accessed = accessed - 120 WHERE id < 5')
+        accessed = self.read_accessed()
+
+        list(store.get_many(range(10)))
+
+        updated = self.read_accessed()
+        self.assertTrue(all(updated[i] > accessed[i] for i in range(5)))
+        self.assertEqual([accessed[i] for i in range(5, 10)], [updated[i] for i in range(5, 10)])
+
+    def read_accessed(self):
+        with sqlite3.connect(str(self.path)) as conn:
+            return dict(conn.execute('SELECT id, accessed FROM tweets').fetchall())
+
+    def test_evict_least_recently_used(self):
+        store = local_store.LocalTweetStore(self.path, max_bytes=10**9, access_resolution=0)
+        store.put_many((i, bytes(1000)) for i in range(1000))
+        list(store.get_many(range(500, 1000)))
+
+        store.max_bytes = store.used_bytes() // 2
+        evicted = store.evict()
+
+        self.assertGreater(evicted, 0)
+        remaining = dict(store.get_many(range(1000)))
+        self.assertNotIn(0, remaining)
+        self.assertIn(999, remaining)
+        self.assertLessEqual(store.used_bytes(), store.max_bytes)
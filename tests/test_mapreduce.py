@@ -0,0 +1,152 @@
+import collections
+from concurrent import futures
+import os
+import pathlib
+import tempfile
+import textwrap
+import unittest
+
+from wdra_extender.app import app
+from wdra_extender.extract import accounts_table, mapreduce, plugins, tweet_store
+from .mocks.tweet_provider import TEST_TWEETS
+from .test_accounts_table import BIN_DIR, TWEETS, USERS
+
+
+def count_words(tweets):
+    return collections.Counter(word for tweet in tweets
+                               for word in tweet['content'].split())
+
+
+def shard_pid(tweets):
+    list(tweets)
+    return os.getpid()
+
+
+class MapShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_tweets(self, tweets, name='tweets.jsonl'):
+        path = self.dir_path.joinpath(name)
+        tweet_store.write_ndjson(tweets, path)
+        return path
+
+    def test_shards_cover_every_line_once(self):
+        path = self.write_tweets(TEST_TWEETS * 7)
+
+        for n_shards in (1, 2, 3, 8, 100):
+            with self.subTest(n_shards=n_shards):
+                shards = tweet_store.ndjson_shards(path, n_shards)
+                tweets = [
+                    tweet for start, end in shards
+                    for tweet in tweet_store.iter_ndjson_range(path, start, end)
+                ]
+
+                self.assertLessEqual(len(shards), n_shards)
+                self.assertEqual(TEST_TWEETS * 7, tweets)
+
+    def test_map_shards_in_processes(self):
+        path = self.write_tweets(TEST_TWEETS * 20)
+
+        with app.app_context():
+            partials = mapreduce.map_shards(count_words,
+                                            tweet_store.TweetView(path),
+                                            max_workers=2,
+                                            min_shard_bytes=1)
+
+        self.assertEqual(8, len(partials))
+        self.assertEqual(count_words(TEST_TWEETS * 20), sum(partials, collections.Counter()))
+
+    def test_plugins_share_pool(self):
+        path = self.write_tweets(TEST_TWEETS * 20)
+
+        def map_pids():
+            with app.app_context():
+                return mapreduce.map_shards(shard_pid,
+                                            tweet_store.TweetView(path),
+                                            max_workers=2,
+                                            min_shard_bytes=1)
+
+        with futures.ThreadPoolExecutor(max_workers=3) as threads:
+            pids = {pid for job in [threads.submit(map_pids) for _ in range(3)]
+                    for pid in job.result()}
+
+        # Plugins mapping at the same time do not each start their own processes
+        self.assertLessEqual(len(pids), 2)
+        self.assertNotIn(os.getpid(), pids)
+        self.assertIs(mapreduce._get_pool(2), mapreduce._get_pool(2))  # pylint: disable=protected-access
+
+    def test_plugin_directory_mapper(self):
+        plugin_dir = self.dir_path.joinpath('plugins', 'COUNTWORDS')
+        plugin_dir.mkdir(parents=True)
+        plugin_dir.joinpath('plugin.py').write_text(textwrap.dedent('''
+            import collections
+
+            from wdra_extender.extract.mapreduce import MapReducePlugin
+
+
+            class CountWords(MapReducePlugin):
+                @classmethod
+                def map_shard(cls, tweets):
+                    return collections.Counter(
+                        word for tweet in tweets for word in tweet['content'].split())
+
+                def write(self, result, work_dir, env=None):
+                    pass
+        '''))
+        plugin_class = plugins.load_plugin_class(plugin_dir.joinpath('plugin.py'))
+        path = self.write_tweets(TEST_TWEETS * 20)
+
+        # The plugin module cannot be imported by name in the pool processes
+        with app.app_context():
+            partials = mapreduce.map_shards(plugin_class.map_shard,
+                                            tweet_store.TweetView(path),
+                                            max_workers=2,
+                                            min_shard_bytes=1)
+
+        self.assertEqual(count_words(TEST_TWEETS * 20), sum(partials, collections.Counter()))
+
+    def test_small_file_is_not_sharded(self):
+        path = self.write_tweets(TEST_TWEETS)
+
+        with app.app_context():
+            partials = mapreduce.map_shards(count_words,
+                                            tweet_store.TweetView(path),
+                                            max_workers=2,
+                                            min_shard_bytes=10**9)
+
+        self.assertEqual([count_words(TEST_TWEETS)], partials)
+
+    def test_sharded_accounts_table_matches(self):
+        path = self.write_tweets(TWEETS * 3)
+        users_cache = self.write_tweets(USERS, 'users.jsonl')
+        single_dir = self.dir_path.joinpath('single')
+        sharded_dir = self.dir_path.joinpath('sharded')
+        single_dir.mkdir()
+        sharded_dir.mkdir()
+
+        accounts_table.write_accounts_table(TWEETS * 3, single_dir, BIN_DIR,
+                                            users_cache=users_cache,
+                                            lookup=lambda names: [])
+
+        cls = accounts_table.AccountsTablePlugin
+        partials = [
+            cls.map_shard(tweet_store.iter_ndjson_range(path, start, end))
+            for start, end in tweet_store.ndjson_shards(path, 4)
+        ]
+        table, rows = cls.reduce(partials)
+        sharded_dir.joinpath('00TMP').write_text(''.join(rows))
+        with app.app_context():
+            accounts_table.write_account_files(table, sharded_dir, BIN_DIR,
+                                               users_cache=users_cache,
+                                               lookup=lambda names: [])
+
+        self.assertEqual(4, len(partials))
+        for path in sorted(single_dir.iterdir()):
+            with self.subTest(path.name):
+                self.assertEqual(path.read_bytes(),
+                                 sharded_dir.joinpath(path.name).read_bytes())
@@ -0,0 +1,148 @@
+import pathlib
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from wdra_extender.app import app
+from wdra_extender.extract import metrics, plugins, status_metrics, tweet_providers
+from .mocks.tweet_provider import TEST_TWEET_IDS, TEST_TWEETS
+
+PROVIDER = 'tests.mocks.tweet_provider.tweet_provider'
+
+
+def sample(name: str, **labels) -> float:
+    """Get the current value of a metric sample, or zero if it is not reported."""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class ProviderMetricsTest(unittest.TestCase):
+    def test_iter_tweets(self):
+        labels = {'provider': 'tweet_provider'}
+        before = {
+            name: sample(name, **labels)
+            for name in ['wdrax_provider_requested_tweets_total',
+                         'wdrax_provider_found_tweets_total',
+                         'wdrax_provider_seconds_count']
+        }
+
+        tweets = list(tweet_providers.iter_tweets(TEST_TWEET_IDS | {6, 7}, [PROVIDER]))
+
+        self.assertEqual(TEST_TWEETS, tweets)
+        self.assertEqual(
+            len(TEST_TWEET_IDS) + 2,
+            sample('wdrax_provider_requested_tweets_total', **labels) -
+            before['wdrax_provider_requested_tweets_total'])
+        self.assertEqual(
+            len(TEST_TWEETS),
+            sample('wdrax_provider_found_tweets_total', **labels) -
+            before['wdrax_provider_found_tweets_total'])
+        self.assertEqual(
+            1, sample('wdrax_provider_seconds_count', **labels) -
+            before['wdrax_provider_seconds_count'])
+
+    def test_timed_provider_excludes_caller(self):
+        def provider():
+            yield {'id': 1}
+            yield {'id': 2}
+
+        labels = {'provider': 'timed'}
+        before = sample('wdrax_provider_seconds_sum', **labels)
+        for _ in metrics.timed_provider('tests.timed', provider()):
+            # Time spent by the caller is not the provider's latency
+            time.sleep(0.1)
+
+        self.assertLess(sample('wdrax_provider_seconds_sum', **labels) - before, 0.1)
+
+
+class PluginMetricsTest(unittest.TestCase):
+    def test_executable_plugin_max_rss(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            main_file = pathlib.Path(tmp_dir, 'main.sh')
+            main_file.write_text('#!/bin/sh\necho "$1"\necho error >&2\n')
+            main_file.chmod(0o755)
+
+            credentials = {
+                key: 'test'
+                for key in ['TWITTER_CONSUMER_KEY', 'TWITTER_CONSUMER_SECRET',
+                            'TWITTER_ACCESS_TOKEN', 'TWITTER_ACCESS_TOKEN_SECRET']
+            }
+            with mock.patch.dict(app.config, credentials), app.app_context():
+                proc = plugins.executable_plugin(main_file)('tweets.json', tmp_dir)
+
+        self.assertEqual(0, proc.returncode)
+        self.assertEqual('tweets.json\n', proc.stdout)
+        self.assertEqual('error\n', proc.stderr)
+        self.assertGreater(proc.max_rss, 0)
+
+    def test_failed_process(self):
+        proc = plugins.run_process(['sh', '-c', 'kill -9 $$'])
+        self.assertEqual(-9, proc.returncode)
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        tmp_path = pathlib.Path(tmp_dir.name)
+
+        patcher = mock.patch.dict(app.config, {
+            'TWEET_STORE_PATH': tmp_path.joinpath('tweets.sqlite3'),
+            'PLUGIN_CACHE_DIR': tmp_path.joinpath('plugin_cache'),
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_export(self):
+        client = app.test_client()
+        client.get(f'/extracts/{uuid.uuid4()}/fetch')
+
+        response = client.get('/metrics')
+        self.assertEqual(200, response.status_code)
+
+        text = response.get_data(as_text=True)
+        self.assertIn('wdrax_request_seconds_count{endpoint="download_extract"}', text)
+        # Labels of configured providers and loaded plugins exist before use
+        self.assertIn('wdrax_provider_found_tweets_total{provider="twarc_provider"}', text)
+        self.assertIn('wdrax_plugin_seconds_count{plugin="DOTWEETSTABLE",status="ok"}', text)
+        self.assertIn('wdrax_plugin_max_rss_bytes_count{plugin="DOTWEETSTABLE"}', text)
+
+    def test_status(self):
+        size_class_stats = {
+            'waiting': 2,
+            'oldest_wait_s': 30.0,
+            'started': 0,
+            'mean_wait_s': None,
+            'max_wait_s': None,
+        }
+        stats = {
+            'queue_depths': {'hydration.small': 2, 'hydration.large': None},
+            'size_classes': dict.fromkeys(['small', 'medium', 'large'], size_class_stats),
+        }
+        with mock.patch.object(status_metrics, 'queue_stats', return_value=stats) as get_stats:
+            client = app.test_client()
+            health = client.get('/health').get_json()
+            get_stats.assert_not_called()
+
+            text = client.get('/metrics').get_data(as_text=True)
+
+        self.assertEqual(['redis'], list(health))
+        self.assertIn('wdrax_build_queue_messages{queue="hydration.small"} 2.0', text)
+        # Unknown depths are left out rather than reported as zero
+        self.assertNotIn('queue="hydration.large"', text)
+        self.assertIn('wdrax_build_oldest_wait_seconds{size_class="medium"} 30.0', text)
+        self.assertNotIn('wdrax_build_mean_wait_seconds{', text)
+        self.assertIn('wdrax_tweet_store_tweets 0.0', text)
+        self.assertIn('wdrax_plugin_cache_entries 0.0', text)
+
+    def test_status_unavailable(self):
+        with mock.patch.object(status_metrics, 'queue_stats', side_effect=ConnectionError):
+            response = app.test_client().get('/metrics')
+
+        self.assertEqual(200, response.status_code)
+        text = response.get_data(as_text=True)
+        self.assertNotIn('wdrax_build_queue_messages', text)
+        self.assertIn('wdrax_tweet_store_tweets', text)
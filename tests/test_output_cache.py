@@ -0,0 +1,191 @@
+import json
+import os
+import pathlib
+import importlib
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from wdra_extender.app import app
+from wdra_extender.extract import output_cache, plugins, scheduler
+from .mocks.tweet_provider import TEST_TWEETS
+
+
+def writing_plugin(calls: list, name: str, reads: str = None):
+    """Make a mock plugin which writes a file, optionally copying an input file."""
+    def run(tweets_file, work_dir, **kwargs):
+        calls.append(name)
+        content = name
+        if reads is not None:
+            content += work_dir.joinpath(reads).read_text()
+
+        work_dir.joinpath(f'{name}.txt').write_text(content)
+        return subprocess.CompletedProcess([name], 0, stdout='', stderr='')
+
+    return run
+
+
+class OutputCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self.tmp_dir.name)
+        self.cache = output_cache.PluginOutputCache(
+            self.dir_path.joinpath('cache'), max_bytes=10**9, max_age=3600)
+
+        self.src_dir = self.dir_path.joinpath('src')
+        self.src_dir.joinpath('sub').mkdir(parents=True)
+        self.src_dir.joinpath('a.csv').write_text('a')
+        self.src_dir.joinpath('sub', 'b.csv').write_text('bb')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_and_get(self):
+        dest_dir = self.dir_path.joinpath('dest')
+        self.assertIsNone(self.cache.get('ab12', dest_dir))
+
+        self.cache.put('ab12', self.src_dir, ['a.csv', 'sub/b.csv'])
+        files = self.cache.get('ab12', dest_dir)
+
+        self.assertEqual(['a.csv', 'sub/b.csv'], files)
+        self.assertEqual('bb', dest_dir.joinpath('sub', 'b.csv').read_text())
+
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['entries'])
+        self.assertEqual(3, stats['used_bytes'])
+
+    def test_evict_least_recently_used(self):
+        for key in ('aa01', 'bb02', 'cc03'):
+            self.cache.put(key, self.src_dir, ['a.csv', 'sub/b.csv'])
+            # Make sure the last use times differ
+            record = self.cache._entry_dir(key).joinpath(output_cache.ENTRY_FILE)
+            os.utime(record, (time.time() - 60, time.time() - 60))
+
+        self.cache.get('aa01', self.dir_path.joinpath('dest'))
+        self.cache.max_bytes = 6
+
+        self.assertEqual(2, self.cache.evict())
+        self.assertIsNotNone(self.cache.get('aa01', self.dir_path.joinpath('dest')))
+
+    def test_evict_expired(self):
+        self.cache.put('aa01', self.src_dir, ['a.csv'])
+        self.cache.max_age = -1
+
+        self.assertIsNone(self.cache.get('aa01', self.dir_path.joinpath('dest')))
+        self.assertEqual(1, self.cache.evict())
+        self.assertEqual(0, self.cache.stats()['entries'])
+
+    def test_tweets_digest_ignores_order(self):
+        lines = [json.dumps(tweet) for tweet in TEST_TWEETS]
+        forward = self.dir_path.joinpath('forward.jsonl')
+        forward.write_text('\n'.join(lines) + '\n')
+        backward = self.dir_path.joinpath('backward.jsonl')
+        backward.write_text('\n'.join(reversed(lines)) + '\n')
+        fewer = self.dir_path.joinpath('fewer.jsonl')
+        fewer.write_text('\n'.join(lines[1:]) + '\n')
+
+        self.assertEqual(output_cache.tweets_digest(forward),
+                         output_cache.tweets_digest(backward))
+        self.assertNotEqual(output_cache.tweets_digest(forward),
+                            output_cache.tweets_digest(fewer))
+
+    def test_plugin_digest_changes_with_contents(self):
+        before = output_cache.plugin_digest(self.src_dir)
+        self.src_dir.joinpath('run.log').write_text('ignored')
+        self.assertEqual(before, output_cache.plugin_digest(self.src_dir))
+
+        self.src_dir.joinpath('a.csv').write_text('changed')
+        self.assertNotEqual(before, output_cache.plugin_digest(self.src_dir))
+
+    def test_plugin_digest_follows_imports(self):
+        package_dir = self.dir_path.joinpath('wdrax_digest_test')
+        package_dir.mkdir()
+        package_dir.joinpath('__init__.py').write_text('')
+        package_dir.joinpath('engine.py').write_text(
+            'from .helpers import helper\n\nclass Engine:\n    pass\n')
+        package_dir.joinpath('helpers.py').write_text(
+            'from . import deep\n\ndef helper():\n    return deep\n')
+        package_dir.joinpath('deep.py').write_text('VALUE = 1\n')
+        package_dir.joinpath('unused.py').write_text('')
+
+        sys.path.insert(0, str(self.dir_path))
+        self.addCleanup(sys.path.remove, str(self.dir_path))
+        for name in ['', '.engine', '.helpers', '.deep']:
+            self.addCleanup(sys.modules.pop, f'wdrax_digest_test{name}', None)
+        engine = importlib.import_module('wdrax_digest_test.engine')
+
+        self.assertEqual(
+            {'wdrax_digest_test.engine', 'wdrax_digest_test.helpers', 'wdrax_digest_test.deep'},
+            set(output_cache.imported_sources('wdrax_digest_test.engine')))
+
+        before = output_cache.plugin_digest(plugin_class=engine.Engine)
+        package_dir.joinpath('unused.py').write_text('VALUE = 2\n')
+        self.assertEqual(before, output_cache.plugin_digest(plugin_class=engine.Engine))
+
+        # Indirectly imported
+        package_dir.joinpath('deep.py').write_text('VALUE = 2\n')
+        self.assertNotEqual(before, output_cache.plugin_digest(plugin_class=engine.Engine))
+
+    def test_engine_digest_includes_helpers(self):
+        sources = output_cache.imported_sources('wdra_extender.extract.text_stats')
+        for name in ['accounts_table', 'mapreduce', 'tweet_store']:
+            self.assertIn(f'wdra_extender.extract.{name}', sources)
+
+    def test_plugin_keys_include_dependencies(self):
+        depends = {'A': ('B', ), 'C': ('D', )}
+        keys = output_cache.plugin_keys('t', {'A': '1', 'B': '2', 'C': '3'},
+                                        depends, {})
+        changed = output_cache.plugin_keys('t', {'A': '1', 'B': '4', 'C': '3'},
+                                           depends, {})
+
+        self.assertNotEqual(keys['A'], changed['A'])
+        self.assertIsNone(keys['C'])
+
+
+class CachedSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self.tmp_dir.name)
+        self.cache = output_cache.PluginOutputCache(
+            self.dir_path.joinpath('cache'), max_bytes=10**9, max_age=3600)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_plugins(self, calls, work_name):
+        work_dir = self.dir_path.joinpath(work_name)
+        work_dir.mkdir()
+        plugin_map = {
+            pathlib.Path('A'): writing_plugin(calls, 'A', reads='B.txt'),
+            pathlib.Path('B'): writing_plugin(calls, 'B'),
+        }
+        manifests = {pathlib.Path('A'): plugins.PluginManifest('A', depends=('B', ))}
+
+        with app.app_context():
+            results = scheduler.PluginScheduler(
+                plugin_map, manifests, max_workers=2, cache=self.cache,
+                cache_keys={'A': 'aa01', 'B': 'bb02'}).run(None, work_dir)
+
+        return work_dir, results
+
+    def test_second_build_reuses_output(self):
+        calls = []
+        work_dir, results = self.run_plugins(calls, 'first')
+
+        self.assertEqual(['B', 'A'], calls)
+        self.assertEqual(['miss', 'miss'], [r.cache for r in results])
+        self.assertEqual(['A.txt', 'B.txt'],
+                         sorted(p.name for p in work_dir.iterdir()))
+        self.assertEqual('AB', work_dir.joinpath('A.txt').read_text())
+
+        work_dir, results = self.run_plugins(calls, 'second')
+
+        self.assertEqual(['B', 'A'], calls)
+        self.assertEqual(['hit', 'hit'], [r.cache for r in results])
+        self.assertEqual(['ok', 'ok'], [r.status for r in results])
+        self.assertEqual('AB', work_dir.joinpath('A.txt').read_text())
+        self.assertFalse(work_dir.joinpath(scheduler.PRIVATE_DIR).exists())
@@ -0,0 +1,242 @@
+import json
+import os
+import pathlib
+import subprocess
+import tempfile
+import time
+import unittest
+
+from wdra_extender.app import app
+from wdra_extender.extract import plugins, scheduler
+
+
+def sleeping_plugin(duration: float, log: list, name: str):
+    """Make a mock plugin which records when it starts and finishes."""
+    def run(tweets_file, work_dir, **kwargs):
+        log.append(('start', name))
+        time.sleep(duration)
+        log.append(('end', name))
+        return subprocess.CompletedProcess([name], 0, stdout=name, stderr='')
+
+    return run
+
+
+def failing_plugin(tweets_file, work_dir, **kwargs):
+    raise subprocess.CalledProcessError(3, ['fail'], output='', stderr='oops')
+
+
+class ManifestTest(unittest.TestCase):
+    def test_read_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dir_path = pathlib.Path(tmp_dir)
+            dir_path.joinpath('plugin.ini').write_text(
+                '[plugin]\ndepends = A, B\nmax_parallel = 2\n')
+
+            manifest = plugins.read_manifest(dir_path)
+
+        self.assertEqual(('A', 'B'), manifest.depends)
+        self.assertEqual(2, manifest.max_parallel)
+
+    def test_read_missing_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest = plugins.read_manifest(pathlib.Path(tmp_dir))
+
+        self.assertEqual((), manifest.depends)
+        self.assertIsNone(manifest.max_parallel)
+
+
+PYTHON_PLUGIN = """
+from wdra_extender.extract.plugins import PluginBase
+
+
+class CountPlugin(PluginBase):
+    def run(self, tweets=None, tweets_file=None, work_dir=None, env=None):
+        work_dir.joinpath('count.txt').write_text(str(len(self.tweets)))
+"""
+
+
+class PluginCollectionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def load_plugins(self):
+        collection = plugins.PluginCollection([self.dir_path])
+        with app.app_context():
+            collection.load_plugins()
+
+        return {path.name: plugin for path, plugin in collection.plugins.items()}
+
+    def test_load_python_plugin(self):
+        plugin_dir = self.dir_path.joinpath('COUNT')
+        plugin_dir.mkdir()
+        plugin_dir.joinpath('plugin.py').write_text(PYTHON_PLUGIN)
+        work_dir = self.dir_path.joinpath('work')
+        work_dir.mkdir()
+
+        plugin = self.load_plugins()['COUNT']
+        with app.app_context():
+            plugin(None, work_dir, tweets=[{'id': 1}, {'id': 2}])
+
+        self.assertEqual('2', work_dir.joinpath('count.txt').read_text())
+
+    def test_python_plugin_reads_tweets_file(self):
+        plugin_dir = self.dir_path.joinpath('COUNT')
+        plugin_dir.mkdir()
+        plugin_dir.joinpath('plugin.py').write_text(PYTHON_PLUGIN)
+        tweets_file = self.dir_path.joinpath('tweets.json')
+        tweets_file.write_text('[{"id": 1}]')
+
+        plugin = self.load_plugins()['COUNT']
+        with app.app_context():
+            plugin(tweets_file, self.dir_path)
+
+        self.assertEqual('1', self.dir_path.joinpath('count.txt').read_text())
+
+    def test_invalid_python_plugin_is_skipped(self):
+        plugin_dir = self.dir_path.joinpath('BROKEN')
+        plugin_dir.mkdir()
+        plugin_dir.joinpath('plugin.py').write_text('import does_not_exist\n')
+
+        self.assertNotIn('BROKEN', self.load_plugins())
+
+    def test_bundled_plugins(self):
+        collection = plugins.PluginCollection([app.config['PLUGIN_DIR']])
+        with app.app_context():
+            collection.load_plugins()
+
+        loaded = {path.name: plugin for path, plugin in collection.plugins.items()}
+        self.assertTrue(
+            loaded['DOACCOUNTSTABLE'].__qualname__.startswith('python_plugin'))
+        self.assertTrue(
+            loaded['DOTWEETSTABLE'].__qualname__.startswith('executable_plugin'))
+
+
+class PluginRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self.tmp_dir.name)
+        self.registry = plugins.PluginRegistry()
+        self.registry.plugin_directories = [self.dir_path]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add_plugin(self, name):
+        plugin_dir = self.dir_path.joinpath(name)
+        plugin_dir.mkdir()
+        plugin_dir.joinpath('plugin.py').write_text(PYTHON_PLUGIN)
+
+    def test_loads_once(self):
+        self.add_plugin('A')
+
+        with app.app_context():
+            collection = self.registry.get()
+            self.assertIs(collection, self.registry.get())
+
+    def test_reloads_when_changed(self):
+        self.add_plugin('A')
+
+        with app.app_context():
+            collection = self.registry.get()
+            self.add_plugin('B')
+            reloaded = self.registry.get()
+
+        self.assertIsNot(collection, reloaded)
+        self.assertEqual({'A', 'B'}, {path.name for path in reloaded.plugins})
+
+    def test_reloads_when_touched(self):
+        self.add_plugin('A')
+
+        # Make sure the new modification time differs
+        os.utime(self.dir_path, ns=(0, 0))
+
+        with app.app_context():
+            collection = self.registry.get()
+            self.registry.touch()
+            self.assertIsNot(collection, self.registry.get())
+
+    def test_list_command(self):
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['plugins', 'list', '--json'])
+
+        self.assertEqual(0, result.exit_code, result.output)
+        listed = {p['name']: p for p in json.loads(result.output)['plugins']}
+        self.assertEqual('python', listed['DOACCOUNTSTABLE']['kind'])
+        self.assertTrue(listed['DOTWEETSTABLE']['source'].endswith('main.sh'))
+
+
+class PluginSchedulerTest(unittest.TestCase):
+    def run_plugins(self, plugin_map, manifests=None, max_workers=4):
+        plugin_map = {pathlib.Path(k): v for k, v in plugin_map.items()}
+        manifests = {
+            pathlib.Path(k): plugins.PluginManifest(k, **v)
+            for k, v in (manifests or {}).items()
+        }
+
+        with app.app_context():
+            return scheduler.PluginScheduler(
+                plugin_map, manifests, max_workers=max_workers).run(None, None)
+
+    def test_independent_plugins_run_concurrently(self):
+        log = []
+        results = self.run_plugins({
+            'A': sleeping_plugin(0.2, log, 'A'),
+            'B': sleeping_plugin(0.2, log, 'B'),
+        })
+
+        self.assertEqual([('start', 'A'), ('start', 'B')], sorted(log[:2]))
+        self.assertEqual(['ok', 'ok'], [r.status for r in results])
+        self.assertEqual(['A', 'B'], [r.stdout for r in results])
+
+    def test_dependencies_run_first(self):
+        log = []
+        self.run_plugins(
+            {
+                'A': sleeping_plugin(0, log, 'A'),
+                'B': sleeping_plugin(0.1, log, 'B'),
+            },
+            manifests={'A': {'depends': ('B', )}})
+
+        self.assertEqual(
+            [('start', 'B'), ('end', 'B'), ('start', 'A'), ('end', 'A')], log)
+
+    def test_max_parallel(self):
+        log = []
+        self.run_plugins(
+            {
+                'A': sleeping_plugin(0.1, log, 'A'),
+                'B': sleeping_plugin(0.1, log, 'B'),
+            },
+            manifests={'B': {'max_parallel': 1}})
+
+        self.assertEqual(('end', log[0][1]), log[1])
+
+    def test_failure_skips_dependents(self):
+        log = []
+        results = self.run_plugins(
+            {
+                'A': failing_plugin,
+                'B': sleeping_plugin(0, log, 'B'),
+                'C': sleeping_plugin(0, log, 'C'),
+            },
+            manifests={'B': {'depends': ('A', )}})
+
+        self.assertEqual(['failed', 'skipped', 'ok'], [r.status for r in results])
+        self.assertEqual(3, results[0].returncode)
+        self.assertEqual('oops', results[0].stderr)
+
+    def test_circular_dependencies_are_skipped(self):
+        log = []
+        results = self.run_plugins(
+            {
+                'A': sleeping_plugin(0, log, 'A'),
+                'B': sleeping_plugin(0, log, 'B'),
+            },
+            manifests={'A': {'depends': ('B', )}, 'B': {'depends': ('A', )}})
+
+        self.assertEqual(['skipped', 'skipped'], [r.status for r in results])
+        self.assertEqual([], log)
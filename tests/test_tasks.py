@@ -0,0 +1,286 @@
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from wdra_extender import extensions
+from wdra_extender.app import app
+from wdra_extender.extract import models, scheduling, tasks
+from .mocks.redis_client import FakeRedis
+
+STAGE_CONFIG = {
+    'WORKER_STAGE': None,
+    'WORKER_SIZE_CLASSES': ('small', 'medium', 'large'),
+    'HYDRATION_QUEUE': 'hydration',
+    'ANALYSIS_QUEUE': 'analysis',
+    'HYDRATION_WORKER_CONCURRENCY': 8,
+    'ANALYSIS_WORKER_CONCURRENCY': 2,
+    'HYDRATION_WORKER_PREFETCH': 4,
+    'ANALYSIS_WORKER_PREFETCH': 1,
+}
+
+
+class StageConfigTest(unittest.TestCase):
+    def test_all_stages(self):
+        config = extensions.get_stage_config(STAGE_CONFIG)
+
+        self.assertEqual([
+            'hydration.small', 'hydration.medium', 'hydration.large',
+            'analysis.small', 'analysis.medium', 'analysis.large'
+        ], [queue.name for queue in config['task_queues']])
+        self.assertEqual(1, config['worker_prefetch_multiplier'])
+        self.assertNotIn('worker_concurrency', config)
+
+    def test_single_stage(self):
+        config = extensions.get_stage_config(
+            dict(STAGE_CONFIG, WORKER_STAGE='hydration', WORKER_SIZE_CLASSES=('small', )))
+
+        self.assertEqual(['hydration.small'],
+                         [queue.name for queue in config['task_queues']])
+        self.assertEqual(4, config['worker_prefetch_multiplier'])
+        self.assertEqual(8, config['worker_concurrency'])
+
+        with self.assertRaises(ValueError):
+            extensions.get_stage_config(dict(STAGE_CONFIG, WORKER_STAGE='other'))
+
+        with self.assertRaises(ValueError):
+            extensions.get_stage_config(dict(STAGE_CONFIG, WORKER_SIZE_CLASSES=('huge', )))
+
+    def test_transport_options_kept(self):
+        config = extensions.get_stage_config(
+            dict(STAGE_CONFIG, CELERY_BROKER_TRANSPORT_OPTIONS={'visibility_timeout': 7200}))
+
+        self.assertEqual({
+            'visibility_timeout': 7200,
+            'priority_steps': extensions.PRIORITY_STEPS
+        }, config['broker_transport_options'])
+
+    def test_route_task(self):
+        with mock.patch.object(extensions.celery, 'app', app, create=True), \
+                mock.patch.dict(app.config, {'ANALYSIS_QUEUE': 'cpu'}):
+            route = extensions.celery.route_task
+
+            self.assertEqual({'queue': 'hydration.small'},
+                             route(tasks.hydrate_extract.name, (), {}, {},
+                                   task=tasks.hydrate_extract))
+            self.assertEqual({'queue': 'cpu.small'},
+                             route(tasks.analyse_extract.name, (), {}, {},
+                                   task=tasks.analyse_extract))
+            self.assertIsNone(route('other', (), {}, {}, task=None))
+
+    def test_build_stages(self):
+        with app.app_context():
+            stages = tasks.build_stages('uuid', partial=True,
+                                        size_class='large', priority=2).tasks
+
+        self.assertEqual([tasks.hydrate_extract.name, tasks.analyse_extract.name],
+                         [stage.task for stage in stages])
+        self.assertTrue(all(stage.immutable for stage in stages))
+        self.assertEqual({'partial': True}, stages[1].kwargs)
+        self.assertEqual(['hydration.large', 'analysis.large'],
+                         [stage.options['queue'] for stage in stages])
+        self.assertEqual([2, 2], [stage.options['priority'] for stage in stages])
+
+
+class EstimateBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(extensions.FlaskRedis, 'client',
+                                    new_callable=mock.PropertyMock,
+                                    return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.dict(app.config, {
+            'HIT_RATE_SAMPLE_SIZE': 1000,
+            'SMALL_BUILD_MAX_LOOKUPS': 100,
+            'MEDIUM_BUILD_MAX_LOOKUPS': 1000,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+    def test_size_classes(self):
+        # Half cached and a quarter known to be unavailable
+        for tweet_id in range(0, 4000, 2):
+            self.redis.set(f'tweet_hydrated:{tweet_id}', b'{}')
+        for tweet_id in range(1, 4000, 4):
+            self.redis.set(f'tweet_missing:{tweet_id}', 1)
+
+        estimate = scheduling.estimate_build(list(range(400)))
+        self.assertEqual((400, 0.75, 100, 'small'), estimate)
+
+        self.assertEqual('medium', scheduling.estimate_build(list(range(3000))).size_class)
+        self.assertEqual('large', scheduling.estimate_build(list(range(4000, 5001))).size_class)
+
+    def test_sampled(self):
+        for tweet_id in range(0, 10**5, 2):
+            self.redis.set(f'tweet_hydrated:{tweet_id}', b'{}')
+
+        with mock.patch.object(self.redis, 'exists', wraps=self.redis.exists) as exists:
+            estimate = scheduling.estimate_hit_rate(list(range(0, 10**5, 2)), 10)
+
+        self.assertEqual(1.0, estimate)
+        self.assertEqual(10, exists.call_count)
+
+    def test_unreachable(self):
+        with mock.patch.object(scheduling, 'estimate_hit_rate',
+                               side_effect=ConnectionError):
+            self.assertEqual((2000, 0.0, 2000, 'large'),
+                             scheduling.estimate_build(list(range(2000))))
+
+
+class StageRetryTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        patcher = mock.patch.dict(app.config,
+                                  {'STAGING_DIR': pathlib.Path(tmp_dir.name)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+        self.extract = models.Extract(uuid='test-uuid',
+                                      email='test@example.com',
+                                      status=models.Extract.STATUS_PENDING)
+
+    def test_hydration_not_repeated(self):
+        staging = self.extract.get_staging()
+        staging.path.mkdir()
+        staging.merged_path.write_text('{"id": 1}\n')
+
+        with mock.patch.object(models.Extract, 'hydrate') as hydrate:
+            self.extract.hydrate_stage([1])
+
+        hydrate.assert_not_called()
+
+    def test_analysis_not_repeated(self):
+        with self.assertRaises(FileNotFoundError):
+            self.extract.analyse_stage()
+
+        # The previous attempt packaged the Bundle and cleared its staging area
+        self.extract.status = models.Extract.STATUS_COMPLETE
+        self.assertEqual('test-uuid', self.extract.analyse_stage())
+
+        # A partial Bundle does not count as a complete one
+        self.extract.status = models.Extract.STATUS_PARTIAL
+        self.assertEqual('test-uuid', self.extract.analyse_stage(partial=True))
+        with self.assertRaises(FileNotFoundError):
+            self.extract.analyse_stage()
+
+
+class FollowUpBuildTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_path = pathlib.Path(tmp_dir.name)
+
+        patcher = mock.patch.dict(app.config, {
+            'STAGING_DIR': self.tmp_path,
+            'OUTPUT_DIR': self.tmp_path,
+            'PLUGIN_CACHE_MAX_BYTES': 0,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+        self.extract = models.Extract(uuid='test-uuid',
+                                      email='test@example.com',
+                                      status=models.Extract.STATUS_PENDING,
+                                      started_at=None,
+                                      tweet_count=3,
+                                      skipped_count=0)
+
+        for target, kwargs in [
+            (models.Extract, {'query': mock.Mock(**{'get.return_value': self.extract})}),
+            (models.Extract, {'save': mock.DEFAULT}),
+            (models, {'get_plugins': mock.Mock(return_value=models.PluginCollection([]))}),
+        ]:
+            patcher = mock.patch.multiple(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(tasks, 'queue_build')
+        self.queue_build = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def hydrate(self, tweets):
+        staging = self.extract.get_staging(partial=True)
+        staging.path.mkdir(parents=True)
+        staging.merged_path.write_text(''.join(f'{{"id": {tweet_id}}}\n' for tweet_id in tweets))
+
+    def test_hydration_retried(self):
+        error = requests.exceptions.ConnectionError()
+        with mock.patch.object(models.Extract, 'hydrate_stage',
+                               side_effect=error) as hydrate_stage:
+            result = tasks.hydrate_extract.apply(('test-uuid', [1, 2, 3]), {'partial': True})
+
+        self.assertIs(error, result.result)
+        self.assertEqual(tasks.hydrate_extract.max_retries + 1, hydrate_stage.call_count)
+        # Only once the final attempt fails
+        self.queue_build.assert_called_once_with(self.extract, [1, 2, 3])
+
+    def test_hydration_retry_succeeds(self):
+        with mock.patch.object(models.Extract, 'hydrate_stage',
+                               side_effect=[requests.exceptions.ConnectionError(), None]):
+            result = tasks.hydrate_extract.apply(('test-uuid', [1, 2, 3]), {'partial': True})
+
+        self.assertEqual('test-uuid', result.result)
+        self.queue_build.assert_not_called()
+
+    def test_hydration_failed(self):
+        with mock.patch.object(models.Extract, 'hydrate_stage', side_effect=KeyError):
+            tasks.hydrate_extract.apply(('test-uuid', ), {'partial': True})
+
+        self.queue_build.assert_called_once_with(self.extract, None)
+
+    def test_full_build_failed(self):
+        with mock.patch.object(models.Extract, 'hydrate_stage',
+                               side_effect=requests.exceptions.ConnectionError):
+            tasks.hydrate_extract.apply(('test-uuid', ))
+
+        self.assertEqual(models.Extract.STATUS_FAILED, self.extract.status)
+        self.queue_build.assert_not_called()
+
+    def test_full_build_retry_succeeds(self):
+        with mock.patch.object(models.Extract, 'hydrate_stage',
+                               side_effect=[requests.exceptions.ConnectionError(), None]):
+            tasks.hydrate_extract.apply(('test-uuid', ))
+
+        self.assertEqual(models.Extract.STATUS_PENDING, self.extract.status)
+
+    def test_analysis_retried(self):
+        with mock.patch.object(models.Extract, 'analyse_stage',
+                               side_effect=requests.exceptions.ConnectionError):
+            tasks.analyse_extract.apply(('test-uuid', ), {'partial': True})
+
+        self.queue_build.assert_called_once_with(self.extract, None)
+
+    def test_partial_missing_tweets(self):
+        self.hydrate([1, 2])
+        result = tasks.analyse_extract.apply(('test-uuid', ), {'partial': True})
+
+        self.assertEqual('test-uuid', result.result)
+        self.assertEqual(models.Extract.STATUS_PARTIAL, self.extract.status)
+        self.assertEqual(2, self.extract.found_count)
+        self.queue_build.assert_called_once_with(self.extract)
+
+    def test_partial_found_all_tweets(self):
+        self.hydrate([1, 2, 3])
+        result = tasks.analyse_extract.apply(('test-uuid', ), {'partial': True})
+
+        self.assertEqual('test-uuid', result.result)
+        self.assertEqual(models.Extract.STATUS_COMPLETE, self.extract.status)
+        self.queue_build.assert_not_called()
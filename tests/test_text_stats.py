@@ -0,0 +1,135 @@
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from wdra_extender.extract import text_stats
+
+PLUGIN_DIR = pathlib.Path(__file__).resolve().parents[1].joinpath('plugins')
+TEXT_DIR = PLUGIN_DIR.joinpath('DOTEXTTABLE')
+CLOUD_DIR = PLUGIN_DIR.joinpath('DOWORDCLOUD')
+
+
+def make_tweet(text, hashtags=(), retweet=None):
+    tweet = {
+        'user': {'screen_name': 'alice'},
+        'full_text': text,
+        'entities': {'hashtags': [{'text': h} for h in hashtags]},
+    }
+    if retweet is not None:
+        tweet['retweeted_status'] = retweet
+
+    return tweet
+
+
+TWEETS = [
+    make_tweet('Open Data is great! @bob see https://t.co/abc #OpenData',
+               hashtags=['OpenData']),
+    make_tweet('Research data, open research...\nThe DATA again',
+               hashtags=['opendata', 'Science']),
+    # Retweets are counted from the original Tweet
+    make_tweet('RT @carol: ignored',
+               retweet=make_tweet('research and history of research data',
+                                  hashtags=['History'])),
+    # Combining marks are part of a hashtag to jq but not to Python's \w
+    make_tweet('#résumé café naïve data\x1cdata tab\tdata',
+               hashtags=['Résumé']),
+    make_tweet('data~science http://x.co/a\x1cb science science',
+               hashtags=[None, 'with\ttab']),
+    make_tweet("the the and isn't research history data"),
+]
+
+# jq stops at the first Tweet it cannot process
+BROKEN = [
+    {'user': {'screen_name': 'bob'}, 'text': 'no full text', 'entities': None},
+    make_tweet('science science science', hashtags=['Late']),
+]
+
+
+class TextStatsTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self._dir.name)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def stats(self, tweets, **kwargs):
+        stats = text_stats.TextStats(**kwargs)
+        stats.update(tweets)
+        return stats
+
+    def test_sanitise(self):
+        self.assertEqual(
+            ' see  ', text_stats.sanitise('@bob see https://t.co/abc #Tag'))
+        # Marks are word characters, U+001C is not whitespace
+        self.assertEqual(' x  y',
+                         text_stats.sanitise('#résumé x http://a\x1cb y'))
+
+    def test_language_table(self):
+        text_stats.write_language_table(self.stats(TWEETS), self.dir_path, TEXT_DIR)
+        rows = self.dir_path.joinpath('language.csv').read_text().splitlines()
+
+        self.assertEqual(text_stats.LANGUAGE_HEADER, rows[0])
+        # Ties are in reverse order, the empty hashtag first
+        self.assertEqual('\t1\t\tresearch\t5', rows[1])
+        self.assertEqual('history\t1\t\tdata\t5', rows[2])
+        self.assertEqual('opendata\t2\t\tscience\t2', rows[3])
+        self.assertEqual('résumé\t1\t\topen\t2', rows[4])
+        # Padded where there are fewer words than hashtags
+        self.assertEqual('with\\ttab\t1\t\t', rows[-1])
+
+    def test_stops_at_jq_error(self):
+        stats = self.stats(TWEETS + BROKEN)
+        expected = self.stats(TWEETS)
+
+        self.assertEqual(expected.hashtags, stats.hashtags)
+        self.assertEqual(expected.words, stats.words)
+
+    def test_merge_shards(self):
+        stats = self.stats(TWEETS[:2])
+        stats += self.stats(TWEETS[2:] + BROKEN)
+        stats += self.stats(TWEETS)
+
+        self.assertEqual(self.stats(TWEETS).words, stats.words)
+
+    def test_word_cloud(self):
+        stats = self.stats(TWEETS, hashtags=False, words=False, cloud=True)
+        text_stats.write_word_cloud(stats, self.dir_path, CLOUD_DIR)
+
+        self.assertTrue(self.dir_path.joinpath('wordcloud.png').is_file())
+        self.assertIn('Open Data is great   see', stats.text())
+
+    @unittest.skipUnless(shutil.which('jq'), 'requires jq')
+    def test_matches_shell_plugin(self):
+        tweets_file = self.dir_path.joinpath('tweets.json')
+        tweets_file.write_text(json.dumps(TWEETS + BROKEN))
+        env = os.environ.copy()
+        env.update({'BIN': str(TEXT_DIR), 'LC_ALL': 'C.UTF-8'})
+
+        shell_dir = self.dir_path.joinpath('shell')
+        shell_dir.mkdir()
+        subprocess.run(['sh', TEXT_DIR.joinpath('main.sh'), tweets_file],
+                       cwd=shell_dir,
+                       env=env,
+                       capture_output=True,
+                       check=True)
+
+        stats = self.stats(TWEETS + BROKEN)
+        text_stats.write_language_table(stats, self.dir_path, TEXT_DIR)
+        self.assertEqual(shell_dir.joinpath('language.csv').read_bytes(),
+                         self.dir_path.joinpath('language.csv').read_bytes())
+
+        # Text passed to wordcloud_cli by DOWORDCLOUD
+        proc = subprocess.run(
+            f"jq -r -M -f {CLOUD_DIR}/sanitised.jq {tweets_file} | "
+            "tr -cd '\t-~' | sed -e 's/[^A-Za-z0-9 ]/ /'",
+            shell=True,
+            env=env,
+            capture_output=True,
+            check=False)
+        stats = self.stats(TWEETS + BROKEN, hashtags=False, words=False, cloud=True)
+        self.assertEqual(proc.stdout.decode(), stats.text())
@@ -0,0 +1,120 @@
+import io
+import unittest
+from unittest import mock
+
+import numpy
+
+from wdra_extender.app import app
+from wdra_extender.extract import tweet_ids, views
+
+
+def read(text: str):
+    return tweet_ids.read_tweet_ids(io.BytesIO(text.encode('utf-8'))).tolist()
+
+
+class ReadTweetIdsTest(unittest.TestCase):
+    def test_plain(self):
+        self.assertEqual([3, 1, 2], read('3\n1\n\n2\r\n3\n1'))
+
+    def test_prefixed(self):
+        self.assertEqual([12, 34, 56, 78],
+                         read('ID:12\nid:34\n  Id: 56 \n78\n'))
+
+    def test_invalid(self):
+        for text, line_number in [('1\n2\nx3\n', 3), ('1\n\n2 3\n', 3),
+                                  ('-1', 1), ('ID:', 1), ('1\n1_0\n', 2),
+                                  ('+10', 1), ('ID:+10', 1)]:
+            with self.subTest(text=text):
+                with self.assertRaises(tweet_ids.TweetIdError) as context:
+                    read(text)
+
+                self.assertEqual(line_number, context.exception.line_number)
+
+    def test_chunks(self):
+        ids = list(range(10**18, 10**18 + 5000))
+        text = '\n'.join(f'ID:{i}' for i in ids + ids[:10])
+
+        with mock.patch.object(tweet_ids, 'CHUNK_SIZE', 1000):
+            self.assertEqual(ids, read(text))
+
+            with self.assertRaises(tweet_ids.TweetIdError) as context:
+                read(text + '\nbad')
+
+        self.assertEqual(len(ids) + 11, context.exception.line_number)
+
+    def test_csv(self):
+        self.assertEqual(
+            [12, 34],
+            read('﻿date,Tweet ID,text\n2020-01-01,ID:12,"a, b"\n'
+                 '2020-01-02,ID:34,"multi\nline"\n,,\n2020-01-03,ID:12,c\n'))
+
+        # No recognised header
+        self.assertEqual([12, 34], read('12,a\n34,b\n'))
+        self.assertEqual([12, 34], read('tweet,x\n12,a\n34,b\n'))
+
+        with self.assertRaises(tweet_ids.TweetIdError) as context:
+            read('id,text\n12,a\nb,c\n')
+
+        self.assertEqual(3, context.exception.line_number)
+
+    def test_encode(self):
+        ids = numpy.array([2**63 + 5, 3, 1], dtype=numpy.uint64)
+        self.assertEqual(
+            ids.tolist(),
+            tweet_ids.decode_tweet_ids(tweet_ids.encode_tweet_ids(ids)).tolist())
+
+
+class SubmittedTweetIdsTest(unittest.TestCase):
+    def submitted(self, **data):
+        with app.test_request_context('/extracts/',
+                                      method='POST',
+                                      data=data,
+                                      content_type='multipart/form-data'):
+            return views.get_submitted_tweet_ids().tolist()
+
+    def test_form(self):
+        self.assertEqual([1, 2], self.submitted(tweet_ids='ID:1\n2\n1'))
+
+    def test_file(self):
+        self.assertEqual(
+            [3, 4],
+            self.submitted(tweet_ids='1',
+                           tweet_ids_file=(io.BytesIO(b'id\n3\n4\n'), 'ids.csv')))
+
+    def test_invalid(self):
+        for data in [{'tweet_ids': ''}, {'tweet_ids': '1\nx'}]:
+            with self.subTest(data=data):
+                with self.assertRaises(views.ValidationError):
+                    self.submitted(**data)
+
+
+class TweetIdSetTest(unittest.TestCase):
+    def test_set_operations(self):
+        id_set = tweet_ids.TweetIdSet([5, 2**63 + 1, 3, 3])
+
+        self.assertEqual([3, 5, 2**63 + 1], list(id_set))
+        self.assertEqual(3, len(id_set))
+        self.assertIn(2**63 + 1, id_set)
+        self.assertNotIn(4, id_set)
+        self.assertNotIn(-1, id_set)
+        self.assertEqual({5, 2**63 + 1}, id_set - {3, 7})
+        self.assertEqual({3}, id_set & tweet_ids.TweetIdSet([3, 7]))
+        self.assertEqual({1, 3, 5, 2**63 + 1}, id_set | iter([1, 3]))
+
+        id_set -= [3, 5]
+        self.assertIsInstance(id_set, tweet_ids.TweetIdSet)
+        self.assertEqual([2**63 + 1], list(id_set))
+
+    def test_empty(self):
+        id_set = tweet_ids.TweetIdSet()
+
+        self.assertFalse(id_set)
+        self.assertEqual([], list(id_set - [1]))
+        self.assertNotIn(1, id_set)
+
+    def test_iterates_ints(self):
+        with mock.patch.object(tweet_ids, 'ITER_BATCH_SIZE', 2):
+            values = list(tweet_ids.TweetIdSet(numpy.arange(5, dtype=numpy.uint64)))
+
+        self.assertEqual([0, 1, 2, 3, 4], values)
+        self.assertIs(int, type(values[0]))
@@ -1,8 +1,25 @@
+import time
 import typing
 import unittest
+from unittest import mock
 
+from wdra_extender import extensions
+from wdra_extender.app import app
 from wdra_extender.extract import tweet_providers
-from .mocks.tweet_provider import TEST_TWEET_IDS, TEST_TWEETS
+from .mocks.redis_client import FakeRedis
+from .mocks.tweet_provider import TEST_TWEET_IDS, TEST_TWEETS, tweet_provider
+
+PROVIDER = 'tests.test_tweet_providers.recording_provider'
+
+#: Tweet IDs requested from `recording_provider`
+requested_ids = set()
+
+
+def recording_provider(tweet_ids: typing.Iterable[int]) -> typing.Iterator[typing.Mapping]:
+    """Mock tweet provider which records the Tweet IDs requested from it."""
+    tweet_ids = set(tweet_ids)
+    requested_ids.update(tweet_ids)
+    yield from tweet_provider(tweet_ids)
 
 
 class TweetProvidersTest(unittest.TestCase):
@@ -11,3 +28,80 @@ class TweetProvidersTest(unittest.TestCase):
             TEST_TWEET_IDS, ['tests.mocks.tweet_provider.tweet_provider'])
 
         self.assertEqual(TEST_TWEETS, tweets)
+
+    def test_iter_tweets_stats(self):
+        stats = typing.Counter()
+        missing_ids = {6, 7}
+        tweets = list(
+            tweet_providers.iter_tweets(
+                TEST_TWEET_IDS | missing_ids,
+                ['tests.mocks.tweet_provider.tweet_provider'],
+                stats=stats))
+
+        self.assertEqual(TEST_TWEETS, tweets)
+        self.assertEqual(len(TEST_TWEETS), stats['tweet_provider'])
+        self.assertEqual(len(missing_ids), stats['not_found'])
+        self.assertEqual(0, stats['skipped'])
+
+
+class MissingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(extensions.FlaskRedis, 'client',
+                                    new_callable=mock.PropertyMock,
+                                    return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.dict(app.config, {'REDIS_MISSING_CACHE_TIME': 60})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+    def hydrate(self, tweet_ids):
+        requested_ids.clear()
+        stats = typing.Counter()
+        tweets = list(tweet_providers.iter_tweets(tweet_ids, [PROVIDER], stats=stats))
+
+        return tweets, stats, set(requested_ids)
+
+    def test_missing_recorded_then_skipped(self):
+        missing_ids = {6, 7}
+        tweets, stats, requested = self.hydrate(TEST_TWEET_IDS | missing_ids)
+
+        self.assertEqual(TEST_TWEETS, tweets)
+        self.assertEqual(TEST_TWEET_IDS | missing_ids, requested)
+        self.assertEqual(len(missing_ids), stats['not_found'])
+        self.assertEqual(missing_ids, set(tweet_providers.get_missing(range(10))))
+
+        # Known missing Tweets are not requested again
+        tweets, stats, requested = self.hydrate(TEST_TWEET_IDS | missing_ids)
+
+        self.assertEqual(TEST_TWEETS, tweets)
+        self.assertEqual(TEST_TWEET_IDS, requested)
+        self.assertEqual(len(missing_ids), stats['skipped'])
+        self.assertEqual(0, stats['not_found'])
+
+    def test_missing_expires(self):
+        now = time.monotonic()
+        self.redis.clock = lambda: now
+        self.hydrate({1, 6})
+
+        now += 59
+        self.assertEqual({6}, set(tweet_providers.get_missing([1, 6])))
+
+        # Tweets may become available again, e.g. when unprotected
+        now += 2
+        self.assertEqual(set(), set(tweet_providers.get_missing([1, 6])))
+        _, stats, requested = self.hydrate({1, 6})
+        self.assertEqual({1, 6}, requested)
+        self.assertEqual(0, stats['skipped'])
+
+    def test_disabled(self):
+        with mock.patch.dict(app.config, {'REDIS_MISSING_CACHE_TIME': 0}):
+            self.hydrate({1, 6})
+
+        self.assertEqual({}, self.redis.data)
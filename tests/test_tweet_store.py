@@ -0,0 +1,135 @@
+import json
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from wdra_extender.extract import tweet_store
+from .mocks.tweet_provider import TEST_TWEETS
+
+
+class TweetStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_path = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_ndjson_round_trip(self):
+        path = self.dir_path.joinpath('tweets.jsonl')
+
+        count = tweet_store.write_ndjson(iter(TEST_TWEETS), path)
+
+        self.assertEqual(len(TEST_TWEETS), count)
+        self.assertEqual(len(TEST_TWEETS), len(path.read_text().splitlines()))
+        self.assertEqual(TEST_TWEETS, list(tweet_store.iter_ndjson(path)))
+
+    def test_tweet_view_parses_on_first_use(self):
+        path = self.dir_path.joinpath('tweets.jsonl')
+        tweet_store.write_ndjson(TEST_TWEETS, path)
+
+        view = tweet_store.TweetView(path)
+        path.unlink()
+        with self.assertRaises(FileNotFoundError):
+            len(view)
+
+        tweet_store.write_ndjson(TEST_TWEETS, path)
+        self.assertEqual(len(TEST_TWEETS), len(view))
+        # Iterating streams from the file rather than loading every Tweet
+        self.assertEqual(TEST_TWEETS, list(view))
+        self.assertIsNone(view._tweets)
+
+        self.assertEqual(TEST_TWEETS[0], view[0])
+        # Not parsed again once indexed
+        path.unlink()
+        self.assertEqual(TEST_TWEETS, list(view))
+        self.assertEqual(len(TEST_TWEETS), len(view))
+
+    def test_iter_tweets_file_json_array(self):
+        path = self.dir_path.joinpath('tweets.json')
+        path.write_text(json.dumps(TEST_TWEETS))
+
+        self.assertEqual(TEST_TWEETS, list(tweet_store.iter_tweets_file(path)))
+
+    def test_count_ndjson(self):
+        path = self.dir_path.joinpath('tweets.jsonl')
+        tweet_store.write_ndjson(TEST_TWEETS, path)
+
+        self.assertEqual(len(TEST_TWEETS), tweet_store.count_ndjson(path))
+
+    def test_ndjson_to_json_array(self):
+        ndjson_path = self.dir_path.joinpath('tweets.jsonl')
+        json_path = self.dir_path.joinpath('tweets.json')
+        tweet_store.write_ndjson(TEST_TWEETS, ndjson_path)
+
+        tweet_store.ndjson_to_json_array(ndjson_path, json_path)
+
+        with open(json_path) as json_in:
+            self.assertEqual(TEST_TWEETS, json.load(json_in))
+
+    def test_empty_json_array(self):
+        ndjson_path = self.dir_path.joinpath('tweets.jsonl')
+        json_path = self.dir_path.joinpath('tweets.json')
+        tweet_store.write_ndjson([], ndjson_path)
+
+        tweet_store.ndjson_to_json_array(ndjson_path, json_path)
+
+        with open(json_path) as json_in:
+            self.assertEqual([], json.load(json_in))
+
+
+class StagingAreaTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.staging = tweet_store.StagingArea(
+            pathlib.Path(self.tmp_dir.name).joinpath('extract'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_checkpoint_and_merge(self):
+        self.staging.prepare(5, 3)
+        self.staging.write_chunk(0, TEST_TWEETS[:3])
+        self.staging.write_chunk(1, TEST_TWEETS[3:])
+        merged = self.staging.path.joinpath('tweets.jsonl')
+
+        self.staging.merge(merged, 2)
+
+        self.assertTrue(self.staging.is_complete(1))
+        self.assertEqual(TEST_TWEETS, list(tweet_store.iter_ndjson(merged)))
+
+    def test_resume_keeps_checkpoints(self):
+        self.staging.prepare(5, 3)
+        self.staging.write_chunk(0, TEST_TWEETS[:3])
+
+        self.staging.prepare(5, 3)
+
+        self.assertTrue(self.staging.is_complete(0))
+        self.assertFalse(self.staging.is_complete(1))
+
+    def test_changed_chunk_size_discards_checkpoints(self):
+        self.staging.prepare(5, 3)
+        self.staging.write_chunk(0, TEST_TWEETS[:3])
+
+        self.staging.prepare(5, 2)
+
+        self.assertFalse(self.staging.is_complete(0))
+
+    def test_checkpoint_is_flushed_before_rename(self):
+        self.staging.prepare(5, 3)
+        calls = []
+        replace = os.replace
+
+        def record_replace(*args):
+            calls.append('replace')
+            replace(*args)
+
+        with mock.patch('os.fsync', side_effect=lambda fd: calls.append('fsync')), \
+                mock.patch('os.replace', side_effect=record_replace):
+            self.staging.write_chunk(0, TEST_TWEETS[:3])
+
+        # The file, then the directory after the rename
+        self.assertEqual(['fsync', 'replace', 'fsync'], calls)
+        self.assertTrue(self.staging.is_complete(0))
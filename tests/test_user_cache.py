@@ -0,0 +1,93 @@
+import unittest
+from unittest import mock
+
+from wdra_extender import extensions
+from wdra_extender.app import app
+from wdra_extender.extract import cache_codec, tweet_providers, user_cache
+from .mocks.redis_client import FakeRedis
+
+USER_A = {'id': 1, 'screen_name': 'a', 'followers_count': 10}
+USER_B = {'id': 2, 'screen_name': 'b', 'followers_count': 20}
+
+RETWEET = {
+    'id': 100,
+    'user': USER_A,
+    'retweeted_status': {
+        'id': 99,
+        'user': USER_B,
+    },
+}
+
+
+class UserCacheTest(unittest.TestCase):
+    def test_split_users(self):
+        tweet, users = user_cache.split_users(RETWEET)
+
+        ref_a, ref_b = user_cache.user_ref(USER_A), user_cache.user_ref(USER_B)
+        self.assertEqual({ref_a: USER_A, ref_b: USER_B}, users)
+        self.assertEqual({ref_a, ref_b}, user_cache.user_refs(tweet))
+        self.assertNotIn('screen_name', tweet['user'])
+        self.assertNotIn('screen_name', tweet['retweeted_status']['user'])
+        # Original is unchanged
+        self.assertEqual(USER_A, RETWEET['user'])
+
+    def test_user_ref_depends_on_contents(self):
+        ref = user_cache.user_ref(USER_A)
+
+        self.assertEqual(ref, user_cache.user_ref(dict(reversed(list(USER_A.items())))))
+        self.assertNotEqual(ref, user_cache.user_ref(dict(USER_A, followers_count=11)))
+        self.assertEqual(1, ref[0])
+
+    def test_join_users(self):
+        tweet, users = user_cache.split_users(RETWEET)
+
+        self.assertEqual(RETWEET, user_cache.join_users(tweet, users))
+
+    def test_join_missing_user(self):
+        tweet, _ = user_cache.split_users(RETWEET)
+
+        self.assertIsNone(
+            user_cache.join_users(tweet, {user_cache.user_ref(USER_A): USER_A}))
+
+    def test_join_unhashed_ref(self):
+        # As cached before snapshots were hashed
+        tweet = {'id': 100, 'user': {'id': 1, user_cache.USER_REF_KEY: True}}
+
+        self.assertEqual({(1, None)}, user_cache.user_refs(tweet))
+        self.assertEqual({'id': 100, 'user': USER_A},
+                         user_cache.join_users(tweet, {(1, None): USER_A}))
+
+    def test_no_refs_in_full_tweet(self):
+        self.assertEqual(set(), user_cache.user_refs(RETWEET))
+
+
+class UserSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(extensions.FlaskRedis, 'client',
+                                    new_callable=mock.PropertyMock,
+                                    return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+    def test_tweets_keep_their_snapshot(self):
+        later_a = dict(USER_A, followers_count=11)
+        tweets = [{'id': 1, 'user': USER_A}, {'id': 2, 'user': later_a}]
+
+        tweet_providers.save_to_redis(tweets[:1])
+        tweet_providers.save_to_redis(tweets[1:])
+
+        # Each Tweet is read back with the user as it was hydrated
+        self.assertEqual(tweets, list(tweet_providers.redis_provider([1, 2])))
+        # The latest snapshot is found by ID
+        self.assertEqual({1: later_a}, user_cache.get_users([1, 2]))
+
+    def test_get_unhashed_user(self):
+        codec = cache_codec.get_codec(app.config)
+        self.redis.set(user_cache.user_key(1), codec.encode(USER_A))
+
+        self.assertEqual({1: USER_A}, user_cache.get_users([1]))
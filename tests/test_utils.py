@@ -0,0 +1,40 @@
+import threading
+import time
+import unittest
+
+from wdra_extender.extract import utils
+
+
+class BatchedTest(unittest.TestCase):
+    def test_batched(self):
+        self.assertEqual([[0, 1, 2], [3, 4]], list(utils.batched(range(5), 3)))
+
+    def test_batched_empty(self):
+        self.assertEqual([], list(utils.batched([], 3)))
+
+
+class BoundedMapTest(unittest.TestCase):
+    def test_results_in_order(self):
+        def slow_square(x):
+            time.sleep(0.01 * (5 - x))
+            return x * x
+
+        self.assertEqual([0, 1, 4, 9, 16],
+                         list(utils.bounded_map(slow_square, range(5), 3)))
+
+    def test_bounded_concurrency(self):
+        lock = threading.Lock()
+        in_flight = []
+        max_in_flight = []
+
+        def track(x):
+            with lock:
+                in_flight.append(x)
+                max_in_flight.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.remove(x)
+
+        list(utils.bounded_map(track, range(10), 2))
+
+        self.assertLessEqual(max(max_in_flight), 2)
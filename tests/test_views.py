@@ -0,0 +1,98 @@
+import pathlib
+import tempfile
+import unittest
+import uuid
+
+from wdra_extender.app import app
+
+EXTRACT_UUID = uuid.UUID('12345678-1234-5678-1234-567812345678')
+
+
+class DownloadExtractTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = pathlib.Path(self.tmp_dir.name)
+        self.content = bytes(range(256)) * 100
+        self.output_dir.joinpath(f'{EXTRACT_UUID}.zip').write_bytes(self.content)
+
+        self.config = {key: app.config[key] for key in
+                       ['OUTPUT_DIR', 'DOWNLOAD_OFFLOAD', 'DOWNLOAD_OFFLOAD_PREFIX']}
+        app.config.update(OUTPUT_DIR=self.output_dir,
+                          DOWNLOAD_OFFLOAD='',
+                          DOWNLOAD_OFFLOAD_PREFIX='/protected/')
+        self.client = app.test_client()
+        self.url = f'/extracts/{EXTRACT_UUID}/fetch'
+
+    def tearDown(self):
+        app.config.update(self.config)
+        self.tmp_dir.cleanup()
+
+    def test_download(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.content, response.data)
+        self.assertEqual('application/zip', response.mimetype)
+        self.assertIn(f'filename={EXTRACT_UUID}.zip',
+                      response.headers['Content-Disposition'])
+        self.assertTrue(response.get_etag()[0].startswith(str(EXTRACT_UUID)))
+        self.assertEqual('bytes', response.headers['Accept-Ranges'])
+        response.close()
+
+    def test_missing(self):
+        response = self.client.get(f'/extracts/{uuid.uuid4()}/fetch')
+        self.assertEqual(404, response.status_code)
+
+    def test_conditional(self):
+        etag = self.client.get(self.url).get_etag()[0]
+
+        response = self.client.get(self.url, headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.data)
+
+        # Rebuilt Bundles have a new tag
+        self.output_dir.joinpath(f'{EXTRACT_UUID}.zip').write_bytes(b'new')
+        response = self.client.get(self.url, headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'new', response.data)
+        response.close()
+
+    def test_resume(self):
+        etag = self.client.get(self.url).get_etag()[0]
+
+        response = self.client.get(self.url,
+                                   headers={'Range': 'bytes=1000-',
+                                            'If-Range': f'"{etag}"'})
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(self.content[1000:], response.data)
+        self.assertEqual(f'bytes 1000-{len(self.content) - 1}/{len(self.content)}',
+                         response.headers['Content-Range'])
+        response.close()
+
+        # Restarts from the beginning if the Bundle has changed
+        response = self.client.get(self.url,
+                                   headers={'Range': 'bytes=1000-',
+                                            'If-Range': '"old"'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.content, response.data)
+        response.close()
+
+    def test_offload(self):
+        for offload, header, value in [
+            ('x-accel-redirect', 'X-Accel-Redirect', f'/protected/{EXTRACT_UUID}.zip'),
+            ('x-sendfile', 'X-Sendfile',
+             str(self.output_dir.joinpath(f'{EXTRACT_UUID}.zip').absolute())),
+        ]:
+            with self.subTest(offload=offload):
+                app.config['DOWNLOAD_OFFLOAD'] = offload
+                response = self.client.get(self.url)
+
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(value, response.headers[header])
+                self.assertEqual(b'', response.data)
+                self.assertIn('attachment', response.headers['Content-Disposition'])
+
+                etag = response.get_etag()[0]
+                response = self.client.get(self.url,
+                                           headers={'If-None-Match': f'"{etag}"'})
+                self.assertEqual(304, response.status_code)
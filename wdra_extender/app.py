@@ -7,10 +7,13 @@ This is the entrypoint to WDRA-Extender.
 
 import importlib
 
-from flask import Flask, render_template, request
+from flask import Flask, Response, jsonify, render_template, request
 
 from wdra_extender import extract
-from wdra_extender.extensions import celery, db, migrate
+from wdra_extender.extract import metrics, status_metrics
+from wdra_extender.extensions import celery, db, migrate, redis_pool
+from wdra_extender.extract.commands import plugins_cli
+from wdra_extender.extract.plugins import plugin_registry
 
 __all__ = [
     'app',
@@ -33,6 +36,7 @@ def create_app(config_module='wdra_extender.settings'):
 
     register_extensions(app)
     register_blueprints(app)
+    register_commands(app)
 
     return app
 
@@ -53,6 +57,10 @@ def register_extensions(app) -> None:
 
     db.init_app(app)
     migrate.init_app(app, db)
+    redis_pool.init_app(app)
+    plugin_registry.init_app(app)
+    metrics.init_app(app)
+    status_metrics.init_app(app)
 
 
 def register_blueprints(app) -> None:
@@ -63,6 +71,14 @@ def register_blueprints(app) -> None:
     app.register_blueprint(extract.views.blueprint)
 
 
+def register_commands(app) -> None:
+    """Register all CLI commands with the Flask controller.
+
+    :param app: Flask App which commands should be registered to.
+    """
+    app.cli.add_command(plugins_cli)
+
+
 app = create_app()  # pylint: disable=invalid-name
 
 
@@ -76,3 +92,22 @@ def log_request():
 def index():
     """Static page where users will land when first accessing WDRA-Extender."""
     return render_template('index.html')
+
+
+@app.route('/health')
+def health():
+    """Report health and latency metrics of Redis.
+
+    Responds with status 503 if Redis cannot be reached, so load balancers
+    and orchestrators can act on it.  The build queues and caches are
+    reported at ``/metrics`` - see :mod:`wdra_extender.extract.status_metrics`.
+    """
+    redis_health = redis_pool.health()
+    return jsonify(redis=redis_health), 200 if redis_health['healthy'] else 503
+
+
+@app.route('/metrics')
+def export_metrics():
+    """Export metrics of requests, build queues and caches, and of builds run within the app."""
+    body, content_type = metrics.render(status_metrics.get_registry(app))
+    return Response(body, content_type=content_type)
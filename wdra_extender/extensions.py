@@ -1,18 +1,85 @@
 """Module containing setup code for Flask extensions."""
+import contextlib
+import threading
+import time
 import typing
 
 from celery import Celery
 import flask
+from kombu import Exchange, Queue
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+import redis
 
 __all__ = [
     'celery',
     'db',
     'migrate',
+    'redis_pool',
 ]
 
 
+#: Stages of a Bundle build - tasks of each stage are sent to the queue
+#: `<STAGE>_QUEUE` and served with the settings `<STAGE>_WORKER_*`
+BUILD_STAGES = ('hydration', 'analysis')
+
+#: Size classes of Bundle builds, smallest first - each stage has a queue for each
+#: See :mod:`wdra_extender.extract.scheduling`
+SIZE_CLASSES = ('small', 'medium', 'large')
+
+#: Number of priority levels within each queue - see `scheduling.MAX_PRIORITY`
+PRIORITY_STEPS = list(range(10))
+
+
+def get_stage_queue(config: typing.Mapping, stage: str, size_class: str = 'small') -> str:
+    """Get the name of the Celery queue for builds of a stage and size class."""
+    return f'{config[f"{stage.upper()}_QUEUE"]}.{size_class}'
+
+
+def get_stage_config(config: typing.Mapping) -> typing.Dict[str, typing.Any]:
+    """Get the Celery queue and worker settings for the build stages.
+
+    A worker consumes the queue of the stage named by `WORKER_STAGE`, with
+    that stage's concurrency and prefetch settings.  If no stage is named
+    it consumes every stage's queue.  Of these, it consumes the queues of
+    the size classes in `WORKER_SIZE_CLASSES`, taking from each in turn.
+
+    Broker transport options given by `CELERY_BROKER_TRANSPORT_OPTIONS`, such
+    as the ``visibility_timeout`` which redelivers unacknowledged tasks, are
+    kept alongside the priority steps.
+
+    :param config: Flask config dictionary.
+    """
+    stage = config['WORKER_STAGE']
+    if stage is not None and stage not in BUILD_STAGES:
+        raise ValueError(f'Unknown build stage: {stage}')
+
+    unknown = set(config['WORKER_SIZE_CLASSES']) - set(SIZE_CLASSES)
+    if unknown:
+        raise ValueError(f'Unknown build size classes: {", ".join(sorted(unknown))}')
+
+    stages = BUILD_STAGES if stage is None else (stage, )
+    queues = [
+        get_stage_queue(config, s, size_class) for s in stages
+        for size_class in SIZE_CLASSES if size_class in config['WORKER_SIZE_CLASSES']
+    ]
+    transport_options = dict(config.get('CELERY_BROKER_TRANSPORT_OPTIONS') or {})
+    transport_options['priority_steps'] = PRIORITY_STEPS
+
+    stage_config = {
+        'task_queues': [Queue(q, Exchange(q), routing_key=q) for q in queues],
+        # Long tasks should not wait behind one another in a busy worker
+        'worker_prefetch_multiplier': min(
+            config[f'{s.upper()}_WORKER_PREFETCH'] for s in stages),
+        'broker_transport_options': transport_options,
+    }
+
+    if stage is not None:
+        stage_config['worker_concurrency'] = config[f'{stage.upper()}_WORKER_CONCURRENCY']
+
+    return stage_config
+
+
 class FlaskCelery(Celery):
     """Celery wrapper to support binding of the Flask context.
 
@@ -56,8 +123,155 @@ class FlaskCelery(Celery):
 
         self.app = app
         self.config_from_object(get_celery_keys(app.config))
+        self.conf.update(task_routes=(self.route_task, ),
+                         **get_stage_config(app.config))
+
+    def route_task(self, name, args, kwargs, options, task=None, **kw):
+        """Route a task to the queue of its build stage, if it has one.
+
+        The stage is given by the `stage` option of the task decorator.
+        Tasks are sent to the queue for small builds unless another queue is
+        given when they are sent - see `tasks.build_stages`.
+        """
+        # pylint: disable=too-many-arguments,unused-argument
+        stage = getattr(task, 'stage', None)
+        if stage is None:
+            return None
+
+        return {'queue': get_stage_queue(self.app.config, stage)}
+
+
+class LatencyStats:
+    """Running latency statistics for a single kind of Redis operation."""
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, duration: float, error: bool = False) -> None:
+        """Record a single operation."""
+        self.count += 1
+        self.errors += int(error)
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        """Summarise these statistics with durations in milliseconds."""
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': 1000 * self.total / self.count if self.count else None,
+            'max_ms': 1000 * self.max,
+        }
+
+
+class CountingConnectionPool(redis.BlockingConnectionPool):
+    """Blocking Redis connection pool which counts the connections it has created.
+
+    The count starts again when the pool is reset, as after a fork.
+    """
+    def __init__(self, *args, **kwargs):
+        self._count_lock = threading.Lock()
+        self.created_connections = 0
+        super().__init__(*args, **kwargs)
+
+    def reset(self):
+        with self._count_lock:
+            self.created_connections = 0
+
+        super().reset()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        with self._count_lock:
+            self.created_connections += 1
+
+        return connection
+
+
+class FlaskRedis:
+    """Redis connection pool shared by all cache code within a process.
+
+    Connections are reused across requests and Celery tasks rather than
+    opened for each use.  Connection pools are safe to share across a fork -
+    each child process will create its own connections.
+    """
+    def __init__(self, app=None):
+        self.app = None
+        self.pool = None
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize the connection pool from the Flask app config dictionary.
+
+        No connections are made until the pool is first used.
+        """
+        config = app.config
+        self.app = app
+        self.pool = CountingConnectionPool(
+            host=config['REDIS_HOST'],
+            port=config['REDIS_PORT'],
+            db=config['REDIS_DB'],
+            max_connections=config['REDIS_POOL_SIZE'],
+            timeout=config['REDIS_POOL_TIMEOUT'],
+            socket_timeout=config['REDIS_SOCKET_TIMEOUT'],
+            socket_connect_timeout=config['REDIS_CONNECT_TIMEOUT'])
+
+    @property
+    def client(self) -> redis.Redis:
+        """Get a Redis client which uses the shared connection pool."""
+        if self.pool is None:
+            raise RuntimeError('Redis connection pool has not been initialised')
+
+        return redis.Redis(connection_pool=self.pool)
+
+    @contextlib.contextmanager
+    def timed(self, operation: str):
+        """Context manager to record the latency of a Redis operation."""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+
+        except redis.exceptions.RedisError:
+            error = True
+            raise
+
+        finally:
+            duration = time.perf_counter() - start
+            with self._stats_lock:
+                self._stats.setdefault(operation,
+                                       LatencyStats()).record(duration, error)
+
+    def health(self) -> typing.Dict[str, typing.Any]:
+        """Check the Redis connection and report pool and latency metrics."""
+        try:
+            with self.timed('ping'):
+                self.client.ping()
+            healthy = True
+
+        except redis.exceptions.RedisError:
+            healthy = False
+
+        with self._stats_lock:
+            latency = {op: stats.as_dict() for op, stats in self._stats.items()}
+
+        return {
+            'healthy': healthy,
+            'pool': {
+                'max_connections': self.pool.max_connections,
+                'created_connections': self.pool.created_connections,
+            },
+            'latency': latency,
+        }
 
 
 celery = FlaskCelery()  # pylint: disable=invalid-name
 db = SQLAlchemy()  # pylint: disable=invalid-name
 migrate = Migrate()  # pylint: disable=invalid-name
+redis_pool = FlaskRedis()  # pylint: disable=invalid-name
@@ -0,0 +1,563 @@
+"""Module containing a native Python engine for the DOACCOUNTSTABLE plugin.
+
+This produces the same files as ``plugins/DOACCOUNTSTABLE/main.sh``, byte
+for byte, including its ``00*`` intermediate files, from a single pass over
+the Tweets.  The shell pipeline passes data between jq, awk, sort and join
+as text, so values here are formatted, compared and sorted the way those
+tools do it - see the helpers prefixed ``_jq`` and ``_awk``.  Numbers are
+formatted as by jq 1.6 and mawk, as installed in the Docker image.
+"""
+
+import collections
+import csv
+import json
+import pathlib
+import re
+import shutil
+import string
+import typing
+
+from flask import current_app
+from twarc import Twarc
+
+from .mapreduce import MapReducePlugin
+from .tweet_store import iter_ndjson
+
+__all__ = [
+    'AccountsTable',
+    'AccountsTablePlugin',
+    'lookup_users',
+    'write_account_files',
+    'write_accounts_table',
+]
+
+#: Header row of ``accounts.csv``
+ACCOUNTS_HEADER = '\t'.join([
+    'Account', 'Author', 'Author+Retweets', 'Mentions', 'Mentions+Retweets',
+    'Name', 'Description', 'Location', 'URL', 'Followers', 'Friends',
+    'Statuses', 'Registration'
+])
+
+#: Fields beyond this are dropped by ``cut -f ...-999``
+MAX_FIELDS = 999
+
+#: Largest magnitude which mawk formats as an integer rather than with ``%.6g``
+AWK_MAX_INT = 2**31 - 1
+
+_AWK_NUMBER_PREFIX = re.compile(
+    r'[ \t\n]*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+_AWK_STRNUM = re.compile(
+    r'[ \t\n]*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?[ \t\n]*')
+_AWK_SPACE = re.compile(r'[ \t\n]+')
+_AWK_STRNUM_START = frozenset('0123456789+-. \t\n')
+_DIGITS = re.compile(r'[0-9]+')
+
+
+def _jq_number(value: typing.Union[int, float]) -> str:
+    """Format a number as jq 1.6 outputs it."""
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e17:
+        value = int(value)
+
+    if isinstance(value, int) and abs(value) < 10**17:
+        return str(value)
+
+    return repr(float(value))
+
+
+def _jq_cell(value: typing.Any) -> str:
+    """Format a value as a field of jq's ``@tsv`` output."""
+    if isinstance(value, str):
+        if '\\' in value or '\t' in value or '\r' in value or '\n' in value:
+            return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                    .replace('\r', '\\r').replace('\n', '\\n'))
+        return value
+
+    if value is None:
+        return ''
+
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+
+    if isinstance(value, (int, float)):
+        return _jq_number(value)
+
+    raise TypeError(f'{type(value).__name__} is not valid in a TSV row')
+
+
+def _jq_add(left: typing.Any, right: typing.Any) -> typing.Any:
+    """Add two values as jq does, where null is the identity."""
+    if left is None:
+        return right
+
+    if right is None:
+        return left
+
+    return left + right
+
+
+def _jq_get(obj: typing.Any, *path: typing.Union[str, int]) -> typing.Any:
+    """Follow a path through nested objects as jq does, where null absorbs."""
+    for key in path:
+        if obj is None:
+            return None
+
+        if isinstance(key, int):
+            obj = obj[key] if key < len(obj) else None
+
+        else:
+            obj = obj.get(key)
+
+    return obj
+
+
+def _jq_sort_key(value: typing.Any) -> typing.Tuple:
+    """Key ordering values as jq does: null, booleans, numbers then strings."""
+    if value is None:
+        return (0, 0)
+
+    if isinstance(value, bool):
+        return (1, value)
+
+    if isinstance(value, (int, float)):
+        return (2, value)
+
+    if isinstance(value, str):
+        return (3, value)
+
+    return (4, json.dumps(value, sort_keys=True))
+
+
+def _jq_unique(values: typing.List) -> typing.List:
+    """Sort and remove duplicates from a list as jq's ``unique`` does."""
+    strings = [value for value in values if isinstance(value, str)]
+    if len(strings) + values.count(None) == len(values):
+        # Common case of screen names - null sorts first
+        return [None] * (None in values) + sorted(set(strings))
+
+    result = []
+    last = None
+    for value in sorted(values, key=_jq_sort_key):
+        key = _jq_sort_key(value)
+        if not result or key != last:
+            result.append(value)
+            last = key
+
+    return result
+
+
+def _jq_to_awk(value: typing.Any) -> typing.Union[int, float]:
+    """Convert a value to the number awk reads from jq's ``@tsv`` output."""
+    if isinstance(value, int) and not isinstance(value, bool) and abs(value) < 2**53:
+        return value
+
+    return _awk_number(_jq_cell(value))
+
+
+def _awk_number(text: str) -> typing.Union[int, float]:
+    """Convert a field to a number as awk does, using its numeric prefix."""
+    if text.isdigit():
+        return int(text)
+
+    match = _AWK_NUMBER_PREFIX.match(text)
+    return float(match.group()) if match else 0
+
+
+def _awk_str(number: typing.Union[int, float]) -> str:
+    """Convert a number to a string as mawk does."""
+    if -AWK_MAX_INT <= number <= AWK_MAX_INT and number == int(number):
+        return str(int(number))
+
+    return '%.6g' % number
+
+
+def _awk_differ(left: str, right: str) -> bool:
+    """Compare two fields as awk's ``!=`` does.
+
+    Fields which both look like numbers are compared as numbers.
+    """
+    if left == right:
+        return False
+
+    if (left[0] in _AWK_STRNUM_START and right[0] in _AWK_STRNUM_START
+            and _AWK_STRNUM.fullmatch(left) and _AWK_STRNUM.fullmatch(right)):
+        return float(left) != float(right)
+
+    return True
+
+
+def _awk_fields(text: str) -> typing.List[str]:
+    """Split a line into fields as awk does with the default field separator."""
+    return [field for field in _AWK_SPACE.split(text) if field]
+
+
+_TR_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _tr_lower(text: str) -> str:
+    """Convert text to lower case as ``tr A-Z a-z`` does - only ASCII letters."""
+    return text.translate(_TR_LOWER)
+
+
+class AccountsTable:
+    """Accumulate the contributions of accounts to a set of Tweets.
+
+    Each Tweet is added once.  This collects everything which the shell
+    pipeline derives from ``accounts.jq`` and ``significance.jq``.
+    """
+    def __init__(self):
+        #: Mapping of author to number of Tweets and sum of their appearances
+        self.authors = {}
+
+        #: Mapping of mentioned account to number of Tweets and sum of their appearances
+        self.mentions = {}
+
+        #: Mapping of author to sum of retweets and favourites of their Tweets
+        self.significance = {}
+
+        #: Count of Tweets by each (author, mentioned account) pair
+        self.edges = collections.Counter()
+
+    def add(self, tweet: typing.Mapping) -> str:
+        """Add a Tweet, returning its row of the ``00TMP`` file."""
+        # Retweets are attributed to the original Tweet
+        if 'retweeted_status' in tweet:
+            tweet = tweet['retweeted_status']
+
+        mentions = [tweet.get('in_reply_to_screen_name')]
+        mentions.extend(
+            mention.get('screen_name') for mention in _jq_get(
+                tweet, 'entities', 'user_mentions') or [])
+
+        appearances = _jq_add(tweet.get('retweet_count'), 1)
+        fields = [
+            _jq_cell(appearances),
+            _jq_cell(_jq_get(tweet, 'user', 'screen_name')),
+        ]
+        fields.extend(map(_jq_cell, _jq_unique(mentions)))
+
+        appearances = _jq_to_awk(appearances)
+        author = self.authors.setdefault(fields[1], [0, 0])
+        author[0] += 1
+        author[1] += appearances
+
+        for name in fields[2:MAX_FIELDS]:
+            if name:
+                mention = self.mentions.setdefault(name, [0, 0])
+                mention[0] += 1
+                mention[1] += appearances
+
+        accounts = fields[1:MAX_FIELDS]
+        if any(' ' in field for field in accounts):
+            accounts = _awk_fields('\t'.join(accounts))
+
+        else:
+            accounts = [field for field in accounts if field]
+
+        if accounts:
+            source = accounts[0]
+            for target in accounts[1:]:
+                if _awk_differ(source, target):
+                    self.edges[(source, target)] += 1
+
+        significance = _jq_to_awk(
+            _jq_add(tweet.get('retweet_count'), tweet.get('favorite_count')))
+        self.significance[fields[1]] = self.significance.get(
+            fields[1], 0) + significance
+
+        return '\t'.join(fields)
+
+    def merge(self, other: 'AccountsTable') -> None:
+        """Add the counts of another table, as if its Tweets had been added to this one."""
+        for counts, other_counts in ((self.authors, other.authors),
+                                     (self.mentions, other.mentions)):
+            for name, (n_tweets, appearances) in other_counts.items():
+                stats = counts.setdefault(name, [0, 0])
+                stats[0] += n_tweets
+                stats[1] += appearances
+
+        for name, total in other.significance.items():
+            self.significance[name] = self.significance.get(name, 0) + total
+
+        self.edges.update(other.edges)
+
+    def names(self) -> typing.List[str]:
+        """Get the sorted names of all accounts, excluding all-digit names.
+
+        All-digit names are not valid and would be confused with user IDs.
+        """
+        return sorted(name for name in self.authors.keys() | self.mentions.keys()
+                      if not _DIGITS.fullmatch(name))
+
+    def table_rows(self) -> typing.Iterator[str]:
+        """Get the rows of the left part of the accounts table."""
+        for name in self.names():
+            fields = [name]
+            for stats in (self.authors.get(name), self.mentions.get(name)):
+                fields.extend(map(_awk_str, stats) if stats else ('', ''))
+
+            yield '\t'.join(fields)
+
+    def significance_rows(self) -> typing.List[str]:
+        """Get the sorted rows of the ``00MODS`` file."""
+        return sorted(f'{name}\t{_awk_str(total)}'
+                      for name, total in self.significance.items())
+
+    def edge_rows(self) -> typing.List[str]:
+        """Get the sorted rows of the ``00EDGES`` file."""
+        return sorted(f'{source}\t{target}\t{count}'
+                      for (source, target), count in self.edges.items())
+
+
+def user_row(user: typing.Mapping) -> str:
+    """Get the row of the right part of the accounts table for a user."""
+    created_at = user.get('created_at')
+    if created_at is not None:
+        created_at = (created_at[8:11] + created_at[4:8] + created_at[26:30] +
+                      created_at[10:19])
+
+    fields = [
+        user.get('screen_name'),
+        user.get('name'),
+        user.get('description'),
+        user.get('location'),
+        _jq_get(user, 'entities', 'url', 'urls', 0, 'expanded_url'),
+        user.get('followers_count'),
+        user.get('friends_count'),
+        user.get('statuses_count'),
+        created_at,
+    ]
+    return '\t'.join(map(_jq_cell, fields)).replace('"', '``')
+
+
+def join_rows(left: typing.Iterable[str],
+              right: typing.Iterable[str]) -> typing.Iterator[str]:
+    """Join rows on their first field, keeping unpaired rows from the left.
+
+    This is ``join -t '<tab>' -a 1`` for inputs sorted by their first field.
+    """
+    right_rows = collections.defaultdict(list)
+    for row in right:
+        key, _, rest = row.partition('\t')
+        right_rows[key].append(rest)
+
+    for row in left:
+        matches = right_rows.get(row.partition('\t')[0])
+        if not matches:
+            yield row
+            continue
+
+        for rest in matches:
+            yield f'{row}\t{rest}'
+
+
+def node_row(row: str) -> str:
+    """Format a row of the ``00RES2`` file as a D3 network node."""
+    fields = row.split('\t')
+    fields.extend([''] * (14 - len(fields)))
+
+    return ('{{id:"{0}", name:"{0}", tweets:"{1}", fullname:"{2}", '
+            'profile:"{3}", followers:{4}, significance:{5}}}').format(
+                fields[0], _awk_str(_awk_number(fields[1])), fields[5],
+                fields[6], _awk_str(_awk_number(fields[9])),
+                fields[13] if fields[13] != '' else -1)
+
+
+def edge_row(row: str) -> str:
+    """Format a row of the ``00EDGES`` file as a D3 network edge."""
+    source, target, weight = row.split('\t')[:3]
+    return f'{{source:"{source}", target:"{target}", weight:{weight}}}'
+
+
+def write_lines(path: pathlib.Path, lines: typing.Iterable[str]) -> None:
+    """Write lines of text to a file."""
+    with open(path, mode='w', encoding='utf-8', newline='') as file_out:
+        for line in lines:
+            file_out.write(line)
+            file_out.write('\n')
+
+
+def write_users(users_path: pathlib.Path, names: typing.Sequence[str],
+                users_cache: typing.Optional[pathlib.Path],
+                lookup: typing.Callable[[typing.List[str]], typing.Iterable[typing.Mapping]]
+                ) -> typing.List[typing.Mapping]:
+    """Write the ``00USERS.json`` file of user objects for the named accounts.
+
+    Users in the cache are not looked up again.  An existing ``00USERS.json``
+    file is used as it is.
+
+    :return: All user objects written to the file.
+    """
+    if users_path.is_file():
+        return list(iter_ndjson(users_path))
+
+    users = []
+    if users_cache is not None and users_cache.is_file():
+        users = list(iter_ndjson(users_cache))
+        # Matches `jq -r '.screen_name'` which outputs 'null' if missing
+        # Screen names are not case sensitive, so are compared in lower case
+        cached = {
+            _tr_lower('null' if user.get('screen_name') is None else str(user['screen_name']))
+            for user in users
+        }
+        names = sorted({_tr_lower(name) for name in names} - cached)
+        shutil.copyfile(users_cache, users_path)
+
+    else:
+        users_path.write_bytes(b'')
+
+    if not names:
+        return users
+
+    with open(users_path, mode='a', encoding='utf-8', newline='') as users_out:
+        for user in lookup(names):
+            if 'id_str' in user:
+                users_out.write(json.dumps(user))
+                users_out.write('\n')
+                users.append(user)
+
+    return users
+
+
+def write_accounts_table(
+    tweets: typing.Iterable[typing.Mapping],
+    work_dir: pathlib.Path,
+    bin_dir: pathlib.Path,
+    users_cache: typing.Optional[pathlib.Path] = None,
+    lookup: typing.Optional[typing.Callable[[typing.List[str]],
+                                            typing.Iterable[typing.Mapping]]] = None
+) -> None:
+    """Write the output files of the DOACCOUNTSTABLE plugin.
+
+    :param tweets: Tweets to process - may be a generator.
+    :param work_dir: Directory into which output files are written.
+    :param bin_dir: DOACCOUNTSTABLE plugin directory containing the network
+        HTML templates.
+    :param users_cache: Newline-delimited JSON file of known user objects.
+    :param lookup: Function to get user objects from a list of screen names.
+    """
+    table = AccountsTable()
+    with open(work_dir.joinpath('00TMP'), mode='w', encoding='utf-8',
+              newline='') as tmp_out:
+        for tweet in tweets:
+            tmp_out.write(table.add(tweet))
+            tmp_out.write('\n')
+
+    write_account_files(table, work_dir, bin_dir, users_cache, lookup)
+
+
+def write_account_files(
+    table: AccountsTable,
+    work_dir: pathlib.Path,
+    bin_dir: pathlib.Path,
+    users_cache: typing.Optional[pathlib.Path] = None,
+    lookup: typing.Optional[typing.Callable[[typing.List[str]],
+                                            typing.Iterable[typing.Mapping]]] = None
+) -> None:
+    """Write the output files of the DOACCOUNTSTABLE plugin other than ``00TMP``.
+
+    See `write_accounts_table` for parameters.
+    """
+    lookup = lookup or lookup_users
+
+    users_path = work_dir.joinpath('00USERS.json')
+    users = write_users(users_path, table.names(), users_cache, lookup)
+    user_rows = sorted(map(user_row, users))
+    del users
+
+    res_rows = sorted(join_rows(table.table_rows(), user_rows))
+    write_lines(work_dir.joinpath('00RES'), res_rows)
+
+    max_fields = max((row.count('\t') + 1 for row in res_rows), default=0)
+    write_lines(work_dir.joinpath('accounts.csv'), [
+        ACCOUNTS_HEADER, *(row + '\t-' * (max_fields - row.count('\t') - 1)
+                           for row in res_rows)
+    ])
+
+    mods_rows = table.significance_rows()
+    write_lines(work_dir.joinpath('00MODS'), mods_rows)
+    res2_rows = list(join_rows(res_rows, mods_rows))
+    write_lines(work_dir.joinpath('00RES2'), res2_rows)
+
+    edge_rows = table.edge_rows()
+    write_lines(work_dir.joinpath('00EDGES'), edge_rows)
+
+    with open(work_dir.joinpath('network.html'), mode='wb') as html_out:
+        html_out.write(bin_dir.joinpath('network_pre.htx').read_bytes())
+        html_out.write(('[[\n' + ',\n'.join(map(node_row, res2_rows)) + ']\n'
+                        ',[\n' + ',\n'.join(map(edge_row, edge_rows)) + ']]\n'
+                        ).encode('utf-8'))
+        html_out.write(bin_dir.joinpath('network_post.htx').read_bytes())
+
+    # Edges as a proper CSV file for Gephi
+    with open(work_dir.joinpath('edges.csv'), mode='w', encoding='utf-8',
+              newline='') as csv_out:
+        writer = csv.writer(csv_out, dialect=csv.excel)
+        writer.writerows(
+            csv.reader(['Source\tTarget\tWeight', *edge_rows],
+                       dialect=csv.excel_tab))
+
+
+def lookup_users(
+        screen_names: typing.List[str]) -> typing.Iterator[typing.Mapping]:
+    """Get user objects from their screen names sourced from the Twitter API."""
+    t = Twarc(  # pylint: disable=invalid-name
+        consumer_key=current_app.config['TWITTER_CONSUMER_KEY'],
+        consumer_secret=current_app.config['TWITTER_CONSUMER_SECRET'],
+        access_token=current_app.config['TWITTER_ACCESS_TOKEN'],
+        access_token_secret=current_app.config['TWITTER_ACCESS_TOKEN_SECRET'],
+    )
+
+    yield from t.user_lookup(ids=screen_names, id_type='screen_name')
+
+
+class AccountsTablePlugin(MapReducePlugin):
+    """In-process implementation of the DOACCOUNTSTABLE plugin.
+
+    Shards of the Tweets are aggregated into separate tables in parallel,
+    which are then merged before the users are looked up.
+    """
+    @classmethod
+    def map_shard(
+        cls, tweets: typing.Iterable[typing.Mapping]
+    ) -> typing.Tuple[AccountsTable, str]:
+        """Aggregate a shard of the Tweets into a table and its ``00TMP`` rows."""
+        table = AccountsTable()
+        rows = ''.join(table.add(tweet) + '\n' for tweet in tweets)
+        return table, rows
+
+    @classmethod
+    def reduce(
+        cls, partials: typing.List[typing.Tuple[AccountsTable, str]]
+    ) -> typing.Tuple[AccountsTable, typing.List[str]]:
+        """Merge the tables of each shard, keeping their ``00TMP`` rows in order."""
+        table = partials[0][0]
+        for other, _ in partials[1:]:
+            table.merge(other)
+
+        return table, [rows for _, rows in partials]
+
+    def write(self,
+              result: typing.Tuple[AccountsTable, typing.List[str]],
+              work_dir: pathlib.Path,
+              env: typing.Optional[typing.Mapping[str, str]] = None) -> None:
+        """Write the accounts table, edge list and D3 network.
+
+        The network HTML templates are read from the plugin directory, which
+        defaults to DOACCOUNTSTABLE within `PLUGIN_DIR`.
+
+        :param env: Extra environment variables - the users cache is read
+            from ``USERS_CACHE``.
+        """
+        table, shard_rows = result
+        with open(work_dir.joinpath('00TMP'), mode='w', encoding='utf-8',
+                  newline='') as tmp_out:
+            tmp_out.writelines(shard_rows)
+
+        bin_dir = self.plugin_dir or current_app.config['PLUGIN_DIR'].joinpath(
+            'DOACCOUNTSTABLE')
+        users_cache = (env or {}).get('USERS_CACHE')
+        write_account_files(
+            table,
+            work_dir,
+            bin_dir,
+            users_cache=pathlib.Path(users_cache) if users_cache else None)
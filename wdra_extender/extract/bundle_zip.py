@@ -0,0 +1,215 @@
+"""Module containing the writer which packages output files into a Bundle zip file.
+
+Files are added to the zip file as soon as they are complete - e.g. the
+Tweets file while plugins are still running, or a plugin's output when it
+finishes - and are read and compressed in a background thread.  Each file
+is compressed according to its type, so already-compressed images are
+stored as they are while text is deflated.
+
+The zip file is written under a temporary name and renamed into place when
+complete, so a partly written Bundle is never served.
+"""
+
+import functools
+import os
+import pathlib
+import queue
+import threading
+import time
+import typing
+from uuid import uuid4
+import zipfile
+
+__all__ = [
+    'Compression',
+    'StreamingZipWriter',
+    'parse_compression',
+]
+
+#: zipfile compression method of each name used in `BUNDLE_COMPRESSION`
+METHODS = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+#: Key of the compression used for files matching no other suffix
+DEFAULT_KEY = '*'
+
+
+class Compression(typing.NamedTuple):
+    """Compression of a file within a zip file."""
+    #: zipfile compression method, e.g. `zipfile.ZIP_DEFLATED`
+    method: int = zipfile.ZIP_STORED
+
+    #: Compression level - ``None`` for the compressor's default
+    level: typing.Optional[int] = None
+
+
+@functools.lru_cache(maxsize=None)
+def parse_compression(spec: str) -> typing.Dict[str, Compression]:
+    """Parse the compression of each type of file.
+
+    e.g. ``.png:store,.csv:deflate:9,*:deflate`` stores PNG images, deflates
+    CSV files at level 9 and deflates any other file at the default level.
+
+    :param spec: Comma separated list of ``<suffix>:<method>[:<level>]``
+        where suffix is ``*`` for files matching no other suffix.
+    :return: Mapping of lower case suffix to compression.
+    """
+    compression = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        suffix, *args = item.split(':')
+        if not args or len(args) > 2 or args[0] not in METHODS:
+            raise ValueError(f'Invalid zip compression: {item}')
+
+        level = int(args[1]) if len(args) > 1 else None
+        compression[suffix.lower()] = Compression(METHODS[args[0]], level)
+
+    return compression
+
+
+class StreamingZipWriter:
+    """Write files into a zip file in a background thread as they are added.
+
+    Use as a context manager - the zip file is moved into place when the
+    block exits normally and discarded if it raises an exception.
+
+    :param zip_path: Path of the zip file to write.
+    :param compression: Mapping of lower case file suffix to compression,
+        with key ``*`` for other files - see `parse_compression`.
+    """
+    def __init__(self,
+                 zip_path: pathlib.Path,
+                 compression: typing.Optional[typing.Mapping[str, Compression]] = None):
+        self.zip_path = pathlib.Path(zip_path)
+        self.compression = compression or {}
+        self.names = set()
+
+        # Unique so that concurrent builds of the same Bundle cannot collide
+        self.part_path = self.zip_path.with_name(
+            f'{self.zip_path.name}.{uuid4().hex}.part')
+        self._file = None
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = None
+
+        #: Seconds spent reading and compressing files into the zip file
+        self.write_time = 0.0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+        else:
+            self.abort()
+
+    def open(self) -> None:
+        """Create the temporary zip file and start the background thread."""
+        # pylint: disable=consider-using-with
+        self._file = open(self.part_path, mode='wb')
+        self._thread = threading.Thread(target=self._write,
+                                        args=(zipfile.ZipFile(self._file, 'w'), ),
+                                        name=f'zip-{self.zip_path.name}',
+                                        daemon=True)
+        self._thread.start()
+
+    def _get_compression(self, arcname: str) -> Compression:
+        return self.compression.get(
+            pathlib.PurePosixPath(arcname).suffix.lower(),
+            self.compression.get(DEFAULT_KEY, Compression()))
+
+    def _write(self, zip_file: zipfile.ZipFile) -> None:
+        """Write queued files into the zip file until the end is queued."""
+        with zip_file:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                if self._error is not None:
+                    continue
+
+                path, arcname = item
+                compression = self._get_compression(arcname)
+                start = time.perf_counter()
+                try:
+                    zip_file.write(path,
+                                   arcname=arcname,
+                                   compress_type=compression.method,
+                                   compresslevel=compression.level)
+
+                except Exception as exc:  # pylint: disable=broad-except
+                    # Raised in the calling thread by `close`
+                    self._error = exc
+
+                finally:
+                    self.write_time += time.perf_counter() - start
+
+    def add(self, path: pathlib.Path, arcname: str) -> bool:
+        """Queue a complete file to be written into the zip file.
+
+        The file must not be changed until the zip file is closed.
+
+        :param path: Path of the file.
+        :param arcname: Name of the file within the zip file.
+        :return: Was the file queued - files are only added once per name.
+        """
+        if arcname in self.names:
+            return False
+
+        self.names.add(arcname)
+        self._queue.put((pathlib.Path(path), arcname))
+        return True
+
+    def add_files(self, dir_path: pathlib.Path,
+                  names: typing.Iterable[str]) -> None:
+        """Queue files within a directory, named by their paths relative to it."""
+        for name in names:
+            self.add(dir_path.joinpath(name), pathlib.PurePath(name).as_posix())
+
+    def add_directory(self, dir_path: pathlib.Path) -> None:
+        """Queue every file within a directory which has not already been added."""
+        if not dir_path.is_dir():
+            raise NotADirectoryError(dir_path)
+
+        for root, dirs, files in os.walk(dir_path):
+            dirs.sort()
+            self.add_files(dir_path, (pathlib.Path(root, name).relative_to(dir_path)
+                                      for name in sorted(files)))
+
+    def _stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def close(self) -> None:
+        """Wait for queued files to be written, then move the zip file into place."""
+        self._stop()
+        if self._error is not None:
+            self.abort()
+            raise self._error
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.part_path, self.zip_path)
+
+    def abort(self) -> None:
+        """Stop writing and remove the temporary zip file."""
+        self._error = self._error or RuntimeError('Zip file aborted')
+        self._stop()
+        if self._file is not None:
+            self._file.close()
+
+        try:
+            self.part_path.unlink()
+
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,284 @@
+"""Module containing encodings for Tweets stored in a cache.
+
+A cached value is a small header followed by the encoded Tweet::
+
+    <version: 1 byte> <serialiser: 1 byte> <compressor: 1 byte> <dictionary id: 4 bytes> <payload>
+
+The header records everything needed to decode the value, so entries
+written with a different codec configuration can still be read.
+Values written before the header existed are plain JSON and are still
+readable.
+
+Codecs are named ``<serialiser>+<compressor>``, e.g. ``json+zlib``.
+Serialisers are ``json`` or ``msgpack`` and compressors are ``none``,
+``zlib`` or ``zstd``.  ``msgpack`` and ``zstd`` require the optional
+``msgpack`` and ``zstandard`` packages.
+
+A shared compression dictionary built from sample Tweets (see
+:func:`build_dictionary`) greatly improves compression of small values.
+"""
+
+import functools
+import json
+import pathlib
+import struct
+import threading
+import typing
+import zlib
+
+try:
+    import msgpack
+
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import zstandard
+
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+__all__ = [
+    'CacheCodec',
+    'CacheDecodeError',
+    'build_dictionary',
+    'get_codec',
+]
+
+#: Version of the cache value header
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('>BccI')
+
+_SERIALISERS = {
+    'json': b'j',
+    'msgpack': b'm',
+}
+
+_COMPRESSORS = {
+    'none': b'n',
+    'zlib': b'z',
+    'zstd': b's',
+}
+
+
+class CacheDecodeError(ValueError):
+    """A cached value could not be decoded by this process."""
+
+
+def _dictionary_id(dictionary: typing.Optional[bytes]) -> int:
+    """Identify a compression dictionary - zero means no dictionary."""
+    if not dictionary:
+        return 0
+
+    return zlib.crc32(dictionary) or 1
+
+
+class CacheCodec:
+    """Encoder and decoder for cached Tweets.
+
+    :param name: Name of the codec used for encoding, e.g. 'json+zlib'.
+    :param level: Compression level - ``None`` for the compressor's default.
+    :param dictionary: Shared compression dictionary - ``None`` for no dictionary.
+    """
+    def __init__(self,
+                 name: str = 'json+zlib',
+                 level: typing.Optional[int] = None,
+                 dictionary: typing.Optional[bytes] = None):
+        try:
+            serialiser, compressor = name.split('+')
+            self.serialiser = _SERIALISERS[serialiser]
+            self.compressor = _COMPRESSORS[compressor]
+
+        except (KeyError, ValueError) as exc:
+            raise ValueError(f'Unknown cache codec: {name}') from exc
+
+        if serialiser == 'msgpack' and msgpack is None:
+            raise ImportError('Cache codec requires the msgpack package')
+
+        if compressor == 'zstd' and zstandard is None:
+            raise ImportError('Cache codec requires the zstandard package')
+
+        self.name = name
+        self.level = level
+        self.dictionary = dictionary or None
+        self.dictionary_id = _dictionary_id(self.dictionary)
+
+        if compressor == 'none':
+            # A dictionary has no use without compression
+            self.dictionary = None
+            self.dictionary_id = 0
+
+        # Preparing a dictionary is expensive compared to compressing a
+        # single Tweet so keep primed (de)compressors to be copied or reused
+        zlib_level = -1 if level is None else level
+        if self.dictionary:
+            self._zlib_compressor = zlib.compressobj(zlib_level,
+                                                     zdict=self.dictionary)
+            self._zlib_decompressor = zlib.decompressobj(zdict=self.dictionary)
+
+        else:
+            self._zlib_compressor = zlib.compressobj(zlib_level)
+            self._zlib_decompressor = zlib.decompressobj()
+
+        self._zstd_dict = None
+        if zstandard is not None and self.dictionary:
+            self._zstd_dict = zstandard.ZstdCompressionDict(self.dictionary)
+            self._zstd_dict.precompute_compress(level=3 if level is None else level)
+
+        # Zstandard (de)compressors must not be shared between threads
+        self._local = threading.local()
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.name!r})'
+
+    def _serialise(self, tweet: typing.Mapping) -> bytes:
+        if self.serialiser == b'm':
+            return msgpack.packb(tweet, use_bin_type=True)
+
+        return json.dumps(tweet, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def _deserialise(serialiser: bytes, data: bytes) -> typing.Mapping:
+        if serialiser == b'm' and msgpack is None:
+            raise CacheDecodeError('msgpack package is not available')
+
+        try:
+            if serialiser == b'j':
+                return json.loads(data)
+
+            if serialiser == b'm':
+                return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+        except ValueError as exc:
+            raise CacheDecodeError(str(exc)) from exc
+
+        raise CacheDecodeError(f'Unknown serialiser: {serialiser!r}')
+
+    def _zstd(self, kind: str, with_dictionary: bool = True):
+        """Get a Zstandard compressor or decompressor for the current thread."""
+        key = (kind, with_dictionary)
+        cache = getattr(self._local, 'zstd', None)
+        if cache is None:
+            cache = self._local.zstd = {}
+
+        if key not in cache:
+            dict_data = self._zstd_dict if with_dictionary else None
+            if kind == 'compress':
+                cache[key] = zstandard.ZstdCompressor(
+                    level=3 if self.level is None else self.level,
+                    dict_data=dict_data)
+
+            else:
+                cache[key] = zstandard.ZstdDecompressor(dict_data=dict_data)
+
+        return cache[key]
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compressor == b'z':
+            compressor = self._zlib_compressor.copy()
+            return compressor.compress(data) + compressor.flush()
+
+        if self.compressor == b's':
+            return self._zstd('compress').compress(data)
+
+        return data
+
+    def _decompress(self, compressor: bytes, dictionary_id: int,
+                    data: bytes) -> bytes:
+        if dictionary_id not in {0, self.dictionary_id}:
+            raise CacheDecodeError(
+                f'Value uses unknown compression dictionary {dictionary_id}')
+
+        try:
+            if compressor == b'z':
+                if dictionary_id:
+                    decompressor = self._zlib_decompressor.copy()
+
+                else:
+                    decompressor = zlib.decompressobj()
+
+                return decompressor.decompress(data) + decompressor.flush()
+
+            if compressor == b's':
+                if zstandard is None:
+                    raise CacheDecodeError('zstandard package is not available')
+
+                return self._zstd('decompress',
+                                  bool(dictionary_id)).decompress(data)
+
+        except (zlib.error, getattr(zstandard, 'ZstdError', zlib.error)) as exc:
+            raise CacheDecodeError(str(exc)) from exc
+
+        if compressor == b'n':
+            return data
+
+        raise CacheDecodeError(f'Unknown compressor: {compressor!r}')
+
+    def encode(self, tweet: typing.Mapping) -> bytes:
+        """Encode a Tweet as a cache value."""
+        header = _HEADER.pack(FORMAT_VERSION, self.serialiser,
+                              self.compressor, self.dictionary_id)
+        return header + self._compress(self._serialise(tweet))
+
+    def decode(self, value: typing.Union[bytes, str]) -> typing.Mapping:
+        """Decode a cache value written by any codec.
+
+        :raises CacheDecodeError: If the value cannot be decoded by this process.
+        """
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+
+        # Values written before the header was introduced are plain JSON
+        if value[:1] == b'{':
+            return json.loads(value)
+
+        if len(value) < _HEADER.size or value[0] != FORMAT_VERSION:
+            raise CacheDecodeError('Unknown cache value format')
+
+        _, serialiser, compressor, dictionary_id = _HEADER.unpack_from(value)
+        data = self._decompress(compressor, dictionary_id,
+                                value[_HEADER.size:])
+        return self._deserialise(serialiser, data)
+
+
+def build_dictionary(samples: typing.Iterable[typing.Mapping],
+                     size: int = 32 * 1024) -> bytes:
+    """Build a shared compression dictionary from sample Tweets.
+
+    Uses Zstandard's dictionary trainer if available.  Otherwise the most
+    recent samples are concatenated, which is an effective dictionary for
+    zlib since it favours content at the end of the dictionary.
+    """
+    encoded = [
+        json.dumps(tweet, ensure_ascii=False,
+                   separators=(',', ':')).encode('utf-8') for tweet in samples
+    ]
+
+    if zstandard is not None and len(encoded) >= 8:
+        try:
+            return zstandard.train_dictionary(size, encoded).as_bytes()
+
+        except zstandard.ZstdError:
+            # Too few samples to train - fall back to concatenation
+            pass
+
+    return b''.join(encoded)[-size:]
+
+
+@functools.lru_cache(maxsize=None)
+def _load_codec(name: str, level: typing.Optional[int],
+                dictionary_path: typing.Optional[pathlib.Path]) -> CacheCodec:
+    dictionary = None
+    if dictionary_path is not None:
+        dictionary = pathlib.Path(dictionary_path).read_bytes()
+
+    return CacheCodec(name, level=level, dictionary=dictionary)
+
+
+def get_codec(config: typing.Mapping) -> CacheCodec:
+    """Get the cache codec configured in a Flask config dictionary."""
+    return _load_codec(config['TWEET_CACHE_CODEC'],
+                       config['TWEET_CACHE_COMPRESSION_LEVEL'],
+                       config['TWEET_CACHE_DICTIONARY'])
@@ -0,0 +1,58 @@
+"""Module containing Flask CLI commands for managing tweet processing plugins."""
+
+import json
+
+import click
+from flask.cli import AppGroup
+
+from .plugins import plugin_registry
+
+__all__ = [
+    'plugins_cli',
+]
+
+plugins_cli = AppGroup('plugins', help='Manage tweet processing plugins.')  # pylint: disable=invalid-name
+
+
+@plugins_cli.command('list')
+@click.option('--json', 'as_json', is_flag=True, help='Output as JSON.')
+def list_plugins(as_json: bool):
+    """List plugins with their entry files and declared metadata.
+
+    Exits with a non-zero status if any plugin is invalid.
+    """
+    collection = plugin_registry.get()
+
+    plugins = [{
+        'name': path.name,
+        'kind': collection.entries[path].kind,
+        'source': collection.entries[path].source,
+        'depends': list(collection.manifests[path].depends),
+        'max_parallel': collection.manifests[path].max_parallel,
+    } for path in collection.plugins]
+    invalid = [{
+        'name': path.name,
+        'error': error,
+    } for path, error in collection.errors.items()]
+
+    if as_json:
+        click.echo(json.dumps({'plugins': plugins, 'invalid': invalid}, indent=4))
+
+    else:
+        for plugin in plugins:
+            click.echo(f'{plugin["name"]} ({plugin["kind"]}): {plugin["source"]}')
+            click.echo(f'    depends: {", ".join(plugin["depends"]) or "-"}')
+            click.echo(f'    max_parallel: {plugin["max_parallel"] or "-"}')
+
+        for plugin in invalid:
+            click.echo(f'{plugin["name"]} (invalid): {plugin["error"]}')
+
+    if invalid:
+        raise click.exceptions.Exit(1)
+
+
+@plugins_cli.command('reload')
+def reload_plugins():
+    """Make every process reload its plugins before its next build."""
+    plugin_registry.touch()
+    click.echo('Plugin reload requested')
@@ -0,0 +1,289 @@
+"""Module containing hydration of Tweet IDs across a pool of Twitter API credentials.
+
+The Twitter API limits Tweet lookups per access token, so a single token
+bounds the throughput of large Bundles.  Lookup batches are instead spread
+across every configured credential set, several at a time.  The quota
+remaining for each token is tracked from the rate limit headers of its
+responses - a token is not used again once its quota is spent, and
+batches which are refused by a rate limited or revoked token are rerouted
+to another token.  If every token is rate limited, lookups wait for the
+earliest to reset.
+"""
+
+import json
+import pathlib
+import threading
+import time
+import typing
+
+from flask import current_app
+import requests
+from requests_oauthlib import OAuth1Session
+
+from .utils import batched, bounded_map
+
+__all__ = [
+    'Credentials',
+    'Hydrator',
+    'get_credentials',
+    'get_hydrator',
+]
+
+#: Maximum number of Tweet IDs in each lookup request
+LOOKUP_BATCH_SIZE = 100
+
+#: Seconds to wait for a rate limit to reset if the response does not say
+RATE_LIMIT_WINDOW = 15 * 60
+
+#: Seconds to wait for each lookup response
+REQUEST_TIMEOUT = (3.05, 31)
+
+
+class Credentials(typing.NamedTuple):
+    """A set of Twitter API credentials."""
+    consumer_key: str
+    consumer_secret: str
+    access_token: str
+    access_token_secret: str
+
+    def __str__(self):
+        # Enough to tell tokens apart in logs without revealing them
+        return f'token ...{self.access_token[-4:]}'
+
+
+class _Token:
+    """Rate limit state of a single set of credentials."""
+    def __init__(self, credentials: Credentials):
+        self.credentials = credentials
+        self.enabled = True
+
+        #: Lookups remaining in the current window - ``None`` until known
+        self.remaining = None
+
+        #: Time at which the current window ends - ``None`` until known
+        self.reset = None
+
+        #: Number of lookups currently in progress
+        self.in_flight = 0
+
+    def available(self, now: float) -> int:
+        """Get the number of lookups which may be started now with this token."""
+        if not self.enabled:
+            return 0
+
+        if self.reset is not None and now >= self.reset and not self.in_flight:
+            # The window has reset - probe for the new quota
+            self.remaining = None
+            self.reset = None
+
+        if self.remaining is None:
+            return 0 if self.in_flight else 1
+
+        return self.remaining - self.in_flight
+
+    def update(self, headers: typing.Mapping[str, str], now: float) -> None:
+        """Update the quota from the rate limit headers of a response."""
+        try:
+            self.remaining = int(headers['x-rate-limit-remaining'])
+            self.reset = float(headers['x-rate-limit-reset'])
+
+        except (KeyError, ValueError):
+            pass
+
+        if self.reset is not None and self.reset <= now:
+            self.reset = now
+
+
+class Hydrator:
+    """Look up Tweets by ID concurrently across a pool of API credentials.
+
+    :param credentials: Credential sets to use - each has its own quota.
+    :param lookup_url: URL of the Tweet lookup endpoint.
+    :param concurrency: Maximum number of lookups in progress with each token.
+    :param max_retries: Number of times to retry a lookup after a server or
+        connection error before giving up.
+    """
+    def __init__(self,
+                 credentials: typing.Iterable[Credentials],
+                 lookup_url: str,
+                 concurrency: int = 2,
+                 max_retries: int = 3):
+        self.tokens = [_Token(c) for c in dict.fromkeys(credentials)]
+        self.lookup_url = lookup_url
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self._condition = threading.Condition()
+        self._local = threading.local()
+
+    def _session(self, token: _Token) -> requests.Session:
+        """Get the HTTP session of a token for the current thread."""
+        sessions = self._local.__dict__.setdefault('sessions', {})
+        if token.credentials not in sessions:
+            credentials = token.credentials
+            sessions[token.credentials] = OAuth1Session(
+                client_key=credentials.consumer_key,
+                client_secret=credentials.consumer_secret,
+                resource_owner_key=credentials.access_token,
+                resource_owner_secret=credentials.access_token_secret)
+
+        return sessions[token.credentials]
+
+    def _acquire(self) -> _Token:
+        """Reserve a lookup with the token which has the most quota remaining.
+
+        Waits if every token is rate limited or busy.
+
+        :raises ConnectionError: If no token has valid credentials.
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                available = [(token.available(now), token) for token in self.tokens]
+                count, token = max(available, key=lambda item: item[0],
+                                   default=(0, None))
+                if count > 0:
+                    token.in_flight += 1
+                    return token
+
+                enabled = [token for token in self.tokens if token.enabled]
+                if not enabled:
+                    raise ConnectionError('No valid Twitter API credentials')
+
+                # Wait for a lookup to finish or the earliest window to reset
+                resets = [token.reset for token in enabled
+                          if token.reset is not None and not token.in_flight]
+                self._condition.wait(
+                    timeout=max(0, min(resets) - now) if resets else None)
+
+    def _release(self, token: _Token, response: typing.Optional[requests.Response]) -> None:
+        """Finish a lookup, updating the token's quota from the response."""
+        with self._condition:
+            token.in_flight -= 1
+            now = time.time()
+
+            if response is not None:
+                token.update(response.headers, now)
+
+                if response.status_code == 429:
+                    token.remaining = 0
+                    if token.reset is None or token.reset <= now:
+                        token.reset = now + RATE_LIMIT_WINDOW
+
+                    current_app.logger.warning(
+                        'Twitter API rate limit reached for %s - resets in %.0fs',
+                        token.credentials, token.reset - now)
+
+                elif response.status_code in {401, 403}:
+                    token.enabled = False
+                    current_app.logger.error(
+                        'Twitter API credentials rejected for %s - not using them again',
+                        token.credentials)
+
+            self._condition.notify_all()
+
+    def lookup(self, tweet_ids: typing.List[int]) -> typing.List[typing.Mapping]:
+        """Look up a single batch of Tweets, rerouting it if its token is refused.
+
+        Tweets which do not exist or are protected are not returned.
+
+        :raises ConnectionError: If the batch could not be looked up.
+        """
+        errors = 0
+        while True:
+            token = self._acquire()
+            response = None
+            try:
+                response = self._session(token).post(
+                    self.lookup_url,
+                    data={
+                        'id': ','.join(map(str, tweet_ids)),
+                        'include_entities': 'true',
+                        'include_ext_alt_text': 'true',
+                        'trim_user': 'false',
+                        'tweet_mode': 'extended',
+                    },
+                    timeout=REQUEST_TIMEOUT)
+
+            except requests.exceptions.RequestException as exc:
+                error = exc
+
+            finally:
+                self._release(token, response)
+
+            if response is not None:
+                if response.status_code == 200:
+                    return response.json()
+
+                if response.status_code in {401, 403, 429}:
+                    # Try another token, or wait for this one to reset
+                    continue
+
+                error = requests.exceptions.HTTPError(
+                    f'{response.status_code} from Twitter API', response=response)
+
+            errors += 1
+            if errors > self.max_retries:
+                raise ConnectionError(
+                    f'Failed to look up Tweets after {errors} attempts') from error
+
+            current_app.logger.warning('Twitter API lookup failed, retrying: %s', error)
+            time.sleep(2**errors)
+
+    def hydrate(self,
+                tweet_ids: typing.Iterable[int]) -> typing.Iterator[typing.Mapping]:
+        """Look up Tweets by ID, yielding those found as each batch completes."""
+        app = current_app._get_current_object()  # pylint: disable=protected-access
+
+        def lookup(batch: typing.List[int]) -> typing.List[typing.Mapping]:
+            with app.app_context():
+                return self.lookup(batch)
+
+        max_workers = len(self.tokens) * self.concurrency
+        for tweets in bounded_map(lookup, batched(tweet_ids, LOOKUP_BATCH_SIZE),
+                                  max(1, max_workers)):
+            yield from tweets
+
+
+def get_credentials(config: typing.Mapping) -> typing.List[Credentials]:
+    """Get the Twitter API credential sets from a Flask config dictionary.
+
+    These are the `TWITTER_*` credentials, if set, followed by those listed
+    in `TWITTER_CREDENTIALS_FILE`.
+    """
+    credentials = []
+    if config['TWITTER_ACCESS_TOKEN']:
+        credentials.append(
+            Credentials(config['TWITTER_CONSUMER_KEY'],
+                        config['TWITTER_CONSUMER_SECRET'],
+                        config['TWITTER_ACCESS_TOKEN'],
+                        config['TWITTER_ACCESS_TOKEN_SECRET']))
+
+    path = config['TWITTER_CREDENTIALS_FILE']
+    if path is not None:
+        with open(pathlib.Path(path), encoding='utf-8') as credentials_in:
+            credentials.extend(Credentials(**c) for c in json.load(credentials_in))
+
+    return credentials
+
+
+_hydrators = {}
+_hydrators_lock = threading.Lock()
+
+
+def get_hydrator(config: typing.Mapping) -> Hydrator:
+    """Get the hydrator configured in a Flask config dictionary.
+
+    A hydrator is shared by every build in the process with the same
+    credentials, so that they share its view of each token's quota.
+    """
+    credentials = tuple(get_credentials(config))
+    key = (credentials, config['TWITTER_LOOKUP_URL'],
+           config['TWITTER_TOKEN_CONCURRENCY'])
+
+    with _hydrators_lock:
+        if key not in _hydrators:
+            _hydrators[key] = Hydrator(credentials,
+                                       lookup_url=config['TWITTER_LOOKUP_URL'],
+                                       concurrency=config['TWITTER_TOKEN_CONCURRENCY'])
+
+        return _hydrators[key]
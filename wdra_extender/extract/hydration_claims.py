@@ -0,0 +1,190 @@
+"""Module containing single-flight coordination of hydration across builds.
+
+When Bundles with overlapping Tweet IDs are built at the same time, each
+build misses the cache and would look up the same Tweets from the Twitter
+API.  Before a build looks up Tweets from a shared provider it instead
+claims their IDs using short-lived Redis keys.  IDs which are already
+claimed by another build are not looked up again - the build waits for the
+other to save them to the cache, or to record them as missing, and reads
+them from there.
+
+A build caches the Tweets it found and releases its claims on them as soon
+as it has looked them up - before it waits for any Tweets claimed by other
+builds - so two builds each holding some of the other's Tweets do not wait
+on each other.  Claims also expire after `HYDRATION_CLAIM_TIME` seconds, so
+that Tweets claimed by a build which fails are looked up by another, and a
+build waits at most `HYDRATION_CLAIM_MAX_WAIT` seconds in total before
+looking up any Tweets still claimed by others itself.
+"""
+
+import array
+import typing
+import uuid
+
+from flask import current_app
+import redis
+
+from ..extensions import redis_pool
+from .tweet_ids import TYPECODE, TweetIdSet
+from .utils import batched, bounded_map
+
+__all__ = [
+    'HydrationClaims',
+    'get_claims',
+]
+
+
+def claim_key(tweet_id: int) -> str:
+    """Get the Redis key of the claim on a Tweet ID."""
+    return f'tweet_claim:{tweet_id}'
+
+
+class HydrationClaims:
+    """Claims on Tweet IDs held by a single build.
+
+    Claims are made, checked and released in pipelined batches of
+    `REDIS_BATCH_SIZE`, with up to `REDIS_MAX_CONCURRENCY` batches in flight.
+
+    :param claim_time: Seconds after which a claim expires if not released.
+    :param poll_interval: Seconds between checks on Tweets being looked up by
+        other builds.
+    :param max_wait: Seconds for which to wait on Tweets being looked up by
+        other builds before looking them up anyway - defaults to `claim_time`.
+    :param cache_writers: Functions which cache Tweets for other builds to
+        read, called before the claims on those Tweets are released.
+    """
+    def __init__(self,
+                 claim_time: float,
+                 poll_interval: float = 1,
+                 max_wait: typing.Optional[float] = None,
+                 cache_writers: typing.Iterable[typing.Callable[[typing.Iterable[typing.Mapping]],
+                                                                None]] = ()):
+        self.claim_time = claim_time
+        self.poll_interval = poll_interval
+        self.max_wait = claim_time if max_wait is None else max_wait
+        self.cache_writers = list(cache_writers)
+
+        #: Value of the claim keys held by this build
+        self.token = uuid.uuid4().hex
+
+        #: Tweet IDs claimed by this build and not yet released
+        self.held = TweetIdSet()
+
+        #: Tweet IDs saved by the cache writers, or recorded as missing, by this
+        #: build since all claims were last released
+        self.cached = TweetIdSet()
+
+    def _map_batches(self, func: typing.Callable[[typing.List[int]], typing.List[int]],
+                     tweet_ids: typing.Iterable[int]) -> TweetIdSet:
+        """Apply a function to batches of Tweet IDs, collecting the IDs it returns."""
+        config = current_app.config
+        result = array.array(TYPECODE)
+
+        try:
+            for batch_result in bounded_map(
+                    func, batched(tweet_ids, config['REDIS_BATCH_SIZE']),
+                    config['REDIS_MAX_CONCURRENCY']):
+                result.extend(batch_result)
+
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.TimeoutError) as exc:
+            raise ConnectionError from exc
+
+        return TweetIdSet(result)
+
+    def claim(self, tweet_ids: typing.Iterable[int]) -> typing.Tuple[TweetIdSet, TweetIdSet]:
+        """Claim Tweet IDs which are not already claimed by another build.
+
+        :return: IDs now claimed by this build and IDs claimed by other builds.
+        :raises ConnectionError: If Redis could not be reached.
+        """
+        tweet_ids = TweetIdSet(tweet_ids)
+        claim_ms = max(1, int(self.claim_time * 1000))
+
+        def claim_batch(batch: typing.List[int]) -> typing.List[int]:
+            pipe = redis_pool.client.pipeline(transaction=False)
+            for tweet_id in batch:
+                pipe.set(claim_key(tweet_id), self.token, nx=True, px=claim_ms)
+
+            with redis_pool.timed('pipeline'):
+                results = pipe.execute()
+
+            return [i for i, claimed in zip(batch, results) if claimed]
+
+        # IDs already held by this build cannot be claimed again
+        claimed = self._map_batches(claim_batch, tweet_ids - self.held)
+        self.held |= claimed
+
+        return tweet_ids & self.held, tweet_ids - self.held
+
+    def held_by_others(self, tweet_ids: typing.Iterable[int]) -> TweetIdSet:
+        """Get the Tweet IDs which are currently claimed by other builds.
+
+        :raises ConnectionError: If Redis could not be reached.
+        """
+        token = self.token.encode()
+
+        def read_batch(batch: typing.List[int]) -> typing.List[int]:
+            with redis_pool.timed('mget'):
+                values = redis_pool.client.mget([claim_key(i) for i in batch])
+
+            return [
+                i for i, value in zip(batch, values)
+                if value is not None and value != token
+            ]
+
+        return self._map_batches(read_batch, tweet_ids)
+
+    def release(self, tweet_ids: typing.Optional[typing.Iterable[int]] = None) -> None:
+        """Release claims held by this build.
+
+        Claims which have expired and been taken by another build are left alone.
+
+        :param tweet_ids: Tweet IDs to release - if not given, release every
+            claim and forget which Tweets have been cached.
+
+        :raises ConnectionError: If Redis could not be reached.
+        """
+        token = self.token.encode()
+
+        def release_batch(batch: typing.List[int]) -> typing.List[int]:
+            keys = [claim_key(i) for i in batch]
+            with redis_pool.timed('mget'):
+                values = redis_pool.client.mget(keys)
+
+            # Not atomic - a claim taken by another build in between is lost,
+            # which at worst means its Tweets are looked up twice
+            held = [key for key, value in zip(keys, values) if value == token]
+            if held:
+                with redis_pool.timed('delete'):
+                    redis_pool.client.delete(*held)
+
+            return []
+
+        if tweet_ids is None:
+            held, self.held = self.held, TweetIdSet()
+            self.cached = TweetIdSet()
+
+        else:
+            held = self.held & tweet_ids
+            self.held -= held
+
+        self._map_batches(release_batch, held)
+
+
+def get_claims(
+    config: typing.Mapping,
+    cache_writers: typing.Iterable[typing.Callable[[typing.Iterable[typing.Mapping]], None]] = ()
+) -> typing.Optional[HydrationClaims]:
+    """Get a new set of claims for a build from a Flask config dictionary.
+
+    :param cache_writers: Functions with which the build caches the Tweets it finds.
+    :return: Claims, or ``None`` if single-flight hydration is disabled.
+    """
+    if config['HYDRATION_CLAIM_TIME'] <= 0:
+        return None
+
+    return HydrationClaims(config['HYDRATION_CLAIM_TIME'],
+                           poll_interval=config['HYDRATION_CLAIM_POLL_INTERVAL'],
+                           max_wait=config['HYDRATION_CLAIM_MAX_WAIT'],
+                           cache_writers=cache_writers)
@@ -0,0 +1,245 @@
+"""Module containing a local on-disk store of hydrated Tweets.
+
+This acts as a second cache tier behind Redis.  Tweets are kept in an
+SQLite database on the worker's volume, encoded by :mod:`.cache_codec`,
+until the store grows beyond its size limit, at which point the least
+recently used Tweets are evicted.
+
+Reads do not write to the database, so they do not wait on SQLite's single
+write lock.  A Tweet's access time is only updated if it was last updated
+more than `ACCESS_RESOLUTION` seconds ago, and hits and misses are counted
+in memory and written every `STATS_FLUSH_INTERVAL` seconds.
+"""
+
+import collections
+import functools
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import typing
+
+from .utils import batched
+
+__all__ = [
+    'LocalTweetStore',
+    'get_store',
+]
+
+#: Maximum number of parameters in a single SQLite query
+#: Older SQLite versions are limited to 999
+_MAX_PARAMS = 900
+
+#: Seconds for which a Tweet's access time is not updated again - eviction
+#: only needs the order in which Tweets were used to within this
+ACCESS_RESOLUTION = 60 * 60
+
+#: Seconds between writes of the hit and miss counts of a process
+STATS_FLUSH_INTERVAL = 10
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tweets (
+    id INTEGER PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tweets_accessed ON tweets (accessed);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats (name, value) VALUES ('hits', 0), ('misses', 0);
+'''
+
+
+class LocalTweetStore:
+    """Key-value store of encoded Tweets keyed by Tweet ID.
+
+    Safe to share between threads and between processes using the same file.
+
+    :param path: Path of the SQLite database file - created if required.
+    :param max_bytes: Size above which least recently used Tweets are evicted.
+    :param access_resolution: Seconds for which a Tweet's access time is not updated again.
+    """
+    def __init__(self,
+                 path: pathlib.Path,
+                 max_bytes: int,
+                 access_resolution: float = ACCESS_RESOLUTION):
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+        self.access_resolution = access_resolution
+        self._local = threading.local()
+
+        #: Hits and misses not yet written, by the process which counted them
+        self._counts = collections.Counter()
+        self._counts_pid = os.getpid()
+        self._counts_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get a database connection for the current thread."""
+        # Connections must not be shared with forked worker processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.conn = None
+            self._local.pid = os.getpid()
+
+        conn = self._local.conn
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            # Allow concurrent readers while a worker is writing
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+
+        return conn
+
+    def get_many(
+        self, tweet_ids: typing.Iterable[int]
+    ) -> typing.Iterator[typing.Tuple[int, bytes]]:
+        """Look up Tweets by ID, yielding the encoded value of each one found."""
+        conn = self._connect()
+
+        for batch in batched(tweet_ids, _MAX_PARAMS):
+            placeholders = ','.join('?' * len(batch))
+            rows = conn.execute(
+                f'SELECT id, value, accessed FROM tweets WHERE id IN ({placeholders})',
+                batch).fetchall()
+
+            now = time.time()
+            stale = [
+                tweet_id for tweet_id, _, accessed in rows
+                if accessed < now - self.access_resolution
+            ]
+            if stale:
+                placeholders = ','.join('?' * len(stale))
+                with conn:
+                    conn.execute(
+                        f'UPDATE tweets SET accessed = ? WHERE id IN ({placeholders})',
+                        [now, *stale])
+
+            self._count(hits=len(rows), misses=len(batch) - len(rows))
+            yield from ((tweet_id, value) for tweet_id, value, _ in rows)
+
+    def _count(self, **counts: int) -> None:
+        """Count hits and misses, writing them if they were last written long enough ago."""
+        with self._counts_lock:
+            if self._counts_pid != os.getpid():
+                # Counted by the parent of a forked worker process
+                self._counts.clear()
+                self._counts_pid = os.getpid()
+
+            self._counts.update(counts)
+            if time.monotonic() - self._flushed_at < STATS_FLUSH_INTERVAL:
+                return
+
+        self.flush_stats()
+
+    def flush_stats(self) -> None:
+        """Write the hits and misses counted by this process."""
+        with self._counts_lock:
+            counts, self._counts = self._counts, collections.Counter()
+            self._flushed_at = time.monotonic()
+
+        if self._counts_pid != os.getpid() or not counts:
+            return
+
+        conn = self._connect()
+        with conn:
+            conn.executemany('UPDATE stats SET value = value + ? WHERE name = ?',
+                             [(counts[name], name) for name in ('hits', 'misses')])
+
+    def put_many(self, items: typing.Iterable[typing.Tuple[int,
+                                                            bytes]]) -> None:
+        """Store encoded Tweets, replacing any with the same ID."""
+        conn = self._connect()
+
+        for batch in batched(items, _MAX_PARAMS):
+            now = time.time()
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO tweets (id, value, size, accessed) '
+                    'VALUES (?, ?, ?, ?)',
+                    [(tweet_id, value, len(value), now)
+                     for tweet_id, value in batch])
+
+        self.evict()
+
+    def used_bytes(self) -> int:
+        """Get the size of the store excluding free space within the file."""
+        conn = self._connect()
+        page_count, = conn.execute('PRAGMA page_count').fetchone()
+        freelist_count, = conn.execute('PRAGMA freelist_count').fetchone()
+        page_size, = conn.execute('PRAGMA page_size').fetchone()
+
+        return (page_count - freelist_count) * page_size
+
+    def evict(self) -> int:
+        """Remove least recently used Tweets until the store is within its size limit.
+
+        Frees an extra tenth of the limit so eviction is not needed on every write.
+
+        :return: Number of Tweets evicted.
+        """
+        excess = self.used_bytes() - self.max_bytes
+        if excess <= 0:
+            return 0
+
+        excess += self.max_bytes // 10
+        conn = self._connect()
+        evicted = 0
+
+        with conn:
+            while excess > 0:
+                rows = conn.execute(
+                    'SELECT id, size FROM tweets ORDER BY accessed LIMIT ?',
+                    (_MAX_PARAMS, )).fetchall()
+                if not rows:
+                    break
+
+                ids = []
+                for tweet_id, size in rows:
+                    ids.append(tweet_id)
+                    excess -= size
+                    if excess <= 0:
+                        break
+
+                conn.execute(
+                    f'DELETE FROM tweets WHERE id IN ({",".join("?" * len(ids))})',
+                    ids)
+                evicted += len(ids)
+
+        return evicted
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Report hit ratio and size of the store."""
+        self.flush_stats()
+        conn = self._connect()
+        counts = dict(conn.execute('SELECT name, value FROM stats').fetchall())
+        n_tweets, = conn.execute('SELECT COUNT(*) FROM tweets').fetchone()
+        lookups = counts['hits'] + counts['misses']
+
+        return {
+            'hits': counts['hits'],
+            'misses': counts['misses'],
+            'hit_ratio': counts['hits'] / lookups if lookups else None,
+            'tweets': n_tweets,
+            'used_bytes': self.used_bytes(),
+            'max_bytes': self.max_bytes,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def _open_store(path: pathlib.Path, max_bytes: int) -> LocalTweetStore:
+    return LocalTweetStore(path, max_bytes)
+
+
+def get_store(config: typing.Mapping) -> LocalTweetStore:
+    """Get the local Tweet store configured in a Flask config dictionary."""
+    return _open_store(config['TWEET_STORE_PATH'],
+                       config['TWEET_STORE_MAX_BYTES'])
@@ -0,0 +1,212 @@
+"""Module containing the map/reduce execution mode for aggregating plugins.
+
+Plugins which count things over the Tweets - hashtags, words, mentions,
+edges - can be split into a mapper which aggregates one shard of the Tweets
+and a reducer which merges the partial aggregates.  Shards of the
+newline-delimited Tweets file are parsed and mapped in a pool of processes,
+so a single large Bundle can use every core rather than one.
+
+The pool is shared by every map/reduce plugin within a worker process, so
+plugins running at the same time together use at most `MAPREDUCE_WORKERS`
+processes.  Its processes are started by a fork server rather than forked
+from the worker, whose other threads - logging, Redis connections, the
+Bundle zip writer - may hold locks which would never be released in a
+forked child.
+"""
+
+import abc
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+import importlib.util
+import multiprocessing
+import pathlib
+import pickle
+import sys
+import threading
+import typing
+
+from flask import current_app
+
+from .plugins import PLUGIN_MODULE_PREFIX, PluginBase
+from .tweet_store import TweetView, iter_ndjson_range, ndjson_shards
+
+__all__ = [
+    'MapReducePlugin',
+    'map_shards',
+]
+
+#: Number of shards per worker process, so that uneven shards balance out
+SHARDS_PER_WORKER = 4
+
+#: Process pools shared by map/reduce plugins, by number of processes
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _import_plugin_modules(modules: typing.Iterable[typing.Tuple[str, str]]) -> None:
+    """Import plugin modules which cannot be imported by name, as `load_plugin_class` does."""
+    for name, path in modules:
+        if name not in sys.modules:
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module
+            spec.loader.exec_module(module)
+
+
+def _map_range(modules: typing.List[typing.Tuple[str, str]], mapper: bytes,
+               path: pathlib.Path, start: int, end: int) -> typing.Any:
+    """Apply a pickled mapper to the Tweets within a byte range of a file.
+
+    The mapper is unpickled once the plugin module defining it is imported.
+    """
+    _import_plugin_modules(modules)
+    return pickle.loads(mapper)(iter_ndjson_range(path, start, end))
+
+
+def _plugin_modules(mapper: typing.Callable) -> typing.List[typing.Tuple[str, str]]:
+    """Get the name and path of the plugin module a mapper belongs to, if any.
+
+    Plugin modules loaded from plugin directories cannot be imported by
+    name, so are imported from their path before the mapper is unpickled.
+    """
+    # Mappers are usually classmethods, pickled as a reference to their class
+    owner = getattr(mapper, '__self__', mapper)
+    name = getattr(owner, '__module__', None)
+    if name is None or not name.startswith(PLUGIN_MODULE_PREFIX):
+        return []
+
+    return [(name, sys.modules[name].__file__)]
+
+
+def _get_context():
+    """Get the multiprocessing context used to start worker processes.
+
+    Processes are not forked directly from the multi-threaded worker - see
+    the module docstring.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+
+    return multiprocessing.get_context('spawn')
+
+
+def _get_pool(max_workers: int) -> futures.ProcessPoolExecutor:
+    """Get the process pool shared by map/reduce plugins, starting it if required."""
+    with _pools_lock:
+        pool = _pools.get(max_workers)
+        if pool is None:
+            pool = futures.ProcessPoolExecutor(max_workers=max_workers,
+                                               mp_context=_get_context())
+            _pools[max_workers] = pool
+
+        return pool
+
+
+def _discard_pool(max_workers: int, pool: futures.ProcessPoolExecutor) -> None:
+    """Stop using a pool whose processes have died, so that a new one is started."""
+    with _pools_lock:
+        if _pools.get(max_workers) is pool:
+            del _pools[max_workers]
+
+    pool.shutdown(wait=False)
+
+
+def map_shards(mapper: typing.Callable[[typing.Iterable[typing.Mapping]],
+                                       typing.Any],
+               tweets: typing.Iterable[typing.Mapping],
+               max_workers: int,
+               min_shard_bytes: int) -> typing.List:
+    """Apply a mapper to shards of the Tweets.
+
+    Only Tweets backed by a newline-delimited JSON file can be sharded - any
+    others, and files too small to be worth sharding, are mapped as a single
+    shard in this process.
+
+    :param mapper: Picklable function which aggregates an iterable of Tweets.
+    :param tweets: Tweets to map - a `TweetView` of a ``.jsonl`` file is sharded.
+    :param max_workers: Number of processes in the pool shared by all mappers.
+    :param min_shard_bytes: Minimum size of each shard of the file.
+    :return: Results of the mapper for each shard, in the order of the Tweets.
+    """
+    path = tweets.path if isinstance(tweets, TweetView) else None
+    if path is None or path.suffix != '.jsonl' or max_workers <= 1:
+        return [mapper(tweets)]
+
+    n_shards = min(path.stat().st_size // max(1, min_shard_bytes),
+                   max_workers * SHARDS_PER_WORKER)
+    ranges = ndjson_shards(path, n_shards) if n_shards > 1 else []
+    if len(ranges) <= 1:
+        return [mapper(tweets)]
+
+    if multiprocessing.current_process().daemon:
+        current_app.logger.warning(
+            'Cannot start processes from a daemon process - mapping %d shards in-process',
+            len(ranges))
+        return [mapper(iter_ndjson_range(path, start, end)) for start, end in ranges]
+
+    current_app.logger.info('Mapping %d shards of %s in a pool of %d processes',
+                            len(ranges), path, max_workers)
+    modules = _plugin_modules(mapper)
+    pickled = pickle.dumps(mapper)
+    pool = _get_pool(max_workers)
+    try:
+        jobs = [
+            pool.submit(_map_range, modules, pickled, path, start, end)
+            for start, end in ranges
+        ]
+        return [job.result() for job in jobs]
+
+    except BrokenProcessPool:
+        _discard_pool(max_workers, pool)
+        raise
+
+
+class MapReducePlugin(PluginBase):
+    """Base class for Python plugins which aggregate over shards of the Tweets.
+
+    `map_shard` is called with each shard of the Tweets, possibly in another
+    process without the Flask application context, so it is a classmethod
+    and its result must be picklable.  `reduce` merges the partial results
+    in the order of the shards and `write` saves the output files.
+
+    The number of processes is limited by `MAPREDUCE_WORKERS` and the size
+    of each shard by `MAPREDUCE_MIN_SHARD_BYTES`.
+    """
+    @classmethod
+    @abc.abstractmethod
+    def map_shard(cls, tweets: typing.Iterable[typing.Mapping]) -> typing.Any:
+        """Aggregate a shard of the Tweets."""
+
+    @classmethod
+    def reduce(cls, partials: typing.List) -> typing.Any:
+        """Merge the results of each shard.
+
+        By default these are added together, as is suitable for Counters.
+        """
+        result = partials[0]
+        for partial in partials[1:]:
+            result += partial
+
+        return result
+
+    @abc.abstractmethod
+    def write(self, result: typing.Any, work_dir: pathlib.Path,
+              env: typing.Optional[typing.Mapping[str, str]] = None) -> None:
+        """Write the output files from the merged result."""
+
+    def run(self,
+            tweets: typing.Iterable = None,
+            tweets_file: pathlib.Path = None,
+            work_dir: pathlib.Path = None,
+            env: typing.Optional[typing.Mapping[str, str]] = None):
+        """Map shards of the Tweets, merge the results and write the output files."""
+        if tweets is None:
+            tweets = self.tweets
+
+        if tweets is None:
+            tweets = TweetView(tweets_file or self.tweets_file)
+
+        partials = map_shards(self.map_shard, tweets,
+                              current_app.config['MAPREDUCE_WORKERS'],
+                              current_app.config['MAPREDUCE_MIN_SHARD_BYTES'])
+        self.write(self.reduce(partials), work_dir, env)
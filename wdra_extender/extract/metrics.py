@@ -0,0 +1,220 @@
+"""Module containing Prometheus metrics of Bundle builds and requests.
+
+Metrics are served at ``/metrics`` by the web app and, for Celery workers
+with `WORKER_METRICS_PORT` set, by an exporter within each worker.  Builds
+run in Celery worker processes, so their metrics are served by the worker
+exporters unless the app runs without a task queue.
+
+Metrics of Tweet providers and plugins are labelled by name - the
+function names in `TWEET_PROVIDERS` and the plugin names loaded into the
+`PluginCollection`.  These labels are created when the app starts, so each
+series is reported as zero before its first observation.
+
+Web servers and Celery workers which run more than one process must set the
+``prometheus_multiproc_dir`` environment variable to an empty directory in
+which each process records its metrics - see the ``prometheus_client``
+documentation.
+"""
+
+import functools
+import os
+import time
+import typing
+
+from celery import signals
+from flask import Flask
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter,
+                               Histogram, generate_latest, multiprocess,
+                               start_http_server)
+
+from ..extensions import celery
+from .plugins import plugin_registry
+from .scheduler import PluginResult
+
+__all__ = [
+    'HYDRATION_RATE',
+    'PLUGIN_MAX_RSS',
+    'PLUGIN_SECONDS',
+    'PROVIDER_FOUND',
+    'PROVIDER_REQUESTED',
+    'PROVIDER_SECONDS',
+    'REQUEST_SECONDS',
+    'ZIP_BYTES',
+    'ZIP_SECONDS',
+    'init_app',
+    'observe_plugins',
+    'provider_label',
+    'render',
+    'timed_provider',
+    'timed_view',
+]
+
+#: Buckets in seconds for long-running work - a Twitter API lookup may wait
+#: out a rate limit window of 15 minutes and a plugin may run for hours
+LONG_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 5 * 60, 15 * 60, 30 * 60,
+                60 * 60, 2 * 60 * 60, float('inf'))
+
+PROVIDER_SECONDS = Histogram(
+    'wdrax_provider_seconds',
+    'Time spent waiting on a Tweet provider to look up a chunk of Tweets',
+    ['provider'],
+    buckets=LONG_BUCKETS)
+
+PROVIDER_REQUESTED = Counter('wdrax_provider_requested_tweets',
+                             'Tweets requested from a Tweet provider', ['provider'])
+
+PROVIDER_FOUND = Counter('wdrax_provider_found_tweets',
+                         'Tweets found by a Tweet provider', ['provider'])
+
+HYDRATION_RATE = Histogram(
+    'wdrax_hydration_tweets_per_second',
+    'Tweet IDs hydrated per second in each chunk of a build',
+    ['build'],
+    buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, float('inf')))
+
+PLUGIN_SECONDS = Histogram('wdrax_plugin_seconds',
+                           'Time taken by a plugin within a build',
+                           ['plugin', 'status'],
+                           buckets=LONG_BUCKETS)
+
+PLUGIN_MAX_RSS = Histogram(
+    'wdrax_plugin_max_rss_bytes',
+    'Peak resident set size of an executable plugin process',
+    ['plugin'],
+    buckets=tuple(2**n for n in range(24, 38, 2)) + (float('inf'), ))
+
+ZIP_SECONDS = Histogram('wdrax_bundle_zip_seconds',
+                        'Time spent compressing files into a Bundle zip file',
+                        buckets=LONG_BUCKETS)
+
+ZIP_BYTES = Histogram('wdrax_bundle_zip_bytes',
+                      'Size of a Bundle zip file',
+                      buckets=tuple(2**n for n in range(20, 42, 2)) + (float('inf'), ))
+
+REQUEST_SECONDS = Histogram(
+    'wdrax_request_seconds',
+    'Time taken to handle a request, excluding sending a streamed response',
+    ['endpoint'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+             float('inf')))
+
+#: Environment variable naming the directory in which processes record metrics
+MULTIPROC_DIR_ENV = 'prometheus_multiproc_dir'
+
+
+def provider_label(provider_name: str) -> str:
+    """Get the metric label of a Tweet provider from its importable name."""
+    return provider_name.rsplit('.', 1)[-1]
+
+
+def init_app(app: Flask) -> None:
+    """Create the labels of each configured Tweet provider and loaded plugin.
+
+    :param app: Flask App whose Tweet providers and plugins are labelled.
+    """
+    providers = {*app.config['TWEET_PROVIDERS'], *app.config['PARTIAL_TWEET_PROVIDERS']}
+    for name in map(provider_label, providers):
+        PROVIDER_SECONDS.labels(name)
+        PROVIDER_REQUESTED.labels(name)
+        PROVIDER_FOUND.labels(name)
+
+    with app.app_context():
+        plugins = plugin_registry.get()
+
+    for path, entry in plugins.entries.items():
+        PLUGIN_SECONDS.labels(path.name, 'ok')
+        if entry.kind == 'executable':
+            PLUGIN_MAX_RSS.labels(path.name)
+
+
+def get_registry() -> CollectorRegistry:
+    """Get the registry of metrics to export, combining those of every process if required."""
+    if MULTIPROC_DIR_ENV not in os.environ:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render(*registries: CollectorRegistry) -> typing.Tuple[bytes, str]:
+    """Render metrics in the Prometheus text format.
+
+    :param registries: Registries of other metrics to include, such as those
+        of :mod:`.status_metrics`.
+    :return: Metrics and their content type.
+    """
+    body = b''.join(generate_latest(registry) for registry in (get_registry(), *registries))
+    return body, CONTENT_TYPE_LATEST
+
+
+def timed_provider(provider_name: str,
+                   tweets: typing.Iterable[typing.Mapping]) -> typing.Iterator[typing.Mapping]:
+    """Yield the Tweets found by a Tweet provider, recording the time spent waiting on it.
+
+    Time spent by the caller between Tweets is not counted.
+    """
+    elapsed = 0.0
+    tweets = iter(tweets)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                tweet = next(tweets)
+
+            except StopIteration:
+                return
+
+            finally:
+                elapsed += time.perf_counter() - start
+
+            yield tweet
+
+    finally:
+        PROVIDER_SECONDS.labels(provider_label(provider_name)).observe(elapsed)
+
+
+def observe_plugins(results: typing.Iterable[PluginResult]) -> None:
+    """Record the duration and peak memory use of the plugins run within a build.
+
+    Plugins reusing cached output are recorded with status 'cached'.
+    Skipped plugins are not recorded.
+    """
+    for result in results:
+        if result.status == 'skipped':
+            continue
+
+        status = 'cached' if result.cache == 'hit' else result.status
+        PLUGIN_SECONDS.labels(result.name, status).observe(result.duration)
+        if result.max_rss is not None:
+            PLUGIN_MAX_RSS.labels(result.name).observe(result.max_rss)
+
+
+def timed_view(view: typing.Callable) -> typing.Callable:
+    """Decorator to record the time taken by a view, labelled by its name."""
+    histogram = REQUEST_SECONDS.labels(view.__name__)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with histogram.time():
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+@signals.worker_ready.connect
+def start_worker_exporter(**kwargs):
+    """Serve the metrics of a Celery worker and its pool processes if enabled."""
+    # pylint: disable=unused-argument
+    port = celery.app.config['WORKER_METRICS_PORT']
+    if port is not None:
+        start_http_server(port, registry=get_registry())
+        celery.app.logger.info('Serving worker metrics on port %d', port)
+
+
+@signals.worker_process_shutdown.connect
+def mark_process_dead(pid=None, **kwargs):
+    """Stop reporting the live metrics of a Celery pool process which has exited."""
+    # pylint: disable=unused-argument
+    if MULTIPROC_DIR_ENV in os.environ:
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -1,18 +1,27 @@
 """Module containing the Extract model and supporting functionality."""
 
-import json
-import os
+import collections
 import pathlib
+import shutil
 import tempfile
+import time
 import typing
 from uuid import uuid4
-import zipfile
 
 from flask import current_app, url_for
+import numpy
 
 from ..extensions import db
-from .tweet_providers import get_tweets, save_to_redis
-from .plugins import PluginCollection
+from .bundle_zip import StreamingZipWriter, parse_compression
+from .hydration_claims import get_claims
+from .metrics import HYDRATION_RATE, ZIP_BYTES, ZIP_SECONDS, observe_plugins
+from .tweet_ids import decode_tweet_ids, encode_tweet_ids, unique_tweet_ids
+from .tweet_providers import import_object, iter_tweets
+from .tweet_store import StagingArea, TweetView, count_ndjson, iter_ndjson, ndjson_to_json_array
+from .user_cache import cache_users, write_users_file
+from .output_cache import get_output_cache, plugin_keys, tweets_digest
+from .plugins import PluginCollection, plugin_registry
+from .scheduler import PluginFailedError, PluginScheduler, write_report
 
 __all__ = [
     'Extract',
@@ -38,72 +47,395 @@ class Extract(db.Model):
     #: Email address of person who requested the Bundle
     email = db.Column(db.String(254), index=True, nullable=False)
 
+    #: Status of a Bundle which has not yet been built
+    STATUS_PENDING = 'pending'
+
+    #: Status of a Bundle built from cached Tweets while the rest are hydrated
+    STATUS_PARTIAL = 'partial'
+
+    #: Status of a Bundle built after all Tweet IDs have been hydrated
+    STATUS_COMPLETE = 'complete'
+
+    #: Status of a Bundle whose build failed and will not be retried
+    STATUS_FAILED = 'failed'
+
     #: Is the Bundle ready for pickup?
+    #: This is True for both partial and complete Bundles
     ready = db.Column(db.Boolean, default=False, index=True, nullable=False)
 
+    #: Build status of the Bundle - one of the STATUS_* constants
+    status = db.Column(db.String(16),
+                       default=STATUS_PENDING,
+                       index=True,
+                       nullable=False)
+
+    #: Number of distinct Tweet IDs requested
+    tweet_count = db.Column(db.Integer, default=0, nullable=False)
+
+    #: Number of requested Tweet IDs which have been through hydration
+    hydrated_count = db.Column(db.Integer, default=0, nullable=False)
+
+    #: Number of requested Tweet IDs skipped as known to be deleted or protected
+    skipped_count = db.Column(db.Integer, default=0, nullable=False)
+
+    #: Number of requested Tweet IDs hydrated by another build at the same
+    #: time, which this build did not need to look up itself
+    shared_count = db.Column(db.Integer, default=0, nullable=False)
+
+    #: Number of Tweets contained in the most recently built Bundle
+    found_count = db.Column(db.Integer, default=0, nullable=False)
+
+    #: Size class of the build, from its estimated number of Tweet lookups
+    #: See :mod:`.scheduling`
+    size_class = db.Column(db.String(16), default='small', nullable=False)
+
+    #: Time at which the latest build was queued, in UTC
+    queued_at = db.Column(db.DateTime, index=True, nullable=True)
+
+    #: Time at which the latest build started hydration, in UTC
+    started_at = db.Column(db.DateTime, nullable=True)
+
+    #: Distinct requested Tweet IDs - see `set_tweet_ids`
+    #: Deferred so that it is only loaded by the build
+    tweet_id_blob = db.deferred(db.Column(db.LargeBinary, nullable=True))
+
     def save(self) -> None:
         """Save this model to the database."""
         db.session.add(self)
         db.session.commit()
 
-    def build(self, tweet_ids):
+    def set_tweet_ids(self, tweet_ids: numpy.ndarray) -> None:
+        """Store the distinct Tweet IDs requested for this Bundle.
+
+        They are read by the build, so only the UUID of the Bundle needs to
+        be sent to the task queue.
+        """
+        self.tweet_id_blob = encode_tweet_ids(tweet_ids)
+        self.tweet_count = len(tweet_ids)
+
+    def get_tweet_ids(self) -> numpy.ndarray:
+        """Get the distinct Tweet IDs requested for this Bundle."""
+        if self.tweet_id_blob is None:
+            raise ValueError(f'No Tweet IDs stored for Bundle {self.uuid}')
+
+        return decode_tweet_ids(self.tweet_id_blob)
+
+    def build(self, tweet_ids=None, partial: bool = False):
         """Build a requested Twitter extract.
 
-        Called by `extract.tasks.build_extract` Celery task.
+        Runs both stages of the build in turn - the Celery tasks in
+        `extract.tasks` run each stage as its own task.
 
-        :param tweet_ids: Tweet IDs to include within this Bundle.
+        :param tweet_ids: Tweet IDs to include within this Bundle - by
+            default those stored by `set_tweet_ids`.
+        :param partial: Build the Bundle using only the Tweets which are
+            available from the cache providers in `PARTIAL_TWEET_PROVIDERS`.
+            The Bundle is only marked as partial if some Tweets were not found.
+        """
+        self.hydrate_stage(tweet_ids, partial=partial)
+        return self.analyse_stage(partial=partial)
+
+    def get_staging(self, partial: bool = False) -> StagingArea:
+        """Get the staging area in which this Bundle's Tweets are hydrated."""
+        staging_dir = current_app.config['STAGING_DIR']
+        if partial:
+            # Kept separate so partial chunks are not reused by the full build
+            return StagingArea(staging_dir.joinpath(f'{self.uuid}.partial'))
+
+        return StagingArea(staging_dir.joinpath(self.uuid))
+
+    def hydrate_stage(self, tweet_ids=None, partial: bool = False) -> None:
+        """Hydrate the Tweets of this Bundle into its staging area.
+
+        Called by `extract.tasks.hydrate_extract` Celery task.  If a previous
+        attempt hydrated every chunk, the Tweets are not hydrated again.
+
+        :param tweet_ids: Tweet IDs to include within this Bundle - by
+            default those stored by `set_tweet_ids`.
+        :param partial: Hydrate using only the cache providers in `PARTIAL_TWEET_PROVIDERS`.
+        """
+        current_app.logger.info('Hydrating %sBundle %s',
+                                'partial ' if partial else '', self.uuid)
+        config = current_app.config
+        staging = self.get_staging(partial)
+        if staging.merged_path.is_file():
+            current_app.logger.info('Bundle %s is already hydrated', self.uuid)
+            return
+
+        if tweet_ids is None:
+            tweet_ids = self.get_tweet_ids()
+
+        if partial:
+            stats = self.hydrate(tweet_ids,
+                                 staging,
+                                 tweet_providers=config['PARTIAL_TWEET_PROVIDERS'],
+                                 cache_writers=[],
+                                 record_missing=False)
+
+        else:
+            stats = self.hydrate(tweet_ids,
+                                 staging,
+                                 tweet_providers=config['TWEET_PROVIDERS'],
+                                 cache_writers=config['TWEET_CACHE_WRITERS'])
+
+        staging.merge(staging.merged_path, stats['chunks'])
+
+    def analyse_stage(self, partial: bool = False):
+        """Run plugins over the hydrated Tweets of this Bundle and package their output.
+
+        Called by `extract.tasks.analyse_extract` Celery task, after
+        `hydrate_stage`.  Plugin output which was cached by a previous
+        attempt is reused - see `PLUGIN_CACHE_DIR`.
+
+        :param partial: Package the Tweets hydrated for a partial Bundle.
         """
-        current_app.logger.info('Processing Bundle %s', self.uuid)
+        current_app.logger.info('Analysing %sBundle %s',
+                                'partial ' if partial else '', self.uuid)
+        config = current_app.config
+        staging = self.get_staging(partial)
+        ndjson_file = staging.merged_path
 
-        tweets = get_tweets(
-            tweet_ids, tweet_providers=current_app.config['TWEET_PROVIDERS'])
+        if not ndjson_file.is_file():
+            if self.status == self.STATUS_COMPLETE or (
+                    partial and self.status == self.STATUS_PARTIAL):
+                # A previous attempt finished but was not acknowledged
+                current_app.logger.info('Bundle %s is already packaged', self.uuid)
+                return self.uuid
 
-        try:
-            save_to_redis(tweets)
+            raise FileNotFoundError(f'Bundle {self.uuid} has not been hydrated')
 
-        except ConnectionError as exc:
-            current_app.logger.error('Failed to cache found Tweets: %s', exc)
+        zip_path = config['OUTPUT_DIR'].joinpath(self.uuid).with_suffix('.zip')
+        compression = parse_compression(config['BUNDLE_COMPRESSION'])
 
-        with tempfile.TemporaryDirectory() as tmp_dir:
+        # Output files are zipped in the background as soon as they are complete
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                StreamingZipWriter(zip_path, compression) as bundle_zip:
             work_dir = pathlib.Path(tmp_dir)
-            tweets_file = work_dir.joinpath('tweets.json')
 
-            with open(tweets_file, mode='w', encoding='utf-8') as json_out:
-                json.dump(tweets, json_out, ensure_ascii=False, indent=4)
+            tweets_file = write_tweets_file(ndjson_file, work_dir)
+            bundle_zip.add_files(work_dir, [tweets_file.name])
+
+            # Users we already know about, so plugins don't look them up again
+            users_file = staging.path.joinpath('users.jsonl')
+            write_users_file(ndjson_file, users_file)
+
+            plugins = get_plugins()
+            cache = get_output_cache(config)
+            scheduler = PluginScheduler(
+                plugins.plugins,
+                plugins.manifests,
+                max_workers=current_app.config['PLUGIN_MAX_WORKERS'],
+                cache=cache,
+                cache_keys=(None if cache is None else
+                            get_cache_keys(plugins, ndjson_file)),
+                on_output=lambda name, files: bundle_zip.add_files(work_dir, files))
+            # Python plugins share one copy of the Tweets, parsed when first used
+            results = scheduler.run(tweets_file,
+                                    work_dir,
+                                    env={'USERS_CACHE': str(users_file)},
+                                    tweets=TweetView(ndjson_file))
+
+            # Keep a record of plugin timings to explain slow Bundles
+            write_report(results, work_dir.joinpath('00PLUGINS.json'))
+            observe_plugins(results)
+            if cache is not None:
+                cached = collections.Counter(result.cache for result in results)
+                current_app.logger.info(
+                    'Plugin output cache for Bundle %s: %d hits, %d misses',
+                    self.uuid, cached['hit'], cached['miss'])
 
-            for plugin in get_plugins().values():
-                output = plugin(tweets_file, tmp_dir)
-                current_app.logger.info(f'Plugin output: {output}')
+            failed = [result.name for result in results if result.status == 'failed']
+            if failed:
+                raise PluginFailedError(f'Plugins failed: {", ".join(failed)}')
 
-            zip_path = current_app.config['OUTPUT_DIR'].joinpath(
-                self.uuid).with_suffix('.zip')
-            zip_directory(zip_path, work_dir)
-            current_app.logger.info('Zipped output files to %s', zip_path)
+            # Users looked up by plugins can be served from cache next time
+            plugin_users_file = work_dir.joinpath('00USERS.json')
+            if plugin_users_file.is_file():
+                try:
+                    cache_users(iter_ndjson(plugin_users_file))
+
+                except ConnectionError as exc:
+                    current_app.logger.error('Failed to cache users: %s', exc)
+
+            bundle_zip.add_directory(work_dir)
+
+        zip_size = zip_path.stat().st_size
+        ZIP_SECONDS.observe(bundle_zip.write_time)
+        ZIP_BYTES.observe(zip_size)
+        current_app.logger.info('Zipped output files to %s - %d bytes in %.2fs',
+                                zip_path, zip_size, bundle_zip.write_time)
+        found_count = count_ndjson(ndjson_file)
+        staging.clear()
 
         self.ready = True
+        self.found_count = found_count
+        if partial and found_count + self.skipped_count < self.tweet_count:
+            self.status = self.STATUS_PARTIAL
+
+        else:
+            self.status = self.STATUS_COMPLETE
+
         self.save()
         return self.uuid
 
+    def hydrate(self,
+                tweet_ids: typing.Iterable[int],
+                staging: StagingArea,
+                tweet_providers: typing.Iterable[str],
+                cache_writers: typing.Iterable[str],
+                record_missing: bool = True) -> typing.Counter[str]:
+        """Hydrate Tweet IDs in fixed-size chunks, checkpointing each chunk.
+
+        Chunks which were completed by a previous attempt are skipped, so an
+        interrupted build resumes from the last completed chunk.
+
+        :param tweet_ids: Tweet IDs to include within this Bundle.
+        :param staging: Staging area in which to checkpoint chunks.
+        :param tweet_providers: Names of tweet provider functions to import.
+        :param cache_writers: Names of functions to import to cache found Tweets.
+        :param record_missing: Record Tweets which were not found in the negative cache.
+        :return: Counter of 'chunks', Tweets 'found', Tweets 'skipped' and
+            Tweets 'shared' with other builds.
+        """
+        # Remove duplicates but keep order so chunks are the same on retry
+        tweet_ids = unique_tweet_ids(tweet_ids)
+        chunk_size = current_app.config['HYDRATION_CHUNK_SIZE']
+        chunks = [
+            tweet_ids[start:start + chunk_size]
+            for start in range(0, len(tweet_ids), chunk_size)
+        ]
+
+        staging.prepare(len(tweet_ids), chunk_size)
+        self.tweet_count = len(tweet_ids)
+        self.hydrated_count = sum(
+            len(chunk) for index, chunk in enumerate(chunks)
+            if staging.is_complete(index))
+        if not self.hydrated_count:
+            self.skipped_count = 0
+            self.shared_count = 0
+        self.save()
+
+        # Count Tweets in chunks checkpointed by a previous attempt
+        totals = collections.Counter(chunks=len(chunks),
+                                     skipped=self.skipped_count,
+                                     shared=self.shared_count)
+        for index in range(len(chunks)):
+            if staging.is_complete(index):
+                totals['found'] += count_ndjson(staging.chunk_path(index))
+
+        # Only builds which cache the Tweets they find can share them
+        writers = [import_object(name) for name in cache_writers]
+        claims = get_claims(current_app.config, writers) if writers else None
+
+        for index, chunk in enumerate(chunks):
+            if staging.is_complete(index):
+                continue
+
+            stats = collections.Counter()
+            start = time.perf_counter()
+            tweets = iter_tweets(chunk,
+                                 tweet_providers=tweet_providers,
+                                 stats=stats,
+                                 record_missing=record_missing,
+                                 claims=claims)
+            try:
+                n_tweets = staging.write_chunk(index, tweets)
+                totals['found'] += n_tweets
+                totals['skipped'] += stats['skipped']
+                totals['shared'] += stats['shared']
+
+                for writer in writers:
+                    tweets = iter_ndjson(staging.chunk_path(index))
+                    if claims is not None:
+                        # Tweets looked up under a claim were cached before it was released
+                        tweets = (tweet for tweet in tweets if tweet['id'] not in claims.cached)
+
+                    try:
+                        writer(tweets)
+
+                    except ConnectionError as exc:
+                        current_app.logger.error(
+                            'Failed to cache found Tweets using %s: %s',
+                            writer.__name__, exc)
+
+            finally:
+                # Claims are released as their Tweets are cached, unless the lookup failed
+                if claims is not None:
+                    try:
+                        claims.release()
+
+                    except ConnectionError as exc:
+                        current_app.logger.error(
+                            'Failed to release Tweet claims: %s', exc)
+
+            # Partial builds read only from caches, so are much faster
+            HYDRATION_RATE.labels('full' if record_missing else 'partial').observe(
+                len(chunk) / (time.perf_counter() - start))
+
+            self.hydrated_count += len(chunk)
+            self.skipped_count += stats['skipped']
+            self.shared_count += stats['shared']
+            self.save()
+            current_app.logger.info(
+                'Hydrated chunk %d of %d - found %d Tweets - '
+                'skipped %d, not found %d, shared %d - %d of %d done', index + 1,
+                len(chunks), n_tweets, stats['skipped'], stats['not_found'],
+                stats['shared'], self.hydrated_count, self.tweet_count)
+
+        if totals['shared']:
+            current_app.logger.info(
+                'Saved %d Tweet lookups for Bundle %s hydrated by other builds',
+                totals['shared'], self.uuid)
+
+        return totals
+
     def get_absolute_url(self):
         """Get the URL for this object's detail view."""
         return url_for('extract.detail_extract', extract_uuid=self.uuid)
 
 
-def zip_directory(zip_path: pathlib.Path, dir_path: pathlib.Path):
-    """Create a zipfile from a directory."""
-    if not dir_path.is_dir():
-        raise NotADirectoryError
+def write_tweets_file(ndjson_file: pathlib.Path,
+                      work_dir: pathlib.Path) -> pathlib.Path:
+    """Write the Tweets file passed to plugins in the configured format.
+
+    :param ndjson_file: Newline-delimited JSON file containing Tweets.
+    :param work_dir: Directory into which the Tweets file should be written.
+    :return: Path of the written Tweets file.
+    """
+    tweets_format = current_app.config['TWEETS_FILE_FORMAT']
+
+    if tweets_format == 'json':
+        tweets_file = work_dir.joinpath('tweets.json')
+        ndjson_to_json_array(ndjson_file, tweets_file)
+
+    elif tweets_format == 'ndjson':
+        tweets_file = work_dir.joinpath('tweets.jsonl')
+        shutil.copyfile(ndjson_file, tweets_file)
+
+    else:
+        raise ValueError(f'Unknown Tweets file format: {tweets_format}')
 
-    with zipfile.ZipFile(zip_path, 'w') as z:  # pylint: disable=invalid-name
-        for root, _, files in os.walk(dir_path):
-            for f in files:  # pylint: disable=invalid-name
-                filepath = pathlib.Path(root, f)
-                z.write(filepath, arcname=filepath.relative_to(dir_path))
+    return tweets_file
 
 
-def get_plugins() -> typing.Dict[pathlib.Path, typing.Callable]:
-    """Get list of plugin classes."""
-    plugin_directories = [
-        current_app.config['PLUGIN_DIR'],
-    ]
-    return PluginCollection(plugin_directories).load_plugins()
+def get_plugins() -> PluginCollection:
+    """Get the collection of loaded plugins.
+
+    Plugins are only loaded again if they have changed since they were last loaded.
+    """
+    return plugin_registry.get()
+
+
+def get_cache_keys(plugins: PluginCollection,
+                   ndjson_file: pathlib.Path) -> typing.Dict[str, typing.Optional[str]]:
+    """Get the key of each plugin's output in the plugin output cache.
+
+    :param plugins: Loaded plugins.
+    :param ndjson_file: Path to the Tweets of the Bundle, one per line.
+    """
+    return plugin_keys(
+        tweets_digest(ndjson_file),
+        {path.name: digest for path, digest in plugins.digests.items()},
+        {path.name: manifest.depends
+         for path, manifest in plugins.manifests.items()},
+        {'tweets_file_format': current_app.config['TWEETS_FILE_FORMAT']})
@@ -0,0 +1,366 @@
+"""Module containing a content-addressed cache of plugin output files.
+
+A plugin's output depends only on the Tweets it is given, on the plugin
+itself and on the output of the plugins it depends on.  Each of these is
+hashed to give a key, so when an unchanged plugin is given the same set
+of Tweets again, its previous output files are reused rather than running
+the plugin again.
+"""
+
+import ast
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import pathlib
+import shutil
+import sys
+import threading
+import time
+import typing
+import uuid
+
+__all__ = [
+    'PluginOutputCache',
+    'get_output_cache',
+    'imported_sources',
+    'plugin_digest',
+    'plugin_keys',
+    'tweets_digest',
+]
+
+#: Name of the record kept with each cache entry
+ENTRY_FILE = 'entry.json'
+
+#: Files within a plugin directory which do not affect its output
+IGNORED_SUFFIXES = ('.pyc', '.log')
+
+#: Seconds after which an abandoned partial entry may be removed
+TMP_MAX_AGE = 60 * 60
+
+
+def tweets_digest(ndjson_file: pathlib.Path) -> str:
+    """Hash the set of Tweets in a newline-delimited JSON file.
+
+    The hash does not depend on the order of the Tweets, so the same set of
+    Tweets gives the same hash however the request listed their IDs.
+    """
+    digests = []
+    with open(ndjson_file, mode='rb') as ndjson_in:
+        for line in ndjson_in:
+            line = line.strip()
+            if line:
+                digests.append(hashlib.blake2b(line, digest_size=16).digest())
+
+    digests.sort()
+    return hashlib.sha256(b''.join(digests)).hexdigest()
+
+
+def _imported_modules(node: ast.AST, package: typing.Optional[str]) -> typing.Iterator[str]:
+    """Get the names of the modules imported by an import statement.
+
+    :param node: Statement within a module.
+    :param package: Package of the module, against which relative imports are resolved.
+    """
+    if isinstance(node, ast.Import):
+        yield from (alias.name for alias in node.names)
+
+    elif isinstance(node, ast.ImportFrom):
+        base = node.module or ''
+        if node.level:
+            base = importlib.util.resolve_name('.' * node.level + base, package)
+
+        for alias in node.names:
+            # Either a submodule or a name defined within the module
+            submodule = f'{base}.{alias.name}'
+            yield submodule if submodule in sys.modules else base
+
+
+def imported_sources(module_name: str) -> typing.Dict[str, pathlib.Path]:
+    """Find the source files of a module and of the modules it imports, directly or indirectly.
+
+    Only imports from the module's own top-level package and from
+    ``wdra_extender`` are followed, as other packages are versioned separately.
+
+    :param module_name: Name of an imported module.
+    :return: Mapping of module name to source file.
+    """
+    packages = {module_name.split('.')[0], __name__.split('.')[0]}
+    sources = {}
+    pending = [module_name]
+    while pending:
+        name = pending.pop()
+        module = sys.modules.get(name)
+        path = getattr(module, '__file__', None)
+        if name in sources or path is None or not path.endswith('.py'):
+            continue
+
+        sources[name] = pathlib.Path(path)
+        tree = ast.parse(sources[name].read_bytes(), path)
+        pending.extend(
+            imported for node in ast.walk(tree)
+            for imported in _imported_modules(node, module.__package__)
+            if imported.split('.')[0] in packages)
+
+    return sources
+
+
+def plugin_digest(dir_path: typing.Optional[pathlib.Path] = None,
+                  plugin_class: typing.Optional[type] = None) -> str:
+    """Hash the contents of a plugin.
+
+    :param dir_path: Plugin directory - all files within it are hashed
+        except bytecode and logs.
+    :param plugin_class: Python plugin class - the module defining it and the
+        modules that imports, directly or indirectly, from its own package or
+        from ``wdra_extender`` are hashed - see `imported_sources`.  So plugins
+        importing their implementation from a package are rehashed when any
+        module it relies on changes.
+    """
+    files = []
+    if dir_path is not None:
+        for root, dirs, names in os.walk(dir_path):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+            for name in names:
+                if not name.endswith(IGNORED_SUFFIXES):
+                    path = pathlib.Path(root, name)
+                    files.append((path.relative_to(dir_path).as_posix(), path))
+
+    if plugin_class is not None:
+        files.extend(imported_sources(plugin_class.__module__).items())
+
+    digest = hashlib.sha256()
+    for name, path in sorted(files):
+        digest.update(name.encode('utf-8'))
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+
+    return digest.hexdigest()
+
+
+def plugin_keys(
+    tweets_hash: str, digests: typing.Mapping[str, str],
+    depends: typing.Mapping[str, typing.Iterable[str]],
+    context: typing.Mapping[str, typing.Any]
+) -> typing.Dict[str, typing.Optional[str]]:
+    """Get the cache key of the output of each plugin.
+
+    :param tweets_hash: Hash of the set of Tweets - see `tweets_digest`.
+    :param digests: Mapping of plugin name to hash of the plugin.
+    :param depends: Mapping of plugin name to names of its dependencies.
+    :param context: Other settings which affect the output of every plugin.
+    :return: Mapping of plugin name to key, or None if its output cannot be
+        cached because it depends on an unknown plugin or on itself.
+    """
+    keys = {}
+
+    def key(name: str, visiting: typing.FrozenSet[str]) -> typing.Optional[str]:
+        if name in keys:
+            return keys[name]
+
+        if name not in digests or name in visiting:
+            return None
+
+        dependency_keys = [
+            key(dependency, visiting | {name})
+            for dependency in sorted(depends.get(name, ()))
+        ]
+        if None in dependency_keys:
+            keys[name] = None
+
+        else:
+            keys[name] = hashlib.sha256(
+                json.dumps([tweets_hash, digests[name], dependency_keys, context],
+                           sort_keys=True).encode('utf-8')).hexdigest()
+
+        return keys[name]
+
+    for name in digests:
+        key(name, frozenset())
+
+    return keys
+
+
+class PluginOutputCache:
+    """Local store of plugin output files keyed by content hashes.
+
+    Each entry is a directory named by its key, containing the output files
+    and a record of them.  Entries are written under a temporary name and
+    renamed into place, so the store is safe to share between processes.
+
+    :param path: Directory of the store - created if required.
+    :param max_bytes: Total size above which least recently used entries are evicted.
+    :param max_age: Seconds after which entries are evicted, however recently used.
+    """
+    def __init__(self, path: pathlib.Path, max_bytes: int, max_age: int):
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.joinpath('tmp').mkdir(parents=True, exist_ok=True)
+
+    def _entry_dir(self, key: str) -> pathlib.Path:
+        return self.path.joinpath(key[:2], key)
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+
+            else:
+                self.misses += 1
+
+    def get(self, key: str,
+            dest_dir: pathlib.Path) -> typing.Optional[typing.List[str]]:
+        """Copy the output files of a cache entry into a directory.
+
+        :return: Paths of the files relative to the directory, or None if
+            there is no usable entry for this key.
+        """
+        entry_dir = self._entry_dir(key)
+        copied = []
+        try:
+            record_path = entry_dir.joinpath(ENTRY_FILE)
+            record = json.loads(record_path.read_text(encoding='utf-8'))
+            if time.time() - record['created'] > self.max_age:
+                raise FileNotFoundError(record_path)
+
+            for name in record['files']:
+                target = dest_dir.joinpath(name)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(entry_dir.joinpath('files', name), target)
+                copied.append(target)
+
+            # Record the time of last use for eviction
+            os.utime(record_path)
+
+        except (OSError, ValueError, KeyError):
+            for target in copied:
+                target.unlink()
+
+            self._count(hit=False)
+            return None
+
+        self._count(hit=True)
+        return record['files']
+
+    def put(self, key: str, src_dir: pathlib.Path,
+            files: typing.Iterable[str]) -> None:
+        """Store output files in a cache entry then evict old entries if required.
+
+        :param src_dir: Directory containing the files.
+        :param files: Paths of the files relative to the directory.
+        """
+        files = sorted(files)
+        tmp_dir = self.path.joinpath('tmp', uuid.uuid4().hex)
+        try:
+            size = 0
+            for name in files:
+                target = tmp_dir.joinpath('files', name)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(src_dir.joinpath(name), target)
+                size += target.stat().st_size
+
+            tmp_dir.joinpath(ENTRY_FILE).write_text(json.dumps({
+                'created': time.time(),
+                'size': size,
+                'files': files,
+            }), encoding='utf-8')
+
+            entry_dir = self._entry_dir(key)
+            entry_dir.parent.mkdir(exist_ok=True)
+            try:
+                os.rename(tmp_dir, entry_dir)
+
+            except OSError:
+                # Another process stored the same output first
+                if not entry_dir.joinpath(ENTRY_FILE).is_file():
+                    raise
+
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+
+    def _entries(self) -> typing.List[typing.Tuple[float, float, int, pathlib.Path]]:
+        """Get the last use time, creation time, size and directory of each entry."""
+        entries = []
+        for record_path in self.path.glob(f'??/*/{ENTRY_FILE}'):
+            try:
+                last_used = record_path.stat().st_mtime
+                record = json.loads(record_path.read_text(encoding='utf-8'))
+                entries.append((last_used, record['created'], record['size'],
+                                record_path.parent))
+
+            except (OSError, ValueError, KeyError):
+                continue
+
+        return entries
+
+    def evict(self) -> int:
+        """Remove expired entries then least recently used entries until within the size limit.
+
+        :return: Number of entries evicted.
+        """
+        now = time.time()
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size, _ in entries)
+        evicted = 0
+
+        # Free an extra 10% so eviction does not run again on the next put
+        target = self.max_bytes if total <= self.max_bytes else self.max_bytes * 0.9
+        for _, created, size, entry_dir in entries:
+            if total <= target and now - created <= self.max_age:
+                continue
+
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            evicted += 1
+
+        # Partial entries left by workers which were killed
+        for tmp_dir in self.path.joinpath('tmp').iterdir():
+            try:
+                if now - tmp_dir.stat().st_mtime > TMP_MAX_AGE:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+            except FileNotFoundError:
+                continue
+
+        return evicted
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Report hit ratio of this process and size of the store."""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'entries': len(entries),
+            'used_bytes': sum(size for _, _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def _open_cache(path: pathlib.Path, max_bytes: int,
+                max_age: int) -> PluginOutputCache:
+    return PluginOutputCache(path, max_bytes, max_age)
+
+
+def get_output_cache(
+        config: typing.Mapping) -> typing.Optional[PluginOutputCache]:
+    """Get the plugin output cache configured in a Flask config dictionary.
+
+    :return: The cache or None if it is disabled.
+    """
+    if config['PLUGIN_CACHE_MAX_BYTES'] <= 0:
+        return None
+
+    return _open_cache(config['PLUGIN_CACHE_DIR'],
+                       config['PLUGIN_CACHE_MAX_BYTES'],
+                       config['PLUGIN_CACHE_MAX_AGE'])
@@ -1,24 +1,57 @@
 """Module containing tweet processing plugin loaders and structure."""
 
 import abc
+import configparser
+import importlib.util
+import inspect
 import logging
 import os
 import pathlib
+import re
 import subprocess
+import sys
+import tempfile
+import threading
 import typing
 
 from flask import current_app
 
+try:
+    import importlib.metadata as importlib_metadata
+
+except ImportError:  # pragma: no cover
+    # Backport for Python < 3.8
+    import importlib_metadata
+
+from .output_cache import plugin_digest
+from .tweet_store import TweetView
+
+#: Name of the file within a plugin directory which provides a Python plugin
+PLUGIN_MODULE = 'plugin.py'
+
+#: Prefix of the module name under which each plugin module is imported
+PLUGIN_MODULE_PREFIX = 'wdrax_plugin_'
+
+#: Entry point group through which installed packages may provide Python plugins
+ENTRY_POINT_GROUP = 'wdrax.plugins'
+
 
 class PluginBase(metaclass=abc.ABCMeta):
     """
     Base class for Python plugins to WDRAX.
 
-    All Python plugins should inherit from this class
+    All Python plugins should inherit from this class.
+    Python plugins run within the worker process and receive the Tweets
+    already parsed, as a sequence shared with the other plugins of a build
+    which must not be modified.
     """
-    def __init__(self, tweets: typing.Iterable, tweets_file=None):
+    def __init__(self,
+                 tweets: typing.Iterable,
+                 tweets_file=None,
+                 plugin_dir: typing.Optional[pathlib.Path] = None):
         self.tweets = tweets
         self.tweets_file = tweets_file
+        self.plugin_dir = plugin_dir
 
         current_app.logger.info('Starting plugin: %s', self)
 
@@ -26,11 +59,14 @@ class PluginBase(metaclass=abc.ABCMeta):
     def run(self,
             tweets: typing.Iterable = None,
             tweets_file: pathlib.Path = None,
-            work_dir: pathlib.Path = None):
+            work_dir: pathlib.Path = None,
+            env: typing.Optional[typing.Mapping[str, str]] = None):
         """Execute this plugin.
 
         The plugin is expected to save files in the working directory
         which will be included in the output zip file.
+
+        :param env: Extra environment variables, as passed to executable plugins.
         """
 
     def __repr__(self) -> str:
@@ -45,16 +81,118 @@ def log_proc_output(proc: subprocess.CompletedProcess,
         current_app.logger.log(level, msg)
 
     log('-- Plugin STDOUT')
-    for line in proc.stderr.splitlines():
+    for line in proc.stdout.splitlines():
         log(line)
     log('-- End plugin STDOUT')
 
     log('-- Plugin STDERR')
-    for line in proc.stdout.splitlines():
+    for line in proc.stderr.splitlines():
         log(line)
     log('-- End plugin STDERR')
 
 
+class PluginProcess(subprocess.CompletedProcess):
+    """Completed executable plugin process, with its peak memory use."""
+    def __init__(self, args, returncode: int, stdout: str, stderr: str,
+                 max_rss: typing.Optional[int] = None):
+        # pylint: disable=too-many-arguments
+        super().__init__(args, returncode, stdout=stdout, stderr=stderr)
+
+        #: Peak resident set size of the process in bytes
+        self.max_rss = max_rss
+
+
+def run_process(args: typing.Sequence, **kwargs) -> PluginProcess:
+    """Run a process to completion, capturing its output and peak memory use.
+
+    Output is captured in temporary files and the process is reaped with
+    `os.wait4`, which reports the resource usage of that process alone -
+    unlike `resource.getrusage`, which combines every child of the worker.
+
+    :param args: Program and arguments, as passed to `subprocess.Popen`.
+    :param kwargs: Further arguments to `subprocess.Popen`.
+    """
+    with tempfile.TemporaryFile(mode='w+') as stdout, \
+            tempfile.TemporaryFile(mode='w+') as stderr:
+        # pylint: disable=consider-using-with
+        proc = subprocess.Popen(args, stdout=stdout, stderr=stderr, text=True, **kwargs)
+        _, status, rusage = os.wait4(proc.pid, 0)
+
+        # Reaped here, so Popen must not wait for the process itself
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+
+        stdout.seek(0)
+        stderr.seek(0)
+
+        # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+        max_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return PluginProcess(proc.args, proc.returncode, stdout.read(),
+                             stderr.read(), max_rss)
+
+
+class PluginEntry(typing.NamedTuple):
+    """Record of where a loaded plugin comes from."""
+    #: Either 'python' or 'executable'
+    kind: str
+
+    #: Resolved main file, plugin module and class, or entry point
+    source: str
+
+
+class PluginManifest(typing.NamedTuple):
+    """Scheduling metadata declared by a plugin.
+
+    Read from an optional ``plugin.ini`` file next to the plugin's ``main.*``
+    file, e.g.::
+
+        [plugin]
+        depends = DOTWEETSTABLE
+        max_parallel = 1
+    """
+    #: Name of the plugin - the name of its directory
+    name: str
+
+    #: Names of plugins which must complete before this one starts
+    depends: typing.Tuple[str, ...] = ()
+
+    #: Maximum number of plugins, including this one, which may be running
+    #: while this plugin is running - ``None`` for no limit
+    max_parallel: typing.Optional[int] = None
+
+
+def read_manifest(dir_path: pathlib.Path) -> PluginManifest:
+    """Read the manifest from a plugin directory if it has one."""
+    manifest_path = dir_path.joinpath('plugin.ini')
+    if not manifest_path.is_file():
+        return PluginManifest(name=dir_path.name)
+
+    parser = configparser.ConfigParser()
+    parser.read(manifest_path, encoding='utf-8')
+    if not parser.has_section('plugin'):
+        raise IOError('Plugin manifest has no [plugin] section')
+
+    section = parser['plugin']
+    depends = tuple(
+        name for name in re.split(r'[\s,]+', section.get('depends', ''))
+        if name)
+
+    try:
+        max_parallel = section.getint('max_parallel', fallback=None)
+
+    except ValueError as exc:
+        raise IOError('Plugin manifest max_parallel must be an integer') from exc
+
+    if max_parallel is not None and max_parallel < 1:
+        raise IOError('Plugin manifest max_parallel must be at least 1')
+
+    return PluginManifest(name=dir_path.name,
+                          depends=depends,
+                          max_parallel=max_parallel)
+
+
 def executable_plugin(filepath) -> typing.Callable:
     """Factory to construct an Executable Plugin from a filepath.
 
@@ -62,14 +200,25 @@ def executable_plugin(filepath) -> typing.Callable:
     the tweet data provided by it to WDRAX and produces a number
     of output files in the specified working directory.
     """
-    def run(tweets_file: pathlib.Path = None, work_dir: pathlib.Path = None):
+    def run(tweets_file: pathlib.Path = None,
+            work_dir: pathlib.Path = None,
+            env: typing.Optional[typing.Mapping[str, str]] = None,
+            tweets: typing.Optional[typing.Sequence] = None):
         """Run an executable file as a WDRAX plugin.
 
         The file is expected to save files in the working directory
         which will be included in the output zip file.
+
+        :param env: Extra environment variables to pass to the plugin.
+        :param tweets: Unused - executable plugins read the tweets file.
+        :return: The completed process, including its captured output and peak memory use.
         """
+        # pylint: disable=unused-argument
+        extra_env = env or {}
+
         # Add plugin directory to environment so extra files can be used
         env = os.environ.copy()
+        env.update(extra_env)
         env['BIN'] = filepath.parent
         for key in {
                 'TWITTER_CONSUMER_KEY', 'TWITTER_CONSUMER_SECRET',
@@ -78,29 +227,96 @@ def executable_plugin(filepath) -> typing.Callable:
             env[key.replace('TWITTER_', '')] = current_app.config[key]
 
         current_app.logger.info('Executing plugin: %s', filepath.parent.name)
-        try:
-            proc = subprocess.run([filepath, tweets_file],
-                                  cwd=work_dir,
-                                  check=True,
-                                  capture_output=True,
-                                  env=env,
-                                  text=True)
-
-        except subprocess.CalledProcessError:
+        proc = run_process([filepath, tweets_file], cwd=work_dir, env=env)
+
+        if proc.returncode != 0:
             # Process returned non-zero status
             current_app.logger.error('Plugin failed: %s', filepath.parent.name)
             log_proc_output(proc, level=logging.ERROR)
 
-            raise
+            raise subprocess.CalledProcessError(proc.returncode,
+                                                proc.args,
+                                                output=proc.stdout,
+                                                stderr=proc.stderr)
 
-        else:
-            log_proc_output(proc, level=logging.DEBUG)
+        log_proc_output(proc, level=logging.DEBUG)
+
+        return proc
+
+    return run
+
+
+def python_plugin(plugin_class: typing.Type[PluginBase],
+                  dir_path: typing.Optional[pathlib.Path] = None) -> typing.Callable:
+    """Factory to construct a Python Plugin runner from a PluginBase subclass.
+
+    A Python Plugin runs within the worker process, so avoids the cost of
+    starting a process and parsing the tweet data again.
+    """
+    def run(tweets_file: pathlib.Path = None,
+            work_dir: pathlib.Path = None,
+            env: typing.Optional[typing.Mapping[str, str]] = None,
+            tweets: typing.Optional[typing.Sequence] = None):
+        """Run a PluginBase subclass as a WDRAX plugin.
+
+        :param env: Extra environment variables to pass to the plugin.
+        :param tweets: Parsed Tweets shared between plugins - if not given
+            they are parsed from the tweets file when first used.
+        """
+        if tweets is None:
+            tweets = TweetView(tweets_file)
 
-        return proc.stdout
+        current_app.logger.info('Executing plugin in process: %s',
+                                plugin_class.__name__)
+        plugin = plugin_class(tweets, tweets_file, plugin_dir=dir_path)
+        return plugin.run(tweets=tweets,
+                          tweets_file=tweets_file,
+                          work_dir=work_dir,
+                          env=env)
 
     return run
 
 
+def load_plugin_class(module_path: pathlib.Path) -> typing.Type[PluginBase]:
+    """Import a plugin module and find the PluginBase subclass it provides.
+
+    The module must contain exactly one concrete subclass, which may be
+    imported from elsewhere.
+    """
+    spec = importlib.util.spec_from_file_location(
+        f'{PLUGIN_MODULE_PREFIX}{module_path.parent.name}', module_path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so plugin classes can be pickled for worker processes
+    sys.modules[spec.name] = module
+    try:
+        spec.loader.exec_module(module)
+
+    except Exception as exc:  # pylint: disable=broad-except
+        del sys.modules[spec.name]
+        raise IOError(f'Plugin module failed to import: {exc!r}') from exc
+
+    classes = {
+        obj for obj in vars(module).values()
+        if inspect.isclass(obj) and issubclass(obj, PluginBase)
+        and not inspect.isabstract(obj)
+    }
+    if len(classes) != 1:
+        raise IOError(
+            f'Plugin module must contain one PluginBase subclass, found {len(classes)}')
+
+    return classes.pop()
+
+
+def iter_entry_points(group: str) -> typing.Iterator[importlib_metadata.EntryPoint]:
+    """Get the installed entry points in a group."""
+    entry_points = importlib_metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return iter(entry_points.select(group=group))
+
+    # Python < 3.10 returns a dict of groups
+    return iter(entry_points.get(group, []))
+
+
 class PluginCollection:
     """Load plugins from one or multiple directories."""
     def __init__(self, plugin_directories: typing.Iterable[pathlib.Path]):
@@ -108,6 +324,14 @@ class PluginCollection:
             d.resolve() for d in plugin_directories if d.is_dir()
         ]
         self.plugins = {}
+        self.manifests = {}
+        self.entries = {}
+
+        #: Mapping of plugin directory or name to hash of the plugin's contents
+        self.digests = {}
+
+        #: Mapping of plugin directory or name to reason it could not be loaded
+        self.errors = {}
 
     @staticmethod
     def get_main_file(dir_path: pathlib.Path) -> pathlib.Path:
@@ -127,24 +351,159 @@ class PluginCollection:
         raise IOError('Plugin has no main.* file')
 
     def load_plugins(self) -> typing.Dict[pathlib.Path, typing.Callable]:
-        """Load plugins from the specified directories."""
-        # Load executable files as plugins
+        """Load plugins from the specified directories and entry points.
+
+        A directory containing a ``plugin.py`` module is loaded as a Python
+        plugin, otherwise its ``main.*`` file is loaded as an executable plugin.
+        """
         for directory in self.plugin_directories:
             current_app.logger.info('Loading plugins from directory: %s',
                                     directory)
 
             subdirs = sorted(p for p in directory.iterdir() if p.is_dir())
             for dir_path in subdirs:
+                module_path = dir_path.joinpath(PLUGIN_MODULE)
                 try:
-                    plugin_path = self.get_main_file(dir_path)
-
-                except IOError as exc:
+                    if module_path.is_file():
+                        plugin_class = load_plugin_class(module_path)
+                        plugin = python_plugin(plugin_class, dir_path)
+                        entry = PluginEntry(
+                            'python',
+                            f'{module_path.resolve()}:{plugin_class.__name__}')
+                        digest = plugin_digest(dir_path, plugin_class)
+
+                    else:
+                        main_file = self.get_main_file(dir_path)
+                        plugin = executable_plugin(main_file)
+                        entry = PluginEntry('executable', str(main_file.resolve()))
+                        digest = plugin_digest(dir_path)
+
+                    manifest = read_manifest(dir_path)
+
+                except (IOError, configparser.Error) as exc:
                     current_app.logger.error('Error loading plugin %s: %s',
                                              dir_path, str(exc))
+                    self.errors[dir_path] = str(exc)
                     continue
 
-                current_app.logger.info('Loaded executable plugin: %s',
+                current_app.logger.info('Loaded %s plugin: %s', entry.kind,
                                         dir_path.name)
-                self.plugins[dir_path] = executable_plugin(plugin_path)
+                self.plugins[dir_path] = plugin
+                self.manifests[dir_path] = manifest
+                self.entries[dir_path] = entry
+                self.digests[dir_path] = digest
 
+        self.load_entry_points()
         return self.plugins
+
+    def load_entry_points(self, group: str = ENTRY_POINT_GROUP) -> None:
+        """Load Python plugins provided by installed packages."""
+        names = {path.name for path in self.plugins}
+
+        for entry_point in iter_entry_points(group):
+            if entry_point.name in names:
+                current_app.logger.error(
+                    'Error loading plugin %s: a plugin with this name exists',
+                    entry_point.name)
+                continue
+
+            try:
+                plugin_class = entry_point.load()
+                if not (inspect.isclass(plugin_class)
+                        and issubclass(plugin_class, PluginBase)):
+                    raise TypeError('Entry point is not a PluginBase subclass')
+
+                digest = plugin_digest(plugin_class=plugin_class)
+
+            except Exception as exc:  # pylint: disable=broad-except
+                current_app.logger.error('Error loading plugin %s: %s',
+                                         entry_point.name, str(exc))
+                self.errors[pathlib.Path(entry_point.name)] = str(exc)
+                continue
+
+            current_app.logger.info('Loaded Python plugin: %s',
+                                    entry_point.name)
+            # Plugins are identified by name - these have no directory
+            path = pathlib.Path(entry_point.name)
+            self.plugins[path] = python_plugin(plugin_class)
+            self.manifests[path] = PluginManifest(name=entry_point.name)
+            self.entries[path] = PluginEntry('python', entry_point.value)
+            self.digests[path] = digest
+            names.add(entry_point.name)
+
+
+class PluginRegistry:
+    """Plugins loaded once per process and reloaded only when they change.
+
+    Plugins are loaded and validated when the app is created.  Checking for
+    changes only needs the modification times of the plugin directories and
+    the files directly within each plugin, which is much cheaper than
+    loading the plugins again.  Touching a plugin directory, e.g. with
+    ``flask plugins reload``, makes every process reload its plugins.
+    """
+    def __init__(self, app=None):
+        self.plugin_directories = []
+        self._collection = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Load and validate plugins from the directory set in the Flask app config."""
+        self.plugin_directories = [app.config['PLUGIN_DIR']]
+
+        with app.app_context():
+            collection = self.reload()
+            for path, error in collection.errors.items():
+                app.logger.warning('Invalid plugin %s: %s', path.name, error)
+
+    def signature(self) -> typing.Tuple[typing.Tuple[str, typing.Optional[int]], ...]:
+        """Get the modification times of the plugin directories and their files."""
+        mtimes = []
+        for directory in self.plugin_directories:
+            try:
+                mtimes.append((str(directory), directory.stat().st_mtime_ns))
+                with os.scandir(directory) as subdirs:
+                    for subdir in subdirs:
+                        if not subdir.is_dir():
+                            continue
+
+                        mtimes.append((subdir.path, subdir.stat().st_mtime_ns))
+                        with os.scandir(subdir.path) as files:
+                            mtimes.extend(
+                                (f.path, f.stat().st_mtime_ns) for f in files)
+
+            except FileNotFoundError:
+                mtimes.append((str(directory), None))
+
+        return tuple(sorted(mtimes))
+
+    def reload(self) -> PluginCollection:
+        """Load all plugins again."""
+        with self._lock:
+            collection = PluginCollection(self.plugin_directories)
+            collection.load_plugins()
+
+            # After loading, since importing plugin modules writes bytecode
+            self._signature = self.signature()
+            self._collection = collection
+
+        return collection
+
+    def get(self) -> PluginCollection:
+        """Get the loaded plugins, reloading them first if they have changed."""
+        if self._collection is None or self.signature() != self._signature:
+            current_app.logger.info('Plugins have changed - reloading')
+            return self.reload()
+
+        return self._collection
+
+    def touch(self) -> None:
+        """Signal every process using these plugin directories to reload them."""
+        for directory in self.plugin_directories:
+            os.utime(directory)
+
+
+plugin_registry = PluginRegistry()  # pylint: disable=invalid-name
@@ -0,0 +1,367 @@
+"""Module containing the scheduler which runs plugins concurrently.
+
+Plugins which do not depend on each other are run at the same time in a
+bounded thread pool.  Executable plugins spend their time in a subprocess,
+so threads are sufficient to keep all cores busy.  Python plugins run in
+the pool threads themselves and share a single parsed copy of the Tweets.
+
+When given a plugin output cache, each plugin runs in a private directory
+containing only the output of its dependencies, so that the files it
+writes can be stored and reused by later builds of the same Tweets.
+Plugins also run in private directories when their output is streamed
+into the Bundle zip file, which receives each plugin's files as soon as
+no plugin still to run may change them.
+"""
+
+from concurrent import futures
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import time
+import typing
+
+from flask import current_app
+
+from .output_cache import PluginOutputCache
+from .plugins import PluginManifest
+
+__all__ = [
+    'PluginFailedError',
+    'PluginResult',
+    'PluginScheduler',
+    'write_report',
+]
+
+
+class PluginFailedError(RuntimeError):
+    """One or more plugins failed during a build."""
+
+
+class PluginResult(typing.NamedTuple):
+    """Record of a single plugin execution within a build."""
+    #: Name of the plugin - the name of its directory
+    name: str
+
+    #: One of 'ok', 'failed' or 'skipped'
+    status: str
+
+    #: Exit status of the plugin process - ``None`` if it did not run
+    returncode: typing.Optional[int] = None
+
+    #: Wall time taken by the plugin in seconds
+    duration: float = 0.0
+
+    #: Captured standard output of the plugin
+    stdout: str = ''
+
+    #: Captured standard error of the plugin, or the reason it was skipped
+    stderr: str = ''
+
+    #: 'hit' or 'miss' in the plugin output cache - ``None`` if not cached
+    cache: typing.Optional[str] = None
+
+    #: Peak resident set size of the plugin process in bytes - ``None`` if
+    #: unknown, e.g. for Python plugins, which share the worker process
+    max_rss: typing.Optional[int] = None
+
+
+#: Directory within the work directory in which isolated plugins run
+PRIVATE_DIR = '.plugins'
+
+
+def walk_files(dir_path: pathlib.Path) -> typing.List[str]:
+    """List files within a directory as paths relative to it."""
+    return [
+        pathlib.Path(root, name).relative_to(dir_path).as_posix()
+        for root, _, names in os.walk(dir_path) for name in names
+    ]
+
+
+class PluginScheduler:
+    """Run a collection of plugins, respecting their declared dependencies.
+
+    :param plugins: Mapping of plugin directory to plugin callable.
+    :param manifests: Mapping of plugin directory to plugin manifest.
+    :param max_workers: Maximum number of plugins to run at the same time.
+    :param cache: Store from which plugin output is reused.
+    :param cache_keys: Mapping of plugin name to key of its output in the
+        cache - plugins without a key are always run.
+    :param on_output: Called with the name of a plugin and the paths of its
+        output files relative to the work directory, once no plugin which
+        depends on it is still to run.
+    """
+    def __init__(self,
+                 plugins: typing.Mapping[pathlib.Path, typing.Callable],
+                 manifests: typing.Mapping[pathlib.Path, PluginManifest],
+                 max_workers: int = 1,
+                 cache: typing.Optional[PluginOutputCache] = None,
+                 cache_keys: typing.Optional[typing.Mapping[
+                     str, typing.Optional[str]]] = None,
+                 on_output: typing.Optional[typing.Callable[
+                     [str, typing.List[str]], None]] = None):
+        self.plugins = {path.name: plugin for path, plugin in plugins.items()}
+        self.manifests = {
+            path.name: manifests.get(path, PluginManifest(name=path.name))
+            for path in plugins
+        }
+        self.max_workers = max(1, max_workers)
+        self.cache = cache
+        self.cache_keys = cache_keys or {}
+        self.on_output = on_output
+        self.results = {}
+        self.outputs = {}
+        self.released = set()
+
+    @property
+    def isolated(self) -> bool:
+        """Do plugins run in private directories, so that their output files are known?"""
+        return self.cache is not None or self.on_output is not None
+
+    def _limit(self, name: str) -> int:
+        max_parallel = self.manifests[name].max_parallel
+        if max_parallel is None:
+            return self.max_workers
+
+        return min(max_parallel, self.max_workers)
+
+    def _can_start(self, name: str, running: typing.Collection[str]) -> bool:
+        """Would starting this plugin keep every running plugin within its limit?"""
+        n_running = len(running) + 1
+        return all(n_running <= self._limit(other)
+                   for other in [name, *running])
+
+    def _skip(self, name: str, reason: str) -> None:
+        current_app.logger.warning('Skipping plugin %s: %s', name, reason)
+        self.results[name] = PluginResult(name=name,
+                                          status='skipped',
+                                          stderr=reason)
+
+    def _dependencies(self, name: str) -> typing.Set[str]:
+        """Get the names of all plugins on which a plugin depends, directly or indirectly."""
+        found = set()
+        stack = list(self.manifests[name].depends)
+        while stack:
+            dependency = stack.pop()
+            if dependency not in found and dependency in self.manifests:
+                found.add(dependency)
+                stack.extend(self.manifests[dependency].depends)
+
+        return found
+
+    def _release_outputs(self) -> None:
+        """Pass on the output of plugins which no plugin still to run may change."""
+        if self.on_output is None:
+            return
+
+        # Copied as plugins still running add their output from other threads
+        for name, files in list(self.outputs.items()):
+            if name in self.released:
+                continue
+
+            if all(other in self.results for other in self.manifests
+                   if name in self._dependencies(other)):
+                self.released.add(name)
+                self.on_output(name, files)
+
+    @staticmethod
+    def _run(name: str, plugin: typing.Callable, tweets_file: pathlib.Path,
+             work_dir: pathlib.Path,
+             env: typing.Optional[typing.Mapping[str, str]],
+             tweets: typing.Optional[typing.Sequence]) -> PluginResult:
+        """Run a single plugin and record the outcome."""
+        start = time.perf_counter()
+        try:
+            proc = plugin(tweets_file, work_dir, env=env, tweets=tweets)
+
+        except subprocess.CalledProcessError as exc:
+            return PluginResult(name=name,
+                                status='failed',
+                                returncode=exc.returncode,
+                                duration=time.perf_counter() - start,
+                                stdout=exc.stdout or '',
+                                stderr=exc.stderr or '')
+
+        except Exception as exc:  # pylint: disable=broad-except
+            current_app.logger.exception('Plugin failed: %s', name)
+            return PluginResult(name=name,
+                                status='failed',
+                                duration=time.perf_counter() - start,
+                                stderr=repr(exc))
+
+        return PluginResult(name=name,
+                            status='ok',
+                            returncode=getattr(proc, 'returncode', 0),
+                            duration=time.perf_counter() - start,
+                            stdout=getattr(proc, 'stdout', '') or '',
+                            stderr=getattr(proc, 'stderr', '') or '',
+                            max_rss=getattr(proc, 'max_rss', None))
+
+    def _link_inputs(
+        self, name: str, work_dir: pathlib.Path, private_dir: pathlib.Path
+    ) -> typing.Dict[str, typing.Tuple[int, int]]:
+        """Link the output of a plugin's dependencies into its private directory.
+
+        :return: Mapping of linked file to its size and modification time, to
+            tell whether the plugin changed it.
+        """
+        inputs = {}
+        for dependency in self._dependencies(name):
+            for path in self.outputs.get(dependency, ()):
+                target = private_dir.joinpath(path)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(work_dir.joinpath(path), target)
+
+                except OSError:
+                    shutil.copy2(work_dir.joinpath(path), target)
+
+                stat = target.stat()
+                inputs[path] = (stat.st_size, stat.st_mtime_ns)
+
+        return inputs
+
+    def _collect(self, name: str, private_dir: pathlib.Path,
+                 work_dir: pathlib.Path, files: typing.Iterable[str]) -> None:
+        """Move a plugin's output from its private directory into the work directory."""
+        self.outputs[name] = list(files)
+        for path in self.outputs[name]:
+            target = work_dir.joinpath(path)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(private_dir.joinpath(path), target)
+
+    def _execute(self, app, name: str, plugin: typing.Callable,
+                 tweets_file: pathlib.Path, work_dir: pathlib.Path,
+                 env: typing.Optional[typing.Mapping[str, str]],
+                 tweets: typing.Optional[typing.Sequence]) -> PluginResult:
+        """Execute a single plugin within the Flask context, reusing cached output if possible."""
+        with app.app_context():
+            if not self.isolated:
+                return self._run(name, plugin, tweets_file, work_dir, env,
+                                 tweets)
+
+            key = self.cache_keys.get(name) if self.cache is not None else None
+            start = time.perf_counter()
+            private_dir = work_dir.joinpath(PRIVATE_DIR, name)
+            private_dir.mkdir(parents=True)
+
+            files = None if key is None else self.cache.get(key, private_dir)
+            if files is not None:
+                self._collect(name, private_dir, work_dir, files)
+                return PluginResult(name=name,
+                                    status='ok',
+                                    duration=time.perf_counter() - start,
+                                    cache='hit')
+
+            inputs = self._link_inputs(name, work_dir, private_dir)
+            result = self._run(name, plugin, tweets_file, private_dir, env,
+                               tweets)
+            if key is not None:
+                result = result._replace(cache='miss')
+
+            files = []
+            for path in walk_files(private_dir):
+                stat = private_dir.joinpath(path).stat()
+                if inputs.get(path) != (stat.st_size, stat.st_mtime_ns):
+                    files.append(path)
+
+            if key is not None and result.status == 'ok':
+                try:
+                    self.cache.put(key, private_dir, files)
+
+                except OSError:
+                    current_app.logger.exception(
+                        'Failed to cache output of plugin: %s', name)
+
+            self._collect(name, private_dir, work_dir, files)
+            return result
+
+    def run(
+        self,
+        tweets_file: pathlib.Path,
+        work_dir: pathlib.Path,
+        env: typing.Optional[typing.Mapping[str, str]] = None,
+        tweets: typing.Optional[typing.Sequence] = None
+    ) -> typing.List[PluginResult]:
+        """Run all plugins and return a record of each execution.
+
+        A plugin is skipped if any of its dependencies are unknown, failed
+        or were themselves skipped.
+
+        :param tweets_file: Path to the tweet data passed to each plugin.
+        :param work_dir: Directory into which plugins write their output.
+        :param env: Extra environment variables to pass to each plugin.
+        :param tweets: Parsed Tweets passed to each Python plugin.
+        """
+        app = current_app._get_current_object()  # pylint: disable=protected-access
+        pending = list(self.plugins)
+        running = {}
+
+        for name in pending:
+            unknown = set(self.manifests[name].depends) - set(self.plugins)
+            if unknown:
+                self._skip(name, f'unknown dependencies {sorted(unknown)}')
+
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                progress = False
+                for name in pending:
+                    if name in self.results:
+                        continue
+
+                    depends = [self.results.get(d) for d in
+                               self.manifests[name].depends]
+                    if any(r is not None and r.status != 'ok' for r in depends):
+                        self._skip(name, 'a dependency did not complete')
+                        progress = True
+
+                    elif (all(r is not None for r in depends)
+                          and self._can_start(name, running.values())):
+                        future = pool.submit(self._execute, app, name,
+                                             self.plugins[name], tweets_file,
+                                             work_dir, env, tweets)
+                        running[future] = name
+                        progress = True
+
+                pending = [
+                    name for name in pending
+                    if name not in self.results and name not in running.values()
+                ]
+                if not running:
+                    if progress:
+                        continue
+                    break
+
+                done, _ = futures.wait(running,
+                                       return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    del running[future]
+                    self.results[result.name] = result
+                    current_app.logger.info(
+                        'Plugin %s %s in %.2fs with exit status %s%s',
+                        result.name, result.status, result.duration,
+                        result.returncode,
+                        f' (cache {result.cache})' if result.cache else '')
+
+                self._release_outputs()
+
+        for name in pending:
+            self._skip(name, 'circular dependencies')
+
+        self._release_outputs()
+        if self.isolated:
+            shutil.rmtree(work_dir.joinpath(PRIVATE_DIR), ignore_errors=True)
+
+        return [self.results[name] for name in self.plugins]
+
+
+def write_report(results: typing.Iterable[PluginResult],
+                 path: pathlib.Path) -> None:
+    """Write a JSON record of plugin executions for later inspection."""
+    with open(path, mode='w', encoding='utf-8') as report_out:
+        json.dump([result._asdict() for result in results],
+                  report_out,
+                  ensure_ascii=False,
+                  indent=4)
@@ -0,0 +1,212 @@
+"""Module containing size-aware fair scheduling of Bundle builds.
+
+A single Bundle of millions of Tweets can take hours to hydrate, so builds
+are not queued first come, first served.  When a Bundle is requested:
+
+* It is given a size class from the number of Tweets estimated to need
+  looking up from the Twitter API - its number of Tweet IDs less those
+  estimated, from a sample, to be in the cache.  Each build stage has a
+  queue for each size class, which workers consume in turn, so small builds
+  are not stuck behind large ones while large ones still progress.
+* It is given a priority within its queue from the number of other builds
+  the same person has in progress, so that one person submitting many
+  Bundles does not hold up everyone else.  Each person's first build is
+  served before anyone's second build, and so on.
+
+Priorities follow the Redis broker, with 0 the highest priority.
+"""
+
+import datetime
+import typing
+
+from flask import current_app
+import numpy
+import redis
+from sqlalchemy import func
+
+from ..extensions import BUILD_STAGES, SIZE_CLASSES, celery, get_stage_queue, redis_pool
+from .models import Extract
+from .utils import batched
+
+__all__ = [
+    'BuildEstimate',
+    'MAX_PRIORITY',
+    'estimate_build',
+    'estimate_hit_rate',
+    'get_priority',
+    'queue_stats',
+]
+
+#: Lowest priority given to a build - the number of priority levels less one
+MAX_PRIORITY = 9
+
+
+class BuildEstimate(typing.NamedTuple):
+    """Estimated size of a Bundle build, made when it is requested."""
+    #: Number of distinct Tweet IDs requested
+    tweet_count: int
+
+    #: Estimated fraction of the Tweets which are cached or known to be unavailable
+    hit_rate: float
+
+    #: Estimated number of Tweets to look up from the Twitter API
+    lookups: int
+
+    #: One of `SIZE_CLASSES`
+    size_class: str
+
+
+def estimate_hit_rate(tweet_ids: typing.Sequence[int], sample_size: int) -> float:
+    """Estimate the fraction of Tweets which will not need looking up from the Twitter API.
+
+    Checks a random sample of the Tweet IDs against the Redis cache and the
+    negative cache of Tweets known to be unavailable.
+
+    :param tweet_ids: Distinct Tweet IDs.
+    :param sample_size: Maximum number of Tweet IDs to check.
+    :raises ConnectionError: If Redis could not be reached.
+    """
+    tweet_ids = numpy.asarray(tweet_ids)
+    if not len(tweet_ids):  # pylint: disable=len-as-condition
+        return 0.0
+
+    if len(tweet_ids) > sample_size:
+        tweet_ids = numpy.random.default_rng().choice(tweet_ids,
+                                                      sample_size,
+                                                      replace=False)
+
+    hits = 0
+    try:
+        for batch in batched(tweet_ids.tolist(), current_app.config['REDIS_BATCH_SIZE']):
+            pipe = redis_pool.client.pipeline(transaction=False)
+            for tweet_id in batch:
+                pipe.exists(f'tweet_hydrated:{tweet_id}', f'tweet_missing:{tweet_id}')
+
+            with redis_pool.timed('pipeline'):
+                hits += sum(1 for found in pipe.execute() if found)
+
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.TimeoutError) as exc:
+        raise ConnectionError from exc
+
+    return hits / len(tweet_ids)
+
+
+def estimate_build(tweet_ids: typing.Sequence[int]) -> BuildEstimate:
+    """Estimate the size of a Bundle build from its distinct Tweet IDs.
+
+    If the cache cannot be reached, no Tweets are assumed to be cached.
+    """
+    config = current_app.config
+    try:
+        hit_rate = estimate_hit_rate(tweet_ids, config['HIT_RATE_SAMPLE_SIZE'])
+
+    except ConnectionError as exc:
+        current_app.logger.warning('Failed to estimate cache hit rate: %s', exc)
+        hit_rate = 0.0
+
+    lookups = round(len(tweet_ids) * (1 - hit_rate))
+    if lookups <= config['SMALL_BUILD_MAX_LOOKUPS']:
+        size_class = 'small'
+
+    elif lookups <= config['MEDIUM_BUILD_MAX_LOOKUPS']:
+        size_class = 'medium'
+
+    else:
+        size_class = 'large'
+
+    return BuildEstimate(len(tweet_ids), hit_rate, lookups, size_class)
+
+
+def get_priority(extract: Extract) -> int:
+    """Get the queue priority of a build from its requester's other builds in progress.
+
+    Builds count as in progress if they were queued within the last
+    `FAIR_SHARE_WINDOW` seconds and have neither completed nor failed.
+    """
+    since = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=current_app.config['FAIR_SHARE_WINDOW'])
+
+    in_progress = Extract.query.filter(
+        Extract.email == extract.email,
+        Extract.uuid != extract.uuid,
+        Extract.status.notin_([Extract.STATUS_COMPLETE, Extract.STATUS_FAILED]),
+        Extract.queued_at >= since,
+    ).count()
+
+    return min(in_progress, MAX_PRIORITY)
+
+
+def get_queue_depths(queues: typing.Iterable[str]) -> typing.Dict[str, typing.Optional[int]]:
+    """Get the number of messages waiting in Celery queues, or ``None`` for those unknown.
+
+    Every queue is checked over a single broker connection.
+    """
+    depths = dict.fromkeys(queues)
+    try:
+        with celery.connection_for_read() as connection:
+            # Do not wait for an unreachable broker
+            connection.ensure_connection(max_retries=1)
+            for queue in depths:
+                # A missing queue may close the channel used to check it
+                try:
+                    with connection.channel() as channel:
+                        depths[queue] = channel.queue_declare(queue=queue,
+                                                              passive=True).message_count
+
+                except Exception:  # pylint: disable=broad-except
+                    # Missing queues and brokers which cannot report end here
+                    pass
+
+    except Exception:  # pylint: disable=broad-except
+        # Unreachable brokers end here
+        pass
+
+    return depths
+
+
+def queue_stats(window: float = 60 * 60) -> typing.Dict[str, typing.Any]:
+    """Report the depth of each build queue and the time builds of each size class wait.
+
+    :param window: Seconds over which to report the wait time of started builds.
+    """
+    config = current_app.config
+    now = datetime.datetime.utcnow()
+    since = now - datetime.timedelta(seconds=window)
+
+    depths = None
+    if config['CELERY_BROKER_URL']:
+        depths = get_queue_depths(
+            get_stage_queue(config, stage, size_class) for stage in BUILD_STAGES
+            for size_class in SIZE_CLASSES)
+
+    waiting = {
+        size_class: (count, oldest)
+        for size_class, count, oldest in Extract.query.with_entities(
+            Extract.size_class, func.count(), func.min(Extract.queued_at)).filter(
+                Extract.queued_at.isnot(None),
+                Extract.started_at.is_(None)).group_by(Extract.size_class)
+    }
+
+    waits = {}
+    for size_class, queued_at, started_at in Extract.query.with_entities(
+            Extract.size_class, Extract.queued_at, Extract.started_at).filter(
+                Extract.started_at >= since, Extract.queued_at.isnot(None)):
+        waits.setdefault(size_class, []).append(
+            (started_at - queued_at).total_seconds())
+
+    size_classes = {}
+    for size_class in SIZE_CLASSES:
+        count, oldest = waiting.get(size_class, (0, None))
+        class_waits = waits.get(size_class, [])
+        size_classes[size_class] = {
+            'waiting': count,
+            'oldest_wait_s': None if oldest is None else (now - oldest).total_seconds(),
+            'started': len(class_waits),
+            'mean_wait_s': (sum(class_waits) / len(class_waits)
+                            if class_waits else None),
+            'max_wait_s': max(class_waits, default=None),
+        }
+
+    return {'queue_depths': depths, 'size_classes': size_classes}
+
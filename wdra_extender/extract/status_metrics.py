@@ -0,0 +1,140 @@
+"""Module containing Prometheus metrics of the build queues and caches.
+
+These report the state of resources shared by every process rather than
+events within one, so they are collected by the web app only when
+``/metrics`` is scraped.  Counting queued messages opens a broker
+connection, sizing the plugin output cache walks its directory and sizing
+the local Tweet store counts its rows - none of which a ``/health`` check
+should wait on.
+"""
+
+import typing
+
+from flask import Flask
+from prometheus_client import CollectorRegistry
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+
+from ..extensions import SIZE_CLASSES
+from .local_store import get_store
+from .output_cache import get_output_cache
+from .scheduling import queue_stats
+
+__all__ = [
+    'StatusCollector',
+    'get_registry',
+    'init_app',
+]
+
+#: Name under which the registry of status metrics is kept in `Flask.extensions`
+EXTENSION_NAME = 'wdrax_status_metrics'
+
+#: Statistics of each build size class reported by `scheduling.queue_stats`
+#: and the name and description of their metrics
+SIZE_CLASS_GAUGES = {
+    'waiting': ('wdrax_builds_waiting', 'Builds queued but not yet started'),
+    'oldest_wait_s': ('wdrax_build_oldest_wait_seconds',
+                      'Time waited so far by the oldest build not yet started'),
+    'started': ('wdrax_builds_started', 'Builds started within the last hour'),
+    'mean_wait_s': ('wdrax_build_mean_wait_seconds',
+                    'Mean time waited by the builds started within the last hour'),
+    'max_wait_s': ('wdrax_build_max_wait_seconds',
+                   'Longest time waited by a build started within the last hour'),
+}
+
+
+class StatusCollector:
+    """Collect metrics of the build queues, the local Tweet store and the plugin output cache."""
+    def __init__(self, app: Flask):
+        self.app = app
+
+    def collect(self) -> typing.Iterator[Metric]:
+        """Collect the current status of the build queues and caches.
+
+        Metrics which cannot be collected are left out, so the rest are still exported.
+        """
+        with self.app.app_context():
+            for collect in [self.collect_queues, self.collect_tweet_store,
+                            self.collect_plugin_cache]:
+                try:
+                    metrics = list(collect())
+
+                except Exception as exc:  # pylint: disable=broad-except
+                    self.app.logger.warning('Failed to collect status metrics: %r', exc)
+                    continue
+
+                yield from metrics
+
+    def collect_queues(self) -> typing.Iterator[Metric]:
+        """Collect the depth of each build queue and the time builds wait to start."""
+        stats = queue_stats()
+
+        depths = GaugeMetricFamily('wdrax_build_queue_messages',
+                                   'Messages waiting in a build queue',
+                                   labels=['queue'])
+        for queue, depth in (stats['queue_depths'] or {}).items():
+            # Unknown if the broker could not be reached
+            if depth is not None:
+                depths.add_metric([queue], depth)
+
+        yield depths
+
+        for key, (name, documentation) in SIZE_CLASS_GAUGES.items():
+            gauge = GaugeMetricFamily(name, documentation, labels=['size_class'])
+            for size_class in SIZE_CLASSES:
+                value = stats['size_classes'][size_class][key]
+                if value is not None:
+                    gauge.add_metric([size_class], value)
+
+            yield gauge
+
+    def collect_tweet_store(self) -> typing.Iterator[Metric]:
+        """Collect the size and hits of the local Tweet store."""
+        stats = get_store(self.app.config).stats()
+
+        yield CounterMetricFamily('wdrax_tweet_store_hits',
+                                  'Tweets found in the local Tweet store',
+                                  value=stats['hits'])
+        yield CounterMetricFamily('wdrax_tweet_store_misses',
+                                  'Tweets looked up but not found in the local Tweet store',
+                                  value=stats['misses'])
+        yield GaugeMetricFamily('wdrax_tweet_store_tweets',
+                                'Tweets held in the local Tweet store',
+                                value=stats['tweets'])
+        yield GaugeMetricFamily('wdrax_tweet_store_bytes',
+                                'Size of the local Tweet store',
+                                value=stats['used_bytes'])
+        yield GaugeMetricFamily('wdrax_tweet_store_max_bytes',
+                                'Size to which the local Tweet store is limited',
+                                value=stats['max_bytes'])
+
+    def collect_plugin_cache(self) -> typing.Iterator[Metric]:
+        """Collect the size of the plugin output cache, if it is enabled.
+
+        Its hits are counted by the builds which use it - see `metrics.PLUGIN_SECONDS`.
+        """
+        cache = get_output_cache(self.app.config)
+        if cache is None:
+            return
+
+        stats = cache.stats()
+        yield GaugeMetricFamily('wdrax_plugin_cache_entries',
+                                'Plugin outputs held in the plugin output cache',
+                                value=stats['entries'])
+        yield GaugeMetricFamily('wdrax_plugin_cache_bytes',
+                                'Size of the plugin output cache',
+                                value=stats['used_bytes'])
+        yield GaugeMetricFamily('wdrax_plugin_cache_max_bytes',
+                                'Size to which the plugin output cache is limited',
+                                value=stats['max_bytes'])
+
+
+def init_app(app: Flask) -> None:
+    """Create the registry of status metrics collected for a Flask App."""
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(StatusCollector(app))
+    app.extensions[EXTENSION_NAME] = registry
+
+
+def get_registry(app: Flask) -> CollectorRegistry:
+    """Get the registry of status metrics collected for a Flask App."""
+    return app.extensions[EXTENSION_NAME]
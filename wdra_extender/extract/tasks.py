@@ -1,11 +1,177 @@
-"""Module containing Celery tasks related to Twitter Extract Bundles."""
+"""Module containing Celery tasks related to Twitter Extract Bundles.
 
-from ..extensions import celery
+A Bundle is built in two stages, each sent to its own queue so that
+network-bound hydration and CPU-bound analysis can be served by separate
+workers - see `HYDRATION_QUEUE` and `ANALYSIS_QUEUE`:
+
+* `hydrate_extract` hydrates the Tweet IDs into the Bundle's staging area
+  and caches the Tweets it finds
+* `analyse_extract` runs the plugins over the Tweets and packages their
+  output into the Bundle zip file
+
+Each stage resumes from its own checkpoints when retried, so work which
+was completed by a previous attempt is not repeated.
+
+Builds are queued by size class and prioritised fairly between the people
+who requested them - see :mod:`.scheduling`.
+"""
+
+import datetime
+
+from celery import chain
+from celery.canvas import Signature
+from flask import current_app
+import requests
+
+from ..extensions import celery, get_stage_queue
 from .models import Extract
+from .scheduling import get_priority
+
+#: Options shared by the tasks of every stage
+# Acknowledge late so the task is redelivered if the worker dies
+# A retried stage resumes from its last checkpoint
+STAGE_OPTIONS = {
+    'acks_late': True,
+    'reject_on_worker_lost': True,
+    'autoretry_for': (requests.exceptions.RequestException, ),
+    'retry_backoff': True,
+    'max_retries': 5,
+}
+
+
+def build_stages(uuid,
+                 tweet_ids=None,
+                 partial: bool = False,
+                 size_class: str = 'small',
+                 priority: int = 0) -> Signature:
+    """Get the chain of tasks which builds a Bundle.
+
+    :param uuid: UUID of the Bundle to build.
+    :param tweet_ids: Tweet IDs to include - by default those stored with the Bundle.
+    :param partial: Build a partial Bundle from cached Tweets.
+    :param size_class: Size class of the build, whose queues the tasks are sent to.
+    :param priority: Priority of the tasks within their queues - 0 is the highest.
+    """
+    config = current_app.config
+    return chain(
+        hydrate_extract.si(uuid, tweet_ids, partial=partial).set(
+            queue=get_stage_queue(config, 'hydration', size_class),
+            priority=priority),
+        analyse_extract.si(uuid, partial=partial).set(
+            queue=get_stage_queue(config, 'analysis', size_class),
+            priority=priority))
+
+
+def queue_build(extract: Extract, tweet_ids=None, partial: bool = False) -> None:
+    """Queue the build of a Bundle in the queues for its size class.
+
+    The build is given a lower priority for each other build in progress
+    for the same person - see `scheduling.get_priority`.
+
+    :param extract: Bundle to build.
+    :param tweet_ids: Tweet IDs to include - by default those stored with the Bundle.
+    :param partial: Build a partial Bundle from cached Tweets, then the full Bundle.
+    """
+    priority = get_priority(extract)
+    extract.queued_at = datetime.datetime.utcnow()
+    extract.started_at = None
+    if extract.status == Extract.STATUS_FAILED:
+        extract.status = Extract.STATUS_PENDING
+
+    extract.save()
+
+    current_app.logger.info('Queueing %s %sbuild of Bundle %s with priority %d',
+                            extract.size_class, 'partial ' if partial else '',
+                            extract.uuid, priority)
+    build_stages(extract.uuid, tweet_ids, partial, extract.size_class,
+                 priority).delay()
+
+
+@celery.task(stage='hydration', **STAGE_OPTIONS)
+def build_extract(uuid, tweet_ids=None):
+    """Begin the build of a requested Twitter Extract Bundle.
+
+    The Tweet IDs stored with the Bundle are used unless others are given.
+    """
+    queue_build(Extract.query.get(uuid), tweet_ids)
+    return uuid
+
+
+@celery.task(stage='hydration', **STAGE_OPTIONS)
+def build_partial_extract(uuid, tweet_ids=None):
+    """Build a Bundle from cached Tweets then queue the full build if required."""
+    queue_build(Extract.query.get(uuid), tweet_ids, partial=True)
+    return uuid
 
 
-@celery.task()
-def build_extract(uuid, tweet_ids):
-    """Begin the build of a requested Twitter Extract Bundle."""
+def is_final_attempt(task, exc: Exception) -> bool:
+    """Check whether a failed attempt of a build stage task will not be retried.
+
+    :param task: Bound task whose attempt failed.
+    :param exc: Exception raised by the attempt.
+    """
+    return (not isinstance(exc, task.autoretry_for)
+            or task.request.retries >= task.max_retries)
+
+
+def end_failed_build(extract: Extract, tweet_ids=None, partial: bool = False) -> None:
+    """Queue the full build of a Bundle whose partial build failed, else mark it as failed.
+
+    Failed builds no longer lower the priority of the same person's other
+    builds - see `scheduling.get_priority`.
+
+    :param extract: Bundle whose build failed on its final attempt.
+    :param tweet_ids: Tweet IDs to include - by default those stored with the Bundle.
+    :param partial: Whether the failed build was a partial build.
+    """
+    if partial:
+        # The complete Bundle is still wanted
+        queue_build(extract, tweet_ids)
+
+    else:
+        current_app.logger.error('Build of Bundle %s failed', extract.uuid)
+        extract.status = Extract.STATUS_FAILED
+        extract.save()
+
+
+@celery.task(bind=True, stage='hydration', **STAGE_OPTIONS)
+def hydrate_extract(self, uuid, tweet_ids=None, partial: bool = False):
+    """Hydrate the Tweets of a Bundle, ready for `analyse_extract`."""
+    extract = Extract.query.get(uuid)
+    if extract.started_at is None:
+        # For the wait time reported by `scheduling.queue_stats`
+        extract.started_at = datetime.datetime.utcnow()
+        extract.save()
+
+    try:
+        extract.hydrate_stage(tweet_ids, partial=partial)
+
+    except Exception as exc:
+        # Not while this stage will be retried, or it would be done by every attempt
+        if is_final_attempt(self, exc):
+            end_failed_build(extract, tweet_ids, partial)
+
+        raise
+
+    return uuid
+
+
+@celery.task(bind=True, stage='analysis', **STAGE_OPTIONS)
+def analyse_extract(self, uuid, partial: bool = False):
+    """Run plugins over the hydrated Tweets of a Bundle and package their output."""
     extract = Extract.query.get(uuid)
-    return extract.build(tweet_ids)
+
+    try:
+        extract.analyse_stage(partial=partial)
+
+    except Exception as exc:
+        if is_final_attempt(self, exc):
+            end_failed_build(extract, partial=partial)
+
+        raise
+
+    # The complete Bundle is still wanted if the partial build did not find every Tweet
+    if partial and extract.status != Extract.STATUS_COMPLETE:
+        queue_build(extract)
+
+    return uuid
@@ -0,0 +1,419 @@
+"""Module containing a native Python engine for the DOTEXTTABLE and DOWORDCLOUD plugins.
+
+Both plugins derive their output from the text of each Tweet with mentions,
+hashtags and URLs removed, as by ``sanitised.jq``.  This produces the same
+files as their ``main.sh`` scripts, ``language.csv`` byte for byte, with
+the text of each shard of Tweets cleaned and counted in large batches by
+regular expressions and Counters rather than per-line shell tools.
+
+The shell pipelines pass text through jq, sed, tr, sort, join and uniq, so
+text is matched, sorted and joined the way those tools do it.  In
+particular jq's regular expressions are Oniguruma's, whose ``\\w`` and
+``\\s`` differ from Python's, and jq stops all output at the first Tweet
+which it cannot process, for example one without ``full_text``.
+"""
+
+import collections
+import functools
+import pathlib
+import re
+import sys
+import typing
+import unicodedata
+
+from flask import current_app
+from wordcloud import WordCloud, random_color_func
+
+from .accounts_table import _awk_fields, _jq_cell
+from .mapreduce import MapReducePlugin
+
+__all__ = [
+    'TextStats',
+    'TextTablePlugin',
+    'WordCloudPlugin',
+    'read_stopwords',
+    'sanitise',
+    'write_language_table',
+    'write_word_cloud',
+]
+
+#: Header row of ``language.csv``
+LANGUAGE_HEADER = 'Hashtag\tFreq\t\tWord\tFreq'
+
+#: Number of Tweets whose text is cleaned and counted at once
+BATCH_SIZE = 10000
+
+#: Oniguruma whitespace - unlike Python, this excludes U+001C to U+001F
+_URL = re.compile('https?://[^\t\n\x0b\x0c\r \x85\xa0\u1680\u2000-\u200a'
+                  '\u2028\u2029\u202f\u205f\u3000]+')
+
+#: Characters removed by ``sed -e 's/[^ -}]//g'``, keeping line breaks
+_NOT_PRINTABLE = re.compile('[^ -}\n]+')
+
+#: Words left by ``tr '[A-Z] ' '[a-z]\\012' | sed -e 's/[^a-z].*//'``
+_WORD = re.compile('(?<![^ \n])[a-z]+')
+
+#: Characters removed by ``tr -cd '\\t-~'``
+_NOT_CLOUD = re.compile('[^\t-~]+')
+
+#: First character on each line replaced by ``sed -e 's/[^A-Za-z0-9 ]/ /'``
+_CLOUD_FIRST = re.compile('^([A-Za-z0-9 ]*)[^A-Za-z0-9 \n]', re.MULTILINE)
+
+#: ``tr '[A-Z]' '[a-z]'`` only changes ASCII letters
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+                             'abcdefghijklmnopqrstuvwxyz')
+
+
+class _JqError(Exception):
+    """jq would stop with an error, so produces no output for later Tweets."""
+
+
+#: Symbols which Oniguruma treats as word characters - circled letters
+_WORD_SYMBOLS = ((0x24b6, 0x24e9), (0x1f130, 0x1f149), (0x1f150, 0x1f169),
+                 (0x1f170, 0x1f189))
+
+
+def _is_onig_word(code: int) -> bool:
+    """Is a character matched by Oniguruma's ``\\w``?
+
+    These are Python's word characters, and also marks and connector
+    punctuation, but not numbers other than digits beyond Latin-1.
+    """
+    char = chr(code)
+    category = unicodedata.category(char)
+    if category in {'Mn', 'Mc', 'Me', 'Pc'}:
+        return True
+
+    if category == 'No':
+        return code <= 0xff
+
+    if category == 'So':
+        return any(low <= code <= high for low, high in _WORD_SYMBOLS)
+
+    return char.isalnum()
+
+
+@functools.lru_cache(maxsize=None)
+def _mention_pattern() -> typing.Pattern:
+    """Get the pattern ``[@#]\\w+`` as matched by Oniguruma.
+
+    This is built from the Unicode database when first used.
+    """
+    ranges = []
+    for code in range(sys.maxunicode + 1):
+        if _is_onig_word(code):
+            if ranges and ranges[-1][1] == code - 1:
+                ranges[-1][1] = code
+
+            else:
+                ranges.append([code, code])
+
+    word = ''.join(
+        re.escape(chr(low)) if low == high else
+        f'{re.escape(chr(low))}-{re.escape(chr(high))}'
+        for low, high in ranges)
+    return re.compile(f'[@#][{word}]+')
+
+
+def sanitise(text: str) -> str:
+    """Remove mentions, hashtags and URLs from text, as by ``sanitised.jq``."""
+    return _URL.sub('', _mention_pattern().sub('', text))
+
+
+def _jq_index(obj: typing.Any, key: str) -> typing.Any:
+    """Get a key of an object as jq does, failing if it is not an object."""
+    if obj is None:
+        return None
+
+    if not isinstance(obj, dict):
+        raise _JqError(f'Cannot index {type(obj).__name__} with "{key}"')
+
+    return obj.get(key)
+
+
+def _jq_original(tweet: typing.Any) -> typing.Any:
+    """Get the Tweet processed by both jq programs - the original of a retweet."""
+    _jq_index(_jq_index(tweet, 'user'), 'screen_name')
+    if not isinstance(tweet, dict):
+        raise _JqError('Cannot check whether Tweet has a key')
+
+    if 'retweeted_status' in tweet:
+        return tweet['retweeted_status']
+
+    return tweet
+
+
+def _hashtag_cells(tweet: typing.Any) -> typing.List[str]:
+    """Get the ``@tsv`` cells output by ``hashtags.jq`` for a Tweet."""
+    hashtags = _jq_index(_jq_index(_jq_original(tweet), 'entities'), 'hashtags')
+    if isinstance(hashtags, dict):
+        hashtags = list(hashtags.values())
+
+    elif not isinstance(hashtags, list):
+        raise _JqError('Cannot iterate over hashtags')
+
+    try:
+        return [_jq_cell(_jq_index(hashtag, 'text')) for hashtag in hashtags]
+
+    except TypeError as exc:
+        raise _JqError(str(exc)) from exc
+
+
+def _full_text(tweet: typing.Any) -> str:
+    """Get the text which ``sanitised.jq`` sanitises for a Tweet."""
+    text = _jq_index(_jq_original(tweet), 'full_text')
+    if not isinstance(text, str):
+        raise _JqError('full_text cannot be matched, as it is not a string')
+
+    return text
+
+
+class TextStats:
+    """Accumulate hashtag and word counts, or word cloud text, over Tweets.
+
+    Tables can be merged with ``+=`` in the order of their Tweets.  Once jq
+    would have stopped with an error, the Tweets of later tables are ignored.
+
+    :param hashtags: Count hashtags for the ``language.csv`` hashtag table.
+    :param words: Count words for the ``language.csv`` word table.
+    :param cloud: Keep the text passed to the word cloud.
+    """
+    def __init__(self,
+                 hashtags: bool = True,
+                 words: bool = True,
+                 cloud: bool = False):
+        self.hashtags = collections.Counter() if hashtags else None
+        self.words = collections.Counter() if words else None
+        self.cloud_text = [] if cloud else None
+
+        #: Would jq have stopped producing hashtags?
+        self.hashtags_stopped = not hashtags
+
+        #: Would jq have stopped producing sanitised text?
+        self.text_stopped = False
+
+    def update(self, tweets: typing.Iterable[typing.Mapping]) -> None:
+        """Add Tweets, processing their text in batches."""
+        texts = []
+        tokens = []
+        for tweet in tweets:
+            if not self.hashtags_stopped:
+                try:
+                    cells = _hashtag_cells(tweet)
+
+                except _JqError:
+                    self.hashtags_stopped = True
+
+                else:
+                    # Lines removed by ``grep .`` have a single empty cell
+                    if len(cells) > 1 or cells and cells[0]:
+                        tokens.extend(cells)
+
+            if not self.text_stopped:
+                try:
+                    texts.append(_full_text(tweet))
+
+                except _JqError:
+                    self.text_stopped = True
+
+            if len(texts) >= BATCH_SIZE:
+                self._add_texts(texts)
+                texts = []
+
+            if len(tokens) >= BATCH_SIZE:
+                self._add_hashtags(tokens)
+                tokens = []
+
+            if self.hashtags_stopped and self.text_stopped:
+                break
+
+        self._add_texts(texts)
+        self._add_hashtags(tokens)
+
+    def _add_hashtags(self, tokens: typing.List[str]) -> None:
+        if not tokens:
+            return
+
+        joined = '\t'.join(tokens)
+        if joined.isascii():
+            joined = joined.lower()
+
+        else:
+            joined = joined.translate(_ASCII_LOWER)
+
+        self.hashtags.update(joined.split('\t'))
+
+    def _add_texts(self, texts: typing.List[str]) -> None:
+        if not texts:
+            return
+
+        # As output by ``jq -r``, one line or more per Tweet
+        text = sanitise('\n'.join(texts)) + '\n'
+        if self.words is not None:
+            self.words.update(
+                _WORD.findall(_NOT_PRINTABLE.sub('', text).lower()))
+
+        if self.cloud_text is not None:
+            self.cloud_text.append(
+                _CLOUD_FIRST.sub(r'\1 ', _NOT_CLOUD.sub('', text)))
+
+    def __iadd__(self, other: 'TextStats') -> 'TextStats':
+        if not self.hashtags_stopped:
+            self.hashtags.update(other.hashtags)
+            self.hashtags_stopped = other.hashtags_stopped
+
+        if not self.text_stopped:
+            if self.words is not None:
+                self.words.update(other.words)
+
+            if self.cloud_text is not None:
+                self.cloud_text.extend(other.cloud_text)
+
+            self.text_stopped = other.text_stopped
+
+        return self
+
+    def hashtag_rows(self) -> typing.List[str]:
+        """Get the rows of the hashtag table, as output by ``uniq -c | awk``."""
+        rows = []
+        for token in sorted(self.hashtags):
+            fields = _awk_fields(token)
+            rows.append(f'{fields[0] if fields else ""}\t{self.hashtags[token]}')
+
+        return rows
+
+    def word_rows(self, stopword_keys: typing.Sequence[str]) -> typing.List[str]:
+        """Get the rows of the word table - words used more than once, most frequent first.
+
+        :param stopword_keys: Join fields of the lines of the stop words file,
+            in file order - see `read_stopwords`.
+        """
+        # Merge as ``join -v 1`` does, which assumes the stop words are sorted
+        counts = []
+        index = 0
+        for word in sorted(self.words):
+            while index < len(stopword_keys) and stopword_keys[index] < word:
+                index += 1
+
+            if index < len(stopword_keys) and stopword_keys[index] == word:
+                while index < len(stopword_keys) and stopword_keys[index] == word:
+                    index += 1
+                continue
+
+            if self.words[word] > 1:
+                counts.append((self.words[word], word))
+
+        # ``sort -rn`` breaks ties by comparing whole lines in reverse
+        counts.sort(reverse=True)
+        return [f'{word}\t{count}' for count, word in counts]
+
+    def text(self) -> str:
+        """Get the text passed to the word cloud."""
+        return ''.join(self.cloud_text)
+
+
+def read_stopwords(path: pathlib.Path) -> typing.List[str]:
+    """Read the join field of each line of a stop words file, as ``join`` does."""
+    with open(path, mode='r', encoding='utf-8') as stopwords_in:
+        return [(line.split(None, 1) or [''])[0]
+                for line in stopwords_in.read().splitlines()]
+
+
+def language_rows(hashtag_rows: typing.Sequence[str],
+                  word_rows: typing.Sequence[str]) -> typing.Iterator[str]:
+    """Combine the hashtag and word tables side by side, padding the shorter."""
+    for index in range(max(len(hashtag_rows), len(word_rows))):
+        # As by ``paste -d '\\a'`` then ``sed``
+        line = (hashtag_rows[index] if index < len(hashtag_rows) else '') + '\a' + (
+            word_rows[index] if index < len(word_rows) else '')
+        if line.startswith('\a'):
+            line = '\t\t\t' + line[1:]
+
+        yield line.replace('\a', '\t\t', 1)
+
+
+def write_language_table(stats: TextStats, work_dir: pathlib.Path,
+                         bin_dir: pathlib.Path) -> None:
+    """Write the ``language.csv`` output file of the DOTEXTTABLE plugin.
+
+    :param stats: Hashtag and word counts of the Tweets.
+    :param work_dir: Directory into which the output file is written.
+    :param bin_dir: DOTEXTTABLE plugin directory containing the stop words.
+    """
+    stopword_keys = read_stopwords(bin_dir.joinpath('STOPWORDS.100'))
+    with open(work_dir.joinpath('language.csv'), mode='w', encoding='utf-8',
+              newline='') as csv_out:
+        csv_out.write(LANGUAGE_HEADER + '\n')
+        for line in language_rows(stats.hashtag_rows(),
+                                  stats.word_rows(stopword_keys)):
+            csv_out.write(line)
+            csv_out.write('\n')
+
+
+def write_word_cloud(stats: TextStats, work_dir: pathlib.Path,
+                     bin_dir: pathlib.Path) -> None:
+    """Write the ``wordcloud.png`` output file of the DOWORDCLOUD plugin.
+
+    The word cloud is configured as by ``wordcloud_cli`` in the shell
+    plugin.  Its layout is random, so only the word frequencies are the same
+    from one run to the next.
+
+    :param stats: Word cloud text of the Tweets.
+    :param work_dir: Directory into which the output file is written.
+    :param bin_dir: DOWORDCLOUD plugin directory containing the stop words.
+    """
+    with open(bin_dir.joinpath('STOPWORDS.100'), mode='r',
+              encoding='utf-8') as stopwords_in:
+        stopwords = {line.strip() for line in stopwords_in}
+
+    cloud = WordCloud(width=1024,
+                      height=764,
+                      background_color='white',
+                      stopwords=stopwords,
+                      relative_scaling=0,
+                      color_func=random_color_func)
+    frequencies = cloud.process_text(stats.text())
+    # The shell plugin exits successfully even if there were no words
+    if frequencies:
+        cloud.generate_from_frequencies(frequencies)
+        cloud.to_image().save(work_dir.joinpath('wordcloud.png'),
+                              format='png',
+                              optimize=True)
+
+
+class TextTablePlugin(MapReducePlugin):
+    """In-process implementation of the DOTEXTTABLE plugin."""
+    @classmethod
+    def map_shard(cls, tweets: typing.Iterable[typing.Mapping]) -> TextStats:
+        """Count hashtags and words in a shard of the Tweets."""
+        stats = TextStats()
+        stats.update(tweets)
+        return stats
+
+    def write(self,
+              result: TextStats,
+              work_dir: pathlib.Path,
+              env: typing.Optional[typing.Mapping[str, str]] = None) -> None:
+        """Write the hashtag and word frequency table."""
+        bin_dir = self.plugin_dir or current_app.config['PLUGIN_DIR'].joinpath(
+            'DOTEXTTABLE')
+        write_language_table(result, work_dir, bin_dir)
+
+
+class WordCloudPlugin(MapReducePlugin):
+    """In-process implementation of the DOWORDCLOUD plugin."""
+    @classmethod
+    def map_shard(cls, tweets: typing.Iterable[typing.Mapping]) -> TextStats:
+        """Clean the text of a shard of the Tweets for the word cloud."""
+        stats = TextStats(hashtags=False, words=False, cloud=True)
+        stats.update(tweets)
+        return stats
+
+    def write(self,
+              result: TextStats,
+              work_dir: pathlib.Path,
+              env: typing.Optional[typing.Mapping[str, str]] = None) -> None:
+        """Write the word cloud image."""
+        bin_dir = self.plugin_dir or current_app.config['PLUGIN_DIR'].joinpath(
+            'DOWORDCLOUD')
+        write_word_cloud(result, work_dir, bin_dir)
@@ -0,0 +1,317 @@
+"""Module containing parsing of submitted Tweet IDs into compact arrays.
+
+Tweet IDs may be submitted one per line, optionally prefixed by ``ID:`` as
+in WDRA spreadsheets so that spreadsheet software keeps them as text, or as
+a CSV export of such a spreadsheet.  Submissions are parsed a chunk at a
+time into arrays of 64-bit integers, which are far smaller than lists of
+Python ints and can be stored as a single blob rather than being sent to
+the task queue.
+
+While they are hydrated, the Tweet IDs still to be found are held in a
+`TweetIdSet` - a sorted array which costs 8 bytes per ID rather than the
+60 or more of a Python set of ints.
+"""
+
+import array
+import codecs
+import csv
+import functools
+import itertools
+import typing
+import zlib
+
+import numpy
+
+__all__ = [
+    'TweetIdError',
+    'TweetIdSet',
+    'as_tweet_id_array',
+    'decode_tweet_ids',
+    'encode_tweet_ids',
+    'parse_tweet_id',
+    'read_tweet_ids',
+    'unique_tweet_ids',
+]
+
+#: Bytes of a submission to parse at a time
+CHUNK_SIZE = 1024**2
+
+#: Prefix which may precede each Tweet ID, in any case
+ID_PREFIX = 'id:'
+
+#: Lower case names of the column containing Tweet IDs in a CSV file
+CSV_ID_COLUMNS = ('id', 'tweet_id', 'tweet id', 'id_str', 'tweet')
+
+#: Array type code of a Tweet ID - unsigned 64-bit
+TYPECODE = 'Q'
+
+#: Number of Tweet IDs converted to Python ints at a time when iterating a `TweetIdSet`
+ITER_BATCH_SIZE = 65536
+
+_LINE_PREFIXES = [
+    b'\n' + prefix for prefix in (b'id:', b'ID:', b'Id:', b'iD:')
+]
+
+
+class TweetIdError(ValueError):
+    """A submitted Tweet ID is not valid."""
+    def __init__(self, line_number: int, value: str):
+        super().__init__(
+            f'Tweet IDs must be integers - found {value[:40]!r} on line {line_number}.')
+        self.line_number = line_number
+        self.value = value
+
+
+def parse_tweet_id(value: str) -> int:
+    """Parse a single Tweet ID, which may be prefixed with 'ID:'.
+
+    :raises ValueError: If the value is not a valid Tweet ID.
+    """
+    value = value.strip()
+    if value.lower().startswith(ID_PREFIX):
+        value = value[len(ID_PREFIX):].lstrip()
+
+    # int() would also accept e.g. '+10', '1_0' and non-ASCII digits
+    if not value or value.strip('0123456789'):
+        raise ValueError(f'Tweet ID is not a number: {value!r}')
+
+    tweet_id = int(value)
+    if tweet_id >= 2**64:
+        raise ValueError(f'Tweet ID out of range: {tweet_id}')
+
+    return tweet_id
+
+
+def _parse_lines(data: bytes, line_number: int) -> array.array:
+    """Parse Tweet IDs from complete lines, skipping blank lines.
+
+    :param data: Lines of the submission.
+    :param line_number: Line number of the first line, to report errors.
+    """
+    # Fast path - whole lines of digits once prefixes are removed
+    buffer = b'\n' + data + b'\n'
+    has_empty_ids = any(prefix + end in buffer for prefix in _LINE_PREFIXES
+                        for end in (b'\n', b'\r'))
+    for prefix in _LINE_PREFIXES:
+        buffer = buffer.replace(prefix, b'\n')
+
+    # Only digits and line breaks - int() would also accept e.g. b'+10' and b'1_0'
+    if not has_empty_ids and not buffer.translate(None, b'0123456789\r\n'):
+        try:
+            return array.array(TYPECODE, map(int, buffer.split()))
+
+        except (ValueError, OverflowError):
+            pass
+
+    # Line by line, to find the invalid line
+    tweet_ids = array.array(TYPECODE)
+    for offset, line in enumerate(data.split(b'\n')):
+        value = line.decode('utf-8', errors='replace')
+        if value.strip():
+            try:
+                tweet_ids.append(parse_tweet_id(value))
+
+            except ValueError as exc:
+                raise TweetIdError(line_number + offset, value.strip()) from exc
+
+    return tweet_ids
+
+
+def _read_lines(chunks: typing.Iterable[bytes]) -> typing.Iterator[array.array]:
+    """Parse Tweet IDs one per line from chunks of a submission."""
+    line_number = 1
+    rest = b''
+    for chunk in chunks:
+        data = rest + chunk
+        end = data.rfind(b'\n') + 1
+        data, rest = data[:end], data[end:]
+
+        yield _parse_lines(data, line_number)
+        line_number += data.count(b'\n')
+
+    yield _parse_lines(rest, line_number)
+
+
+def _iter_lines(chunks: typing.Iterable[bytes]) -> typing.Iterator[str]:
+    """Split chunks of a submission into lines of text."""
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8', errors='replace') + '\n'
+
+    if rest:
+        yield rest.decode('utf-8', errors='replace')
+
+
+def _read_csv(chunks: typing.Iterable[bytes]) -> typing.Iterator[array.array]:
+    """Parse Tweet IDs from a column of a CSV file.
+
+    The column is found by name from the header row - if there is no
+    recognised header, the first column is used.
+    """
+    reader = csv.reader(_iter_lines(chunks))
+    header = next(reader, [])
+    names = [name.strip().lower() for name in header]
+    column = next((names.index(name) for name in CSV_ID_COLUMNS if name in names),
+                  None)
+    rows = reader
+
+    if column is None:
+        column = 0
+        try:
+            # No header row
+            parse_tweet_id(header[0])
+            rows = itertools.chain([header], reader)
+
+        except (ValueError, IndexError):
+            pass
+
+    tweet_ids = array.array(TYPECODE)
+    for row in rows:
+        value = row[column] if column < len(row) else ''
+        if value.strip():
+            try:
+                tweet_ids.append(parse_tweet_id(value))
+
+            except ValueError as exc:
+                raise TweetIdError(reader.line_num, value.strip()) from exc
+
+    yield tweet_ids
+
+
+def as_tweet_id_array(tweet_ids: typing.Iterable[int]) -> numpy.ndarray:
+    """Convert Tweet IDs to an array of 64-bit integers, without copying if possible."""
+    if isinstance(tweet_ids, TweetIdSet):
+        return tweet_ids.array
+
+    if isinstance(tweet_ids, numpy.ndarray):
+        return tweet_ids.astype(numpy.uint64, copy=False)
+
+    if not isinstance(tweet_ids, array.array) or tweet_ids.typecode != TYPECODE:
+        tweet_ids = array.array(TYPECODE, tweet_ids)
+
+    return numpy.frombuffer(tweet_ids, dtype=numpy.uint64)
+
+
+def unique_tweet_ids(tweet_ids: typing.Iterable[int]) -> numpy.ndarray:
+    """Remove duplicate Tweet IDs, keeping the first occurrence of each."""
+    tweet_ids = as_tweet_id_array(tweet_ids)
+    _, first_index = numpy.unique(tweet_ids, return_index=True)
+    return tweet_ids[numpy.sort(first_index)]
+
+
+def read_tweet_ids(stream: typing.BinaryIO) -> numpy.ndarray:
+    """Read distinct Tweet IDs from a submitted file.
+
+    The file may contain one Tweet ID per line, each optionally prefixed by
+    'ID:', or be a CSV file with a column of Tweet IDs.
+
+    :param stream: Binary file object of the submission.
+    :return: Array of distinct Tweet IDs in the order in which they were submitted.
+    :raises TweetIdError: If the submission contains an invalid Tweet ID.
+    """
+    chunks = iter(functools.partial(stream.read, CHUNK_SIZE), b'')
+    first = next(chunks, b'')
+    if first.startswith(codecs.BOM_UTF8):
+        first = first[len(codecs.BOM_UTF8):]
+
+    chunks = itertools.chain([first], chunks)
+    # A CSV file, or a single column with a header row
+    first_line = first.lstrip().split(b'\n', 1)[0]
+    is_csv = (b',' in first_line or first_line.strip().lower().decode(
+        'utf-8', errors='replace') in CSV_ID_COLUMNS)
+    parse = _read_csv if is_csv else _read_lines
+
+    parts = [
+        numpy.frombuffer(part, dtype=numpy.uint64) for part in parse(chunks)
+        if part
+    ]
+    if not parts:
+        return numpy.empty(0, dtype=numpy.uint64)
+
+    return unique_tweet_ids(numpy.concatenate(parts))
+
+
+def encode_tweet_ids(tweet_ids: numpy.ndarray) -> bytes:
+    """Encode an array of Tweet IDs as a compressed blob."""
+    return zlib.compress(
+        numpy.asarray(tweet_ids, dtype='<u8').tobytes(), 1)
+
+
+def decode_tweet_ids(blob: bytes) -> numpy.ndarray:
+    """Decode an array of Tweet IDs from a blob written by `encode_tweet_ids`."""
+    return numpy.frombuffer(zlib.decompress(blob), dtype='<u8')
+
+
+class TweetIdSet:
+    """Compact set of Tweet IDs backed by a sorted array of 64-bit integers.
+
+    Supports the set operations used during hydration - difference,
+    intersection, union and membership - with vectorised array operations.
+    Iteration yields the Tweet IDs as Python ints in ascending order.
+
+    :param tweet_ids: Tweet IDs - an iterable of ints, a numpy array or
+        another `TweetIdSet`.  Duplicates are removed.
+    """
+    def __init__(self, tweet_ids: typing.Iterable[int] = ()):
+        if isinstance(tweet_ids, TweetIdSet):
+            self.array = tweet_ids.array
+
+        else:
+            self.array = numpy.unique(as_tweet_id_array(tweet_ids))
+
+    @classmethod
+    def _from_sorted(cls, sorted_array: numpy.ndarray) -> 'TweetIdSet':
+        """Make a set from an array which is already sorted and unique."""
+        id_set = cls.__new__(cls)
+        id_set.array = sorted_array
+        return id_set
+
+    def _other(self, other: typing.Iterable[int]) -> numpy.ndarray:
+        return other.array if isinstance(other, TweetIdSet) else TweetIdSet(other).array
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __iter__(self) -> typing.Iterator[int]:
+        for start in range(0, len(self.array), ITER_BATCH_SIZE):
+            yield from self.array[start:start + ITER_BATCH_SIZE].tolist()
+
+    def __contains__(self, tweet_id: int) -> bool:
+        try:
+            value = numpy.uint64(tweet_id)
+
+        except (OverflowError, TypeError, ValueError):
+            return False
+
+        index = numpy.searchsorted(self.array, value)
+        return bool(index < len(self.array) and self.array[index] == value)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (TweetIdSet, set, frozenset)):
+            return numpy.array_equal(self.array, self._other(other))
+
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({len(self)} Tweet IDs)'
+
+    def difference(self, other: typing.Iterable[int]) -> 'TweetIdSet':
+        """Get the Tweet IDs in this set which are not in another."""
+        return self._from_sorted(
+            numpy.setdiff1d(self.array, self._other(other), assume_unique=True))
+
+    def intersection(self, other: typing.Iterable[int]) -> 'TweetIdSet':
+        """Get the Tweet IDs which are in both this set and another."""
+        return self._from_sorted(
+            numpy.intersect1d(self.array, self._other(other), assume_unique=True))
+
+    def union(self, other: typing.Iterable[int]) -> 'TweetIdSet':
+        """Get the Tweet IDs which are in either this set or another."""
+        return self._from_sorted(numpy.union1d(self.array, self._other(other)))
+
+    __sub__ = difference
+    __and__ = intersection
+    __or__ = union
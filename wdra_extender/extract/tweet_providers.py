@@ -1,16 +1,35 @@
+import array
+import collections
 import datetime
 import importlib
-import json
 import logging
+import sqlite3
+import time
 import typing
 
+import flask
 from flask import current_app
 import redis
-from twarc import Twarc
+
+from ..extensions import redis_pool
+from .cache_codec import CacheDecodeError, get_codec
+from .hydration import get_hydrator
+from .hydration_claims import HydrationClaims
+from .local_store import get_store
+from .metrics import PROVIDER_FOUND, PROVIDER_REQUESTED, provider_label, timed_provider
+from .tweet_ids import TYPECODE, TweetIdSet
+from .user_cache import get_user_snapshots, join_users, pipe_users, split_users, user_refs
+from .utils import batched, bounded_map
 
 __all__ = [
     'get_tweets',
+    'iter_claimed',
+    'iter_tweets',
     'redis_provider',
+    'save_to_redis',
+    'save_to_sqlite',
+    'share_claimed',
+    'sqlite_provider',
     'twarc_provider',
 ]
 
@@ -44,114 +63,461 @@ def import_object(name: str) -> object:
     return getattr(module, object_name)
 
 
-def get_tweets(
-        tweet_ids: typing.Iterable[int],
-        tweet_providers: typing.Iterable[str]) -> typing.List[typing.Mapping]:
-    """Get a list of Tweets from their IDs.
+def iter_tweets(
+    tweet_ids: typing.Iterable[int],
+    tweet_providers: typing.Iterable[str],
+    stats: typing.Optional[typing.Counter[str]] = None,
+    record_missing: bool = True,
+    claims: typing.Optional[HydrationClaims] = None
+) -> typing.Iterator[typing.Mapping]:
+    """Get Tweets from their IDs, yielding each Tweet as soon as it is found.
 
     Attempt to get tweets from each of the tweet providers in turn.
     Tweet providers should be passed as the importable name of the callable.
     e.g. 'wdra_extender.extract.tweet_providers.redis_provider'
 
+    Each tweet provider is a callable which accepts a collection of Tweet IDs
+    - a `TweetIdSet`, which iterates in ascending order - and yields the
+    Tweets which it is able to find.
+
+    Tweets which no provider could find, e.g. because they have been deleted
+    or protected, are recorded in a negative cache and are skipped by later
+    requests until the record expires.  The negative cache is only used
+    within the Flask context.
+
+    If `claims` are given, Tweets are only requested from the providers in
+    `SINGLE_FLIGHT_PROVIDERS` once claimed - those claimed by another build
+    are instead read from the Redis cache once that build has saved them.
+    See :mod:`.hydration_claims`.
+
     :param tweet_ids: Tweet IDs to lookup.
     :param tweet_providers: Iterable of names of tweet provider functions to import.
+    :param stats: Counter to which the number of Tweets found by each
+        provider, the number 'skipped' due to the negative cache, the
+        number 'not_found' and the number 'shared' with other builds will be added.
+    :param record_missing: Record Tweets which were not found in the negative
+        cache - disable this if the providers are not expected to find every Tweet.
+    :param claims: Claims of the current build, used to avoid looking up
+        Tweets which another build is already looking up.
     """
-    tweet_ids = set(tweet_ids)
-    found_tweets = []
+    tweet_ids = TweetIdSet(tweet_ids)
+    if stats is None:
+        stats = collections.Counter()
+
+    use_missing_cache = (flask.has_app_context()
+                         and current_app.config['REDIS_MISSING_CACHE_TIME'] > 0)
 
-    for provider in map(import_object, tweet_providers):
+    if use_missing_cache and tweet_ids:
         try:
-            provider_found_ids, provider_found_tweets = provider(tweet_ids)
+            missing_ids = get_missing(tweet_ids)
 
         except ConnectionError as exc:
-            logger.error('Failed to execute Tweet provider: %s', exc)
+            logger.error('Failed to read missing Tweet cache: %s', exc)
 
         else:
-            found_tweets.extend(provider_found_tweets)
-            tweet_ids -= provider_found_ids
-            logger.info(
-                f'Found {len(provider_found_ids)} tweets using provider \'{provider.__name__}\''
-            )
+            tweet_ids -= missing_ids
+            stats['skipped'] += len(missing_ids)
+            if missing_ids:
+                logger.info(
+                    f'Skipping {len(missing_ids)} tweets known to be unavailable')
+
+    # We can only be sure a Tweet is unavailable if every provider was asked
+    all_providers_succeeded = True
+
+    tweet_providers = list(tweet_providers)
+    for index, provider_name in enumerate(tweet_providers, 1):
+        provider = import_object(provider_name)
+        if not tweet_ids:
+            logger.info('Found all tweets - skipping remaining providers')
+            break
+
+        provider_found_ids = array.array(TYPECODE)
+        n_requested = len(tweet_ids)
+        single_flight = (claims is not None and provider_name
+                         in current_app.config['SINGLE_FLIGHT_PROVIDERS'])
+
+        try:
+            if single_flight:
+                # Tweets not found by the last provider are known to be unavailable
+                tweets = iter_claimed(provider,
+                                      tweet_ids,
+                                      claims,
+                                      stats,
+                                      record_missing=(use_missing_cache and record_missing
+                                                      and all_providers_succeeded
+                                                      and index == len(tweet_providers)))
+            else:
+                tweets = provider(tweet_ids)
+
+            for tweet in timed_provider(provider_name, tweets):
+                provider_found_ids.append(tweet['id'])
+                yield tweet
+
+        except ConnectionError as exc:
+            logger.error('Failed to execute Tweet provider: %s', exc)
+            all_providers_succeeded = False
+
+        # Providers may yield a Tweet more than once, e.g. a retried batch
+        provider_found_ids = TweetIdSet(provider_found_ids)
+        tweet_ids -= provider_found_ids
+        if single_flight and use_missing_cache and tweet_ids:
+            # Recorded as missing by another build while we waited for it
+            try:
+                missing_ids = get_missing(tweet_ids - claims.cached)
+
+            except ConnectionError as exc:
+                logger.error('Failed to read missing Tweet cache: %s', exc)
+
+            else:
+                tweet_ids -= missing_ids
+                stats['skipped'] += len(missing_ids)
+                stats['shared'] += len(missing_ids)
+        stats[provider.__name__] += len(provider_found_ids)
+        PROVIDER_REQUESTED.labels(provider_label(provider_name)).inc(n_requested)
+        PROVIDER_FOUND.labels(provider_label(provider_name)).inc(len(provider_found_ids))
+        logger.info(
+            f'Found {len(provider_found_ids)} tweets using provider \'{provider.__name__}\''
+        )
 
         if tweet_ids:
             logger.info(f'There are {len(tweet_ids)} tweets left to find')
 
+    if tweet_ids and all_providers_succeeded:
+        stats['not_found'] += len(tweet_ids)
+
+        if use_missing_cache and record_missing:
+            try:
+                save_missing(tweet_ids)
+
+            except ConnectionError as exc:
+                logger.error('Failed to cache missing Tweets: %s', exc)
+
+
+def share_claimed(tweets: typing.List[typing.Mapping], tweet_ids: TweetIdSet,
+                  claims: HydrationClaims, record_missing: bool = False) -> None:
+    """Cache Tweets looked up under claims, then release the claims on them.
+
+    :param tweets: Tweets found by the provider.
+    :param tweet_ids: Tweet IDs requested from the provider.
+    :param record_missing: Record Tweets which were not found in the negative cache.
+    """
+    found_ids = TweetIdSet(tweet['id'] for tweet in tweets)
+    if tweets:
+        cached = True
+        for writer in claims.cache_writers:
+            try:
+                writer(tweets)
+
+            except ConnectionError as exc:
+                logger.error('Failed to cache found Tweets using %s: %s',
+                             writer.__name__, exc)
+                cached = False
+
+        if cached:
+            claims.cached |= found_ids
+
+    missing_ids = tweet_ids - found_ids
+    if record_missing and missing_ids:
+        try:
+            save_missing(missing_ids)
+
+        except ConnectionError as exc:
+            logger.error('Failed to cache missing Tweets: %s', exc)
+
         else:
-            logger.info('Found all tweets - skipping remaining providers')
-            break
+            claims.cached |= missing_ids
+
+    try:
+        claims.release(tweet_ids)
+
+    except ConnectionError as exc:
+        logger.error('Failed to release Tweet claims: %s', exc)
+
+
+def iter_claimed(
+    provider: typing.Callable[[TweetIdSet], typing.Iterable[typing.Mapping]],
+    tweet_ids: TweetIdSet,
+    claims: HydrationClaims,
+    stats: typing.Counter[str],
+    record_missing: bool = False,
+) -> typing.Iterator[typing.Mapping]:
+    """Get Tweets from a provider, sharing lookups with other builds.
+
+    Tweets are only requested from the provider once claimed.  Once found,
+    they are saved using the cache writers of `claims` and their claims
+    released, before waiting for any Tweets claimed by another build.
+    Those are read from the Redis cache as the other build saves them,
+    until they are found, recorded as missing or their claims are released
+    or expire.  Any which are still not found are then claimed and
+    requested from the provider, as are any still claimed by another build
+    after `claims.max_wait` seconds.
+
+    Tweets found in the cache after waiting are added to `stats` as 'shared'.
+
+    :param record_missing: Record claimed Tweets which the provider did not
+        find in the negative cache before releasing their claims - only if
+        no later provider could find them.
+    :raises ConnectionError: If the provider fails or Redis could not be reached.
+    """
+    def look_up(lookup_ids: TweetIdSet) -> typing.Iterator[typing.Mapping]:
+        found = []
+        for tweet in provider(lookup_ids):
+            found.append(tweet)
+            yield tweet
+
+        # Other builds waiting for these Tweets can now read them from the cache
+        share_claimed(found, lookup_ids, claims, record_missing=record_missing)
 
-    return found_tweets
+    deadline = time.monotonic() + claims.max_wait
+    use_missing_cache = current_app.config['REDIS_MISSING_CACHE_TIME'] > 0
+    waiting_ids = TweetIdSet()
+
+    while tweet_ids:
+        try:
+            claimed_ids, held_ids = claims.claim(tweet_ids)
+
+        except ConnectionError as exc:
+            logger.error('Failed to claim Tweets for hydration: %s', exc)
+            claimed_ids, held_ids = tweet_ids, TweetIdSet()
+
+        if claimed_ids:
+            yield from look_up(claimed_ids)
+
+        if held_ids and not waiting_ids:
+            logger.info(
+                f'Waiting for {len(held_ids)} tweets being hydrated by other builds')
+        waiting_ids |= held_ids
+        tweet_ids = TweetIdSet()
+
+        while waiting_ids and not tweet_ids:
+            if time.monotonic() >= deadline:
+                logger.warning(
+                    f'Stopped waiting for {len(waiting_ids)} tweets being hydrated by other builds')
+                yield from look_up(waiting_ids)
+                return
+
+            # Read claims first so a Tweet cached just before its claim is
+            # released is found by this poll rather than looked up again
+            claimed_ids = claims.held_by_others(waiting_ids)
+
+            found_ids = array.array(TYPECODE)
+            for tweet in redis_provider(waiting_ids):
+                found_ids.append(tweet['id'])
+                yield tweet
+
+            found_ids = TweetIdSet(found_ids)
+            stats['shared'] += len(found_ids)
+            waiting_ids -= found_ids
+            if use_missing_cache and waiting_ids:
+                waiting_ids -= get_missing(waiting_ids)
+
+            # Claims released or expired without the Tweets being cached
+            tweet_ids = waiting_ids - claimed_ids
+            waiting_ids -= tweet_ids
+
+            if waiting_ids and not tweet_ids:
+                time.sleep(min(claims.poll_interval,
+                               max(0, deadline - time.monotonic())))
+
+
+def get_tweets(
+        tweet_ids: typing.Iterable[int],
+        tweet_providers: typing.Iterable[str]) -> typing.List[typing.Mapping]:
+    """Get a list of Tweets from their IDs.
+
+    See :func:`iter_tweets` - prefer it when handling a large number of Tweets.
+
+    :param tweet_ids: Tweet IDs to lookup.
+    :param tweet_providers: Iterable of names of tweet provider functions to import.
+    """
+    return list(iter_tweets(tweet_ids, tweet_providers))
+
+
+def get_missing(tweet_ids: typing.Iterable[int]) -> TweetIdSet:
+    """Get the Tweet IDs which are recorded in the negative cache."""
+    config = current_app.config
+
+    def read_batch(batch: typing.List[int]) -> typing.List[int]:
+        with redis_pool.timed('mget'):
+            values = redis_pool.client.mget(
+                [f'tweet_missing:{i}' for i in batch])
+
+        return [i for i, value in zip(batch, values) if value is not None]
+
+    missing_ids = array.array(TYPECODE)
+    try:
+        for batch_missing in bounded_map(
+                read_batch, batched(tweet_ids, config['REDIS_BATCH_SIZE']),
+                config['REDIS_MAX_CONCURRENCY']):
+            missing_ids.extend(batch_missing)
+
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.TimeoutError) as exc:
+        raise ConnectionError from exc
+
+    return TweetIdSet(missing_ids)
+
+
+def save_missing(tweet_ids: typing.Iterable[int]) -> None:
+    """Record Tweet IDs which could not be found in the negative cache."""
+    config = current_app.config
+    cache_time = config['REDIS_MISSING_CACHE_TIME']
+
+    def write_batch(batch: typing.List[int]) -> None:
+        pipe = redis_pool.client.pipeline(transaction=False)
+        for tweet_id in batch:
+            pipe.setex(f'tweet_missing:{tweet_id}', cache_time, 1)
+
+        with redis_pool.timed('pipeline'):
+            pipe.execute()
+
+    try:
+        for _ in bounded_map(write_batch,
+                             batched(tweet_ids, config['REDIS_BATCH_SIZE']),
+                             config['REDIS_MAX_CONCURRENCY']):
+            pass
+
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.TimeoutError) as exc:
+        raise ConnectionError from exc
 
 
 def save_to_redis(
-    tweets: typing.List[typing.Mapping],
+    tweets: typing.Iterable[typing.Mapping],
     cache_time: datetime.timedelta = datetime.timedelta(days=10)
 ) -> None:
-    """Save tweet JSON to Redis cache."""
+    """Save tweet JSON to Redis cache.
+
+    Tweets are written in pipelined batches of `REDIS_BATCH_SIZE`, with up to
+    `REDIS_MAX_CONCURRENCY` batches in flight at once.
+
+    Each snapshot of a user is stored once in the user cache, with expiry
+    `REDIS_USER_CACHE_TIME`, and replaced by a reference in the cached Tweet.
+
+    :param tweets: Iterable of Tweets - may be a generator.
+    """
     config = current_app.config
-    r = redis.Redis(  # pylint: disable=invalid-name
-        host=config['REDIS_HOST'],
-        port=config['REDIS_PORT'],
-        db=config['REDIS_DB'])
-
-    # Pipeline executes all commands in a single request
-    pipe = r.pipeline()
-    for tweet in tweets:
-        redis_key = f'tweet_hydrated:{tweet["id"]}'
-        redis_value = json.dumps(tweet)
-        # There is no MSETEX command to do this in one request without a pipeline
-        pipe.setex(redis_key, cache_time, redis_value)
+    codec = get_codec(config)
+    user_cache_time = config['REDIS_USER_CACHE_TIME']
+
+    def write_batch(batch: typing.List[typing.Mapping]) -> None:
+        # Pipeline executes all commands in a batch in a single request
+        pipe = redis_pool.client.pipeline(transaction=False)
+        users = {}
+        for tweet in batch:
+            tweet, tweet_users = split_users(tweet)
+            users.update(tweet_users)
+
+            redis_key = f'tweet_hydrated:{tweet["id"]}'
+            redis_value = codec.encode(tweet)
+            # There is no MSETEX command to do this in one request without a pipeline
+            pipe.setex(redis_key, cache_time, redis_value)
+
+        pipe_users(pipe, users, codec, user_cache_time)
+
+        with redis_pool.timed('pipeline'):
+            pipe.execute()
 
     try:
-        pipe.execute()
+        for _ in bounded_map(write_batch,
+                             batched(tweets, config['REDIS_BATCH_SIZE']),
+                             config['REDIS_MAX_CONCURRENCY']):
+            pass
 
-    except redis.exceptions.ConnectionError as exc:
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.TimeoutError) as exc:
         raise ConnectionError from exc
 
 
 def redis_provider(
-    tweet_ids: typing.Iterable[int]
-) -> typing.Tuple[typing.List[int], typing.List[typing.Mapping]]:
+        tweet_ids: typing.Iterable[int]) -> typing.Iterator[typing.Mapping]:
+    """Get Tweets from their IDs sourced from the Redis cache.
+
+    Tweets are requested using `MGET` in batches of `REDIS_BATCH_SIZE`, with
+    up to `REDIS_MAX_CONCURRENCY` batches in flight at once.  Found Tweets
+    are yielded as each batch completes.
+
+    Cached values are decoded by :mod:`.cache_codec` - any which cannot be
+    decoded, or which reference a user no longer in the user cache, are
+    treated as cache misses.
+    """
     config = current_app.config
-    r = redis.Redis(  # pylint: disable=invalid-name
-        host=config['REDIS_HOST'],
-        port=config['REDIS_PORT'],
-        db=config['REDIS_DB'])
+    codec = get_codec(config)
 
-    found_tweet_ids = set()
-    found_tweets = []
+    def read_batch(batch: typing.List[int]) -> typing.List[typing.Mapping]:
+        with redis_pool.timed('mget'):
+            tweet_strings = redis_pool.client.mget(
+                [f'tweet_hydrated:{i}' for i in batch])
+
+        tweets = []
+        for tweet_string in tweet_strings:
+            if tweet_string is None:
+                continue
+
+            try:
+                tweets.append(codec.decode(tweet_string))
+
+            except CacheDecodeError as exc:
+                logger.warning('Failed to decode cached Tweet: %s', exc)
+
+        refs = set().union(*map(user_refs, tweets))
+        users = get_user_snapshots(refs, codec=codec)
+
+        return [
+            tweet for tweet in (join_users(t, users) for t in tweets)
+            if tweet is not None
+        ]
 
-    # Attempt to get all Tweets from cache
     try:
-        tweets = r.mget(map(lambda i: f'tweet_hydrated:{i}', tweet_ids))
+        for tweets in bounded_map(
+                read_batch, batched(tweet_ids, config['REDIS_BATCH_SIZE']),
+                config['REDIS_MAX_CONCURRENCY']):
+            yield from tweets
 
-    except redis.exceptions.ConnectionError as exc:
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.TimeoutError) as exc:
         raise ConnectionError from exc
 
-    for tweet_id, tweet_string in zip(tweet_ids, tweets):
-        if tweet_string is not None:
-            found_tweet_ids.add(tweet_id)
-            found_tweets.append(json.loads(tweet_string))
 
-    return found_tweet_ids, found_tweets
+def save_to_sqlite(tweets: typing.Iterable[typing.Mapping]) -> None:
+    """Save tweet JSON to the local on-disk Tweet store.
+
+    :param tweets: Iterable of Tweets - may be a generator.
+    """
+    config = current_app.config
+    codec = get_codec(config)
+
+    try:
+        get_store(config).put_many(
+            (tweet['id'], codec.encode(tweet)) for tweet in tweets)
+
+    except sqlite3.OperationalError as exc:
+        raise ConnectionError from exc
+
+
+def sqlite_provider(
+        tweet_ids: typing.Iterable[int]) -> typing.Iterator[typing.Mapping]:
+    """Get Tweets from their IDs sourced from the local on-disk Tweet store."""
+    config = current_app.config
+    codec = get_codec(config)
+
+    try:
+        for _, value in get_store(config).get_many(tweet_ids):
+            try:
+                yield codec.decode(value)
+
+            except CacheDecodeError as exc:
+                logger.warning('Failed to decode stored Tweet: %s', exc)
+
+    except sqlite3.OperationalError as exc:
+        raise ConnectionError from exc
 
 
 def twarc_provider(
-    tweet_ids: typing.Iterable[int]
-) -> typing.Tuple[typing.Set[int], typing.List[typing.Mapping]]:
-    """Get a list of Tweets from their IDs sourced from the Twitter API.
+        tweet_ids: typing.Iterable[int]) -> typing.Iterator[typing.Mapping]:
+    """Get Tweets from their IDs sourced from the Twitter API.
 
-    Uses Twarc Twitter API connector - https://github.com/DocNow/twarc.
+    Lookups are spread across every configured set of API credentials,
+    respecting the rate limit of each - see :mod:`.hydration`.
     """
-    # Twitter API consumer - handles rate limits for us
-    t = Twarc(  # pylint: disable=invalid-name
-        consumer_key=current_app.config['TWITTER_CONSUMER_KEY'],
-        consumer_secret=current_app.config['TWITTER_CONSUMER_SECRET'],
-        access_token=current_app.config['TWITTER_ACCESS_TOKEN'],
-        access_token_secret=current_app.config['TWITTER_ACCESS_TOKEN_SECRET'],
-    )
-
-    found_tweets = list(t.hydrate(tweet_ids))
-    found_tweet_ids = {tweet['id'] for tweet in found_tweets}
-
-    return found_tweet_ids, found_tweets
+    yield from get_hydrator(current_app.config).hydrate(tweet_ids)
@@ -0,0 +1,293 @@
+"""Module containing on-disk storage for hydrated Tweets.
+
+Tweets are streamed to disk as compact newline-delimited JSON (NDJSON) so
+that the full set of Tweets in a Bundle never has to be held in memory.
+"""
+
+import collections.abc
+import json
+import os
+import pathlib
+import shutil
+import threading
+import typing
+
+__all__ = [
+    'StagingArea',
+    'TweetView',
+    'count_ndjson',
+    'iter_ndjson',
+    'iter_ndjson_range',
+    'iter_tweets_file',
+    'ndjson_shards',
+    'ndjson_to_json_array',
+    'replace_durably',
+    'write_ndjson',
+]
+
+
+def write_ndjson(tweets: typing.Iterable[typing.Mapping],
+                 path: pathlib.Path,
+                 sync: bool = False) -> int:
+    """Write Tweets to a file as newline-delimited JSON.
+
+    :param tweets: Iterable of Tweets - may be a generator.
+    :param path: Path of file to write.
+    :param sync: Flush the file to disk before returning.
+    :return: Number of Tweets written.
+    """
+    count = 0
+    with open(path, mode='w', encoding='utf-8') as ndjson_out:
+        for tweet in tweets:
+            ndjson_out.write(
+                json.dumps(tweet, ensure_ascii=False, separators=(',', ':')))
+            ndjson_out.write('\n')
+            count += 1
+
+        if sync:
+            ndjson_out.flush()
+            os.fsync(ndjson_out.fileno())
+
+    return count
+
+
+def replace_durably(src: pathlib.Path, dst: pathlib.Path) -> None:
+    """Rename a file which has been flushed to disk, then flush the rename.
+
+    Without flushing the directory, a file renamed just before a crash may
+    be missing, or be present but empty or truncated.
+    """
+    os.replace(src, dst)
+
+    dir_fd = os.open(pathlib.Path(dst).parent, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+
+    finally:
+        os.close(dir_fd)
+
+
+def iter_ndjson(path: pathlib.Path) -> typing.Iterator[typing.Mapping]:
+    """Read Tweets one at a time from a newline-delimited JSON file."""
+    with open(path, mode='r', encoding='utf-8') as ndjson_in:
+        for line in ndjson_in:
+            if line.strip():
+                yield json.loads(line)
+
+
+def ndjson_shards(path: pathlib.Path,
+                  n_shards: int) -> typing.List[typing.Tuple[int, int]]:
+    """Split a newline-delimited JSON file into byte ranges of whole lines.
+
+    :param n_shards: Number of ranges of roughly equal size - fewer are
+        returned if the file has fewer lines.
+    :return: List of start and end offsets - see `iter_ndjson_range`.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, mode='rb') as ndjson_in:
+        for shard in range(1, n_shards):
+            ndjson_in.seek(max(size * shard // n_shards, bounds[-1]))
+            # A line belongs to the range in which it starts
+            ndjson_in.readline()
+            bounds.append(ndjson_in.tell())
+
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def iter_ndjson_range(path: pathlib.Path, start: int,
+                      end: int) -> typing.Iterator[typing.Mapping]:
+    """Read the Tweets from lines which start within a byte range of a newline-delimited JSON file."""
+    with open(path, mode='rb') as ndjson_in:
+        ndjson_in.seek(start)
+        position = start
+        while position < end:
+            line = ndjson_in.readline()
+            if not line:
+                break
+
+            position += len(line)
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_tweets_file(path: pathlib.Path) -> typing.Iterator[typing.Mapping]:
+    """Read Tweets from a Tweets file as passed to plugins.
+
+    Files with a ``.jsonl`` suffix are read as newline-delimited JSON, any
+    other file as a single JSON array.
+    """
+    if path.suffix == '.jsonl':
+        yield from iter_ndjson(path)
+        return
+
+    with open(path, mode='r', encoding='utf-8') as json_in:
+        yield from json.load(json_in)
+
+
+class TweetView(collections.abc.Sequence):
+    """Sequence of the Tweets in a Tweets file, parsed when first used.
+
+    A single view is shared by the in-process plugins of a build.  Iterating
+    over it streams the Tweets from the file, so plugins which only iterate
+    never hold every Tweet in memory.  The Tweets are only loaded into a list
+    when a plugin indexes into the view, after which every plugin shares it.
+
+    :param path: Tweets file - see `iter_tweets_file`.
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._tweets = None
+        self._length = None
+        self._lock = threading.Lock()
+
+    @property
+    def tweets(self) -> typing.List[typing.Mapping]:
+        """Get the parsed Tweets, parsing the file if this is the first use."""
+        if self._tweets is None:
+            # Plugins run concurrently - only the first to arrive parses
+            with self._lock:
+                if self._tweets is None:
+                    self._tweets = list(iter_tweets_file(self.path))
+
+        return self._tweets
+
+    def __getitem__(self, index):
+        return self.tweets[index]
+
+    def __len__(self) -> int:
+        if self._tweets is not None:
+            return len(self._tweets)
+
+        if self._length is None:
+            if self.path.suffix == '.jsonl':
+                self._length = count_ndjson(self.path)
+
+            else:
+                self._length = sum(1 for _ in iter_tweets_file(self.path))
+
+        return self._length
+
+    def __iter__(self) -> typing.Iterator[typing.Mapping]:
+        if self._tweets is not None:
+            return iter(self._tweets)
+
+        return iter_tweets_file(self.path)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.path})'
+
+
+def count_ndjson(path: pathlib.Path) -> int:
+    """Count the Tweets in a newline-delimited JSON file without parsing them."""
+    with open(path, mode='rb') as ndjson_in:
+        return sum(1 for line in ndjson_in if line.strip())
+
+
+def ndjson_to_json_array(src_path: pathlib.Path,
+                         dst_path: pathlib.Path) -> None:
+    """Convert a newline-delimited JSON file into a single JSON array.
+
+    This is the format expected by the executable plugins.  The conversion
+    copies lines without parsing them so memory use does not depend on the
+    number of Tweets.
+    """
+    with open(src_path, mode='r', encoding='utf-8') as ndjson_in, \
+            open(dst_path, mode='w', encoding='utf-8') as json_out:
+        json_out.write('[')
+        first = True
+        for line in ndjson_in:
+            line = line.strip()
+            if not line:
+                continue
+
+            if not first:
+                json_out.write(',\n')
+
+            json_out.write(line)
+            first = False
+
+        json_out.write(']\n')
+
+
+class StagingArea:
+    """Durable per-Extract directory holding checkpointed hydration chunks.
+
+    Tweet IDs are hydrated in fixed-size chunks, each of which is written to
+    its own NDJSON file once complete.  If a build is interrupted, a retry
+    can skip any chunks which already have a file here.  Once every chunk is
+    complete they are merged into a single file at `merged_path`.
+
+    :param path: Directory to use as the staging area - created if required.
+    """
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.meta_path = path.joinpath('meta.json')
+        self.merged_path = path.joinpath('tweets.jsonl')
+
+    def chunk_path(self, index: int) -> pathlib.Path:
+        """Get the path of the checkpoint file for a chunk."""
+        return self.path.joinpath(f'chunk-{index:06d}.jsonl')
+
+    def prepare(self, n_ids: int, chunk_size: int) -> None:
+        """Prepare the staging area for a set of Tweet IDs.
+
+        If the staging area was created for a different number of Tweet IDs
+        or a different chunk size, its checkpoints are invalid and are removed.
+        """
+        meta = {'n_ids': n_ids, 'chunk_size': chunk_size}
+
+        if self.meta_path.is_file():
+            with open(self.meta_path, encoding='utf-8') as meta_in:
+                if json.load(meta_in) == meta:
+                    return
+
+            self.clear()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.meta_path, mode='w', encoding='utf-8') as meta_out:
+            json.dump(meta, meta_out)
+
+    def is_complete(self, index: int) -> bool:
+        """Has the chunk with this index already been checkpointed?"""
+        return self.chunk_path(index).is_file()
+
+    def write_chunk(self, index: int,
+                    tweets: typing.Iterable[typing.Mapping]) -> int:
+        """Checkpoint a chunk of Tweets.
+
+        The file is written under a temporary name, flushed to disk and then
+        renamed, so a chunk file is only visible once it is complete - even
+        after a crash.
+
+        :return: Number of Tweets written.
+        """
+        path = self.chunk_path(index)
+        part_path = path.with_suffix('.part')
+
+        count = write_ndjson(tweets, part_path, sync=True)
+        replace_durably(part_path, path)
+
+        return count
+
+    def merge(self, dst_path: pathlib.Path, n_chunks: int) -> None:
+        """Concatenate all chunk files, in order, into a single NDJSON file.
+
+        The file is written under a temporary name, flushed to disk and then
+        renamed, so it is only visible once complete.
+        """
+        part_path = dst_path.with_suffix('.part')
+        with open(part_path, mode='wb') as ndjson_out:
+            for index in range(n_chunks):
+                with open(self.chunk_path(index), mode='rb') as chunk_in:
+                    shutil.copyfileobj(chunk_in, ndjson_out)
+
+            ndjson_out.flush()
+            os.fsync(ndjson_out.fileno())
+
+        replace_durably(part_path, dst_path)
+
+    def clear(self) -> None:
+        """Remove the staging area and all checkpoints within it."""
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,291 @@
+"""Module containing the deduplicated cache of Twitter user objects.
+
+Every Tweet embeds a full user object for its author, and retweets and
+quotes embed another for the original author.  Rather than caching these
+copies with every Tweet, the Tweet cache stores a reference to the user,
+and each user is cached once under its own key with its own expiry.
+
+A user's profile changes over time - their follower count, for example - so
+each snapshot of a user is cached under a hash of its contents and a
+Tweet's reference names the snapshot it was hydrated with.  A Tweet read
+back from the cache is therefore the same as when it was hydrated.  The
+latest snapshot of each user is also recorded, for users looked up by ID.
+"""
+
+import hashlib
+import json
+import pathlib
+import typing
+
+from flask import current_app
+import redis
+
+from ..extensions import redis_pool
+from .cache_codec import CacheCodec, CacheDecodeError, get_codec
+from .tweet_store import iter_ndjson
+from .utils import batched, bounded_map
+
+__all__ = [
+    'cache_users',
+    'get_user_snapshots',
+    'get_users',
+    'join_users',
+    'pipe_users',
+    'split_users',
+    'user_ref',
+    'user_refs',
+    'write_users_file',
+]
+
+#: Key marking a user object as a reference to the user cache - its value
+#: is the snapshot referenced, or True in Tweets cached before snapshots
+USER_REF_KEY = '_wdrax_user_ref'
+
+#: Keys of a Tweet which may contain another embedded Tweet
+EMBEDDED_TWEET_KEYS = ('retweeted_status', 'quoted_status')
+
+#: Reference to a cached user - their ID and the hash of a snapshot, or
+#: None for the single snapshot cached before snapshots were hashed
+UserRef = typing.Tuple[int, typing.Optional[str]]
+
+
+def user_key(user_id: int, snapshot: typing.Optional[str] = None) -> str:
+    """Get the Redis key for a cached snapshot of a user."""
+    if snapshot is None:
+        return f'user_hydrated:{user_id}'
+
+    return f'user_hydrated:{user_id}:{snapshot}'
+
+
+def latest_key(user_id: int) -> str:
+    """Get the Redis key recording the latest cached snapshot of a user."""
+    return f'user_latest:{user_id}'
+
+
+def user_ref(user: typing.Mapping) -> UserRef:
+    """Get the reference to a snapshot of a user from its contents."""
+    encoded = json.dumps(user, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return user['id'], hashlib.blake2b(encoded.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def split_users(
+    tweet: typing.Mapping
+) -> typing.Tuple[typing.Mapping, typing.Dict[UserRef, typing.Mapping]]:
+    """Replace user objects within a Tweet with references to the user cache.
+
+    The Tweet passed in is not modified.
+
+    :return: Tweet with references and mapping of reference to user object.
+    """
+    users = {}
+
+    def strip(obj: typing.Mapping) -> typing.Mapping:
+        obj = dict(obj)
+
+        user = obj.get('user')
+        if isinstance(user, dict) and 'id' in user and USER_REF_KEY not in user:
+            ref = user_ref(user)
+            users[ref] = user
+            obj['user'] = {'id': user['id'], USER_REF_KEY: ref[1]}
+
+        for key in EMBEDDED_TWEET_KEYS:
+            if isinstance(obj.get(key), dict):
+                obj[key] = strip(obj[key])
+
+        return obj
+
+    return strip(tweet), users
+
+
+def _get_ref(user: typing.Any) -> typing.Optional[UserRef]:
+    """Get the reference to the user cache held in place of a user object, if any."""
+    if not isinstance(user, dict) or not user.get(USER_REF_KEY):
+        return None
+
+    snapshot = user[USER_REF_KEY]
+    return user['id'], None if snapshot is True else snapshot
+
+
+def user_refs(tweet: typing.Mapping) -> typing.Set[UserRef]:
+    """Get the references to all users within a Tweet."""
+    refs = set()
+
+    ref = _get_ref(tweet.get('user'))
+    if ref is not None:
+        refs.add(ref)
+
+    for key in EMBEDDED_TWEET_KEYS:
+        if isinstance(tweet.get(key), dict):
+            refs |= user_refs(tweet[key])
+
+    return refs
+
+
+def join_users(
+        tweet: typing.Mapping,
+        users: typing.Mapping[UserRef, typing.Mapping]
+) -> typing.Optional[typing.Mapping]:
+    """Replace user references within a Tweet with the full user objects.
+
+    :param users: Mapping of reference to user object - see `get_user_snapshots`.
+    :return: The rehydrated Tweet or None if any referenced user is missing.
+    """
+    obj = dict(tweet)
+
+    ref = _get_ref(obj.get('user'))
+    if ref is not None:
+        if ref not in users:
+            return None
+
+        obj['user'] = users[ref]
+
+    for key in EMBEDDED_TWEET_KEYS:
+        if isinstance(obj.get(key), dict):
+            obj[key] = join_users(obj[key], users)
+            if obj[key] is None:
+                return None
+
+    return obj
+
+
+def get_user_snapshots(refs: typing.Iterable[UserRef],
+                       codec: typing.Optional[CacheCodec] = None
+                       ) -> typing.Dict[UserRef, typing.Mapping]:
+    """Get snapshots of users from the user cache.
+
+    :return: Mapping of reference to user object for all snapshots found.
+    """
+    refs = list(refs)
+    if not refs:
+        return {}
+
+    codec = codec or get_codec(current_app.config)
+    with redis_pool.timed('mget'):
+        values = redis_pool.client.mget([user_key(*ref) for ref in refs])
+
+    users = {}
+    for ref, value in zip(refs, values):
+        if value is None:
+            continue
+
+        try:
+            users[ref] = codec.decode(value)
+
+        except CacheDecodeError:
+            pass
+
+    return users
+
+
+def get_users(user_ids: typing.Iterable[int],
+              codec: typing.Optional[CacheCodec] = None
+              ) -> typing.Dict[int, typing.Mapping]:
+    """Get the latest snapshots of users from the user cache.
+
+    :return: Mapping of user ID to user object for all users found.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+
+    with redis_pool.timed('mget'):
+        snapshots = redis_pool.client.mget([latest_key(i) for i in user_ids])
+
+    # Users cached before snapshots were hashed have no record of the latest
+    refs = [(user_id, None if snapshot is None else snapshot.decode())
+            for user_id, snapshot in zip(user_ids, snapshots)]
+    return {
+        user_id: user
+        for (user_id, _), user in get_user_snapshots(refs, codec).items()
+    }
+
+
+def pipe_users(pipe: redis.client.Pipeline,
+               users: typing.Mapping[UserRef, typing.Mapping], codec: CacheCodec,
+               cache_time: int) -> None:
+    """Add commands to save snapshots of users to a Redis pipeline.
+
+    :param users: Mapping of reference to user object - see `user_ref`.
+    """
+    for (user_id, snapshot), user in users.items():
+        pipe.setex(user_key(user_id, snapshot), cache_time, codec.encode(user))
+        pipe.setex(latest_key(user_id), cache_time, snapshot)
+
+
+def cache_users(users: typing.Iterable[typing.Mapping]) -> None:
+    """Save user objects to the user cache in pipelined batches.
+
+    :param users: User objects to cache - may be a generator.
+    """
+    config = current_app.config
+    codec = get_codec(config)
+    cache_time = config['REDIS_USER_CACHE_TIME']
+
+    def write_batch(batch: typing.List[typing.Mapping]) -> None:
+        pipe = redis_pool.client.pipeline(transaction=False)
+        pipe_users(pipe, {user_ref(user): user for user in batch if 'id' in user}, codec,
+                   cache_time)
+        with redis_pool.timed('pipeline'):
+            pipe.execute()
+
+    try:
+        for _ in bounded_map(write_batch,
+                             batched(users, config['REDIS_BATCH_SIZE']),
+                             config['REDIS_MAX_CONCURRENCY']):
+            pass
+
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.TimeoutError) as exc:
+        raise ConnectionError from exc
+
+
+def write_users_file(ndjson_file: pathlib.Path,
+                     users_file: pathlib.Path) -> int:
+    """Write all known user objects relevant to a set of Tweets to a file.
+
+    Authors are taken from the Tweets themselves.  Users who are mentioned
+    or replied to are looked up in the user cache, so plugins only need to
+    request unknown users from the Twitter API.
+
+    :param ndjson_file: Newline-delimited JSON file containing Tweets.
+    :param users_file: Path of newline-delimited JSON file of users to write.
+    :return: Number of users written.
+    """
+    written = set()
+    mentioned = set()
+
+    with open(users_file, mode='w', encoding='utf-8') as users_out:
+        def write(user: typing.Mapping) -> None:
+            users_out.write(
+                json.dumps(user, ensure_ascii=False, separators=(',', ':')))
+            users_out.write('\n')
+            written.add(user['id'])
+
+        for tweet in iter_ndjson(ndjson_file):
+            for obj in (tweet, *(tweet.get(k) for k in EMBEDDED_TWEET_KEYS)):
+                if not isinstance(obj, dict):
+                    continue
+
+                user = obj.get('user')
+                if (isinstance(user, dict) and 'id' in user
+                        and user['id'] not in written):
+                    write(user)
+
+                if obj.get('in_reply_to_user_id'):
+                    mentioned.add(obj['in_reply_to_user_id'])
+
+                for mention in obj.get('entities', {}).get('user_mentions', []):
+                    if mention.get('id'):
+                        mentioned.add(mention['id'])
+
+        mentioned -= written
+        try:
+            for batch in batched(mentioned, current_app.config['REDIS_BATCH_SIZE']):
+                for user in get_users(batch).values():
+                    write(user)
+
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.TimeoutError) as exc:
+            current_app.logger.error('Failed to read cached users: %s', exc)
+
+    return len(written)
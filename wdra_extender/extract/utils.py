@@ -0,0 +1,46 @@
+"""Module containing helpers for processing large collections in batches."""
+
+import collections
+from concurrent import futures
+import itertools
+import typing
+
+__all__ = [
+    'batched',
+    'bounded_map',
+]
+
+
+def batched(iterable: typing.Iterable,
+            size: int) -> typing.Iterator[typing.List]:
+    """Split an iterable into lists of at most `size` items.
+
+    The iterable is consumed lazily so it may be a generator.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+
+        yield batch
+
+
+def bounded_map(func: typing.Callable, iterable: typing.Iterable,
+                max_workers: int) -> typing.Iterator:
+    """Apply a function to each item using a thread pool, yielding results in order.
+
+    At most `max_workers` calls are in flight at once and the iterable is
+    consumed only as fast as results are used, so memory use is bounded.
+    """
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = collections.deque()
+
+        for item in iterable:
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+
+            pending.append(pool.submit(func, item))
+
+        while pending:
+            yield pending.popleft().result()
@@ -1,15 +1,26 @@
 """Module containing views related to Twitter Extract Bundles."""
 
-import pathlib
+import io
+import os
 import typing
 
-from flask import Blueprint, current_app, render_template, redirect, request, send_from_directory
+from flask import Blueprint, current_app, render_template, redirect, request
 import werkzeug
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
 
-from . import models, tasks
+from . import models, scheduling, tasks
+from .metrics import timed_view
+from .tweet_ids import TweetIdError, read_tweet_ids
 
 blueprint = Blueprint("extract", __name__, url_prefix='/extracts')  # pylint: disable=invalid-name
 
+#: Response header which hands a download to the front-end web server for each `DOWNLOAD_OFFLOAD`
+OFFLOAD_HEADERS = {
+    'x-accel-redirect': 'X-Accel-Redirect',
+    'x-sendfile': 'X-Sendfile',
+}
+
 
 class ValidationError(werkzeug.exceptions.BadRequest):
     """Error in validating user-provided data."""
@@ -17,49 +28,60 @@ class ValidationError(werkzeug.exceptions.BadRequest):
     description = 'Invalid data provided.'
 
 
-def cast_tweet_id(tweet_id: str) -> int:
-    """Cast a single Tweet ID to int.
-
-    They may be prefixed with 'ID:' so try to remove this.
-    """
-    if tweet_id.lower().startswith('id:'):
-        tweet_id = tweet_id.lower()[3:]
+def get_submitted_tweet_ids() -> typing.Sequence[int]:
+    """Read the distinct Tweet IDs submitted as a file or in the form, or raise ValidationError."""
+    upload = request.files.get('tweet_ids_file')
+    if upload is not None and upload.filename:
+        stream = upload.stream
 
-    return int(tweet_id)
+    else:
+        stream = io.BytesIO(request.form.get('tweet_ids', '').encode('utf-8'))
 
+    try:
+        tweet_ids = read_tweet_ids(stream)
 
-def validate_tweet_ids(tweet_ids: typing.Iterable[str]) -> typing.List[int]:
-    """Cast Tweet IDs to integer or raise ValidationError."""
+    except TweetIdError as exc:
+        raise ValidationError(str(exc)) from exc
 
-    if not tweet_ids:
+    if not len(tweet_ids):  # pylint: disable=len-as-condition
         raise ValidationError('No Tweet IDs were found.')
 
-    try:
-        # Filter out blank lines and cast to int
-        return [cast_tweet_id(tweet_id) for tweet_id in tweet_ids if tweet_id.strip()]
-
-    except ValueError as exc:
-        raise ValidationError('Tweet IDs must be integers.') from exc
+    return tweet_ids
 
 
 @blueprint.route('/', methods=['POST'])
+@timed_view
 def request_extract():
-    """View to request a Twitter Extract Bundle."""
-    tweet_ids = request.form['tweet_ids'].splitlines()
-    tweet_ids = validate_tweet_ids(tweet_ids)
-    current_app.logger.debug(f'Validated {len(tweet_ids)} Tweet IDs')
+    """View to request a Twitter Extract Bundle.
+
+    Tweet IDs may be uploaded as a file - see `read_tweet_ids` - or entered
+    in the form, one per line.  They are stored with the Bundle, so only its
+    UUID is sent to the task queue.
+    """
+    tweet_ids = get_submitted_tweet_ids()
+    current_app.logger.debug(f'Validated {len(tweet_ids)} distinct Tweet IDs')
 
     extract = models.Extract(email=request.form['email'])
-    extract.save()
+    extract.set_tweet_ids(tweet_ids)
 
     if current_app.config['CELERY_BROKER_URL']:
+        estimate = scheduling.estimate_build(tweet_ids)
+        extract.size_class = estimate.size_class
+        extract.save()
+        current_app.logger.info(
+            'Bundle %s is %s - %d Tweets of which %.0f%% are estimated to be cached',
+            extract.uuid, estimate.size_class, estimate.tweet_count,
+            100 * estimate.hit_rate)
+
         # Add job to task queue
         current_app.logger.debug(f'Handing extract {extract.uuid} to queue')
-        tasks.build_extract.delay(extract.uuid, tweet_ids)
+        # Build from cached Tweets first if requested - the full build follows
+        tasks.queue_build(extract, partial=bool(request.form.get('partial')))
         current_app.logger.debug(f'Handed extract {extract.uuid} to queue')
 
     else:
         # Build the extract now
+        extract.save()
         extract.build(tweet_ids)
 
     return redirect(extract.get_absolute_url())
@@ -73,10 +95,66 @@ def detail_extract(extract_uuid):
     return render_template('extract.html', extract=extract)
 
 
+def bundle_etag(extract_uuid, stat: os.stat_result) -> str:
+    """Get the entity tag of a Bundle zip file.
+
+    A Bundle may be rebuilt - e.g. after a partial build - so the tag
+    identifies the build as well as the Bundle.
+    """
+    return f'{extract_uuid}-{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
 @blueprint.route('/<uuid:extract_uuid>/fetch')
+@timed_view
 def download_extract(extract_uuid):
-    """View to download a Twitter Extract Bundle."""
-    return send_from_directory(current_app.config['OUTPUT_DIR'],
-                               pathlib.Path(
-                                   str(extract_uuid)).with_suffix('.zip'),
-                               as_attachment=True)
+    """View to download a Twitter Extract Bundle.
+
+    Supports conditional and range requests, so unchanged Bundles are not
+    downloaded again and interrupted downloads can be resumed.  If
+    `DOWNLOAD_OFFLOAD` is set, the file is sent by the front-end web server
+    rather than by this worker.
+    """
+    filename = f'{extract_uuid}.zip'
+    path = current_app.config['OUTPUT_DIR'].joinpath(filename)
+    offload = current_app.config['DOWNLOAD_OFFLOAD']
+    if offload and offload not in OFFLOAD_HEADERS:
+        raise ValueError(f'Unknown download offload: {offload}')
+
+    try:
+        # Open first so a Bundle being replaced is sent whole - either the old or the new
+        zip_file = None if offload else open(path, mode='rb')  # pylint: disable=consider-using-with
+        stat = os.fstat(zip_file.fileno()) if zip_file else path.stat()
+
+    except FileNotFoundError as exc:
+        raise werkzeug.exceptions.NotFound() from exc
+
+    if offload:
+        response = current_app.response_class(mimetype='application/zip')
+        response.headers[OFFLOAD_HEADERS[offload]] = (
+            current_app.config['DOWNLOAD_OFFLOAD_PREFIX'] + filename
+            if offload == 'x-accel-redirect' else str(path.absolute()))
+
+    else:
+        response = current_app.response_class(wrap_file(request.environ, zip_file),
+                                              mimetype='application/zip',
+                                              direct_passthrough=True)
+        response.content_length = stat.st_size
+
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    response.set_etag(bundle_etag(extract_uuid, stat))
+    response.last_modified = stat.st_mtime
+    # Revalidate each time since the Bundle may be rebuilt
+    response.cache_control.no_cache = True
+
+    if offload:
+        # The front-end web server handles range requests
+        if not is_resource_modified(request.environ,
+                                    etag=response.get_etag()[0],
+                                    last_modified=response.last_modified):
+            response.status_code = 304
+
+        return response
+
+    return response.make_conditional(request,
+                                     accept_ranges=True,
+                                     complete_length=stat.st_size)
@@ -3,28 +3,146 @@
 Gets settings from environment variables or .env/settings.ini file.
 """
 
+import os
 import pathlib
+import typing
 
-from decouple import AutoConfig
+from decouple import AutoConfig, Csv
 
 BASE_DIR = pathlib.Path(__name__).absolute().parent
 config = AutoConfig(search_path=str(BASE_DIR))  # pylint: disable=invalid-name
 
+
+def optional(cast: typing.Callable) -> typing.Callable:
+    """Make a config cast which allows the value to be unset."""
+    def cast_optional(value):
+        if value is None or value == '':
+            return None
+
+        return cast(value)
+
+    return cast_optional
+
+
 LOG_LEVEL = config('LOG_LEVEL', default='INFO')
 
 PLUGIN_DIR = config('PLUGIN_DIR',
                     cast=pathlib.Path,
                     default=BASE_DIR.joinpath('plugins'))
 
+#: Maximum number of plugins to run at the same time within a build
+PLUGIN_MAX_WORKERS = config('PLUGIN_MAX_WORKERS', cast=int, default=4)
+
+#: Number of processes in which map/reduce plugins aggregate shards of the Tweets
+#: These are shared by every map/reduce plugin running within a worker process
+MAPREDUCE_WORKERS = config('MAPREDUCE_WORKERS',
+                           cast=int,
+                           default=os.cpu_count() or 1)
+
+#: Minimum size in bytes of each shard of the Tweets file for map/reduce plugins
+#: Smaller Bundles are aggregated in a single shard within the worker process
+MAPREDUCE_MIN_SHARD_BYTES = config('MAPREDUCE_MIN_SHARD_BYTES',
+                                   cast=int,
+                                   default=32 * 1024 ** 2)
+
+#: Format of the Tweets file passed to plugins - one of:
+#: 'json' - a single JSON array, as expected by the bundled plugins
+#: 'ndjson' - newline-delimited JSON with one Tweet per line
+TWEETS_FILE_FORMAT = config('TWEETS_FILE_FORMAT', default='json')
+
+#: Directory in which plugin output files are kept to be reused by later builds
+PLUGIN_CACHE_DIR = config('PLUGIN_CACHE_DIR',
+                          cast=pathlib.Path,
+                          default=BASE_DIR.joinpath('plugin_cache'))
+
+#: Size in bytes above which least recently used plugin output is evicted
+#: Set to 0 to disable the plugin output cache
+PLUGIN_CACHE_MAX_BYTES = config('PLUGIN_CACHE_MAX_BYTES',
+                                cast=int,
+                                default=5 * 1024 ** 3)
+
+#: Seconds after which cached plugin output is evicted, however recently used
+#: This bounds how stale user profiles looked up by plugins may become
+PLUGIN_CACHE_MAX_AGE = config('PLUGIN_CACHE_MAX_AGE',
+                              cast=int,
+                              default=7 * 24 * 60 * 60)
+
 #: Directory into which output zip files should be placed
 OUTPUT_DIR = config('OUTPUT_DIR',
                     cast=pathlib.Path,
                     default=BASE_DIR.joinpath('media'))
 
+#: Compression of files within output zip files by file suffix, '*' for any other file
+#: Each is '<suffix>:<method>[:<level>]' with method 'store', 'deflate', 'bzip2' or 'lzma'
+BUNDLE_COMPRESSION = config(
+    'BUNDLE_COMPRESSION',
+    default='.png:store,.jpg:store,.jpeg:store,.gif:store,.zip:store,.gz:store,*:deflate:6')
+
+#: Front-end web server to which Bundle downloads are handed rather than being sent by the app - one of:
+#: '' - sent by the app worker
+#: 'x-accel-redirect' - nginx, with an internal location at `DOWNLOAD_OFFLOAD_PREFIX` serving `OUTPUT_DIR`
+#: 'x-sendfile' - Apache mod_xsendfile or lighttpd, which are given the absolute path of the file
+DOWNLOAD_OFFLOAD = config('DOWNLOAD_OFFLOAD', default='')
+
+#: URL prefix of the internal nginx location serving `OUTPUT_DIR` - see `DOWNLOAD_OFFLOAD`
+DOWNLOAD_OFFLOAD_PREFIX = config('DOWNLOAD_OFFLOAD_PREFIX', default='/protected-media/')
+
+#: Directory in which in-progress builds checkpoint their hydrated Tweets
+STAGING_DIR = config('STAGING_DIR',
+                     cast=pathlib.Path,
+                     default=BASE_DIR.joinpath('staging'))
+
+#: Number of Tweet IDs to hydrate between checkpoints
+HYDRATION_CHUNK_SIZE = config('HYDRATION_CHUNK_SIZE', cast=int, default=10000)
+
+#: Seconds for which a build's claim on Tweets it is looking up stops other builds looking them up
+#: Should exceed the time taken to hydrate a chunk - set to 0 to disable single-flight hydration
+HYDRATION_CLAIM_TIME = config('HYDRATION_CLAIM_TIME', cast=float, default=10 * 60)
+
+#: Seconds between checks for Tweets claimed by another build having been cached
+HYDRATION_CLAIM_POLL_INTERVAL = config('HYDRATION_CLAIM_POLL_INTERVAL',
+                                       cast=float,
+                                       default=2)
+
+#: Seconds a build waits in total for Tweets claimed by other builds before looking them up itself
+HYDRATION_CLAIM_MAX_WAIT = config('HYDRATION_CLAIM_MAX_WAIT',
+                                  cast=float,
+                                  default=HYDRATION_CLAIM_TIME)
+
 REDIS_HOST = config('REDIS_HOST', default=None)
 REDIS_PORT = config('REDIS_PORT', cast=int, default=6379)
 REDIS_DB = config('REDIS_DB', default='0')
 
+#: Maximum number of connections in the shared Redis connection pool
+REDIS_POOL_SIZE = config('REDIS_POOL_SIZE', cast=int, default=20)
+
+#: Number of Tweets to read or write in each Redis cache request
+REDIS_BATCH_SIZE = config('REDIS_BATCH_SIZE', cast=int, default=1000)
+
+#: Maximum number of Redis cache requests in flight at once
+REDIS_MAX_CONCURRENCY = config('REDIS_MAX_CONCURRENCY', cast=int, default=4)
+
+#: Seconds for which each snapshot of a user object is kept in the user cache
+#: Cached Tweets whose users have expired are no longer cache hits
+REDIS_USER_CACHE_TIME = config('REDIS_USER_CACHE_TIME',
+                               cast=int,
+                               default=10 * 24 * 60 * 60)
+
+#: Seconds for which Tweets which could not be found are skipped by later requests
+#: Set to 0 to disable the negative cache
+REDIS_MISSING_CACHE_TIME = config('REDIS_MISSING_CACHE_TIME',
+                                  cast=int,
+                                  default=7 * 24 * 60 * 60)
+
+#: Seconds to wait for a free connection when the pool is exhausted
+REDIS_POOL_TIMEOUT = config('REDIS_POOL_TIMEOUT', cast=float, default=20)
+
+#: Seconds to wait for a Redis command to complete
+REDIS_SOCKET_TIMEOUT = config('REDIS_SOCKET_TIMEOUT', cast=float, default=30)
+
+#: Seconds to wait when opening a new Redis connection
+REDIS_CONNECT_TIMEOUT = config('REDIS_CONNECT_TIMEOUT', cast=float, default=5)
+
 CELERY_BROKER_URL = config(
     'CELERY_BROKER_URL',
     default=(None if REDIS_HOST is None else
@@ -35,18 +153,131 @@ CELERY_RESULT_BACKEND = config(
     default=CELERY_BROKER_URL
 )
 
+#: Seconds after which a Redis broker redelivers a task which has not been acknowledged
+#: Build stage tasks are acknowledged late, so this should exceed the longest stage
+#: Unset to use the broker's default of one hour
+CELERY_VISIBILITY_TIMEOUT = config('CELERY_VISIBILITY_TIMEOUT', cast=optional(int), default=None)
+
+#: Options of the Celery broker transport - see `extensions.get_stage_config`
+CELERY_BROKER_TRANSPORT_OPTIONS = ({} if CELERY_VISIBILITY_TIMEOUT is None else {
+    'visibility_timeout': CELERY_VISIBILITY_TIMEOUT
+})
+
+#: Celery queues to which the tasks of each stage of a Bundle build are sent
+#: Each has a queue for each size class of build, named e.g. 'hydration.small'
+#: Hydration is network bound and analysis is CPU bound, so each may have its own workers
+HYDRATION_QUEUE = config('HYDRATION_QUEUE', default='hydration')
+ANALYSIS_QUEUE = config('ANALYSIS_QUEUE', default='analysis')
+
+#: Build stage served by a Celery worker - 'hydration', 'analysis' or unset to serve both
+WORKER_STAGE = config('WORKER_STAGE', cast=optional(str), default=None)
+
+#: Size classes of builds served by a Celery worker - see :mod:`wdra_extender.extract.scheduling`
+#: e.g. a worker serving only 'small' keeps capacity free for small builds
+WORKER_SIZE_CLASSES = config('WORKER_SIZE_CLASSES',
+                             cast=Csv(post_process=tuple),
+                             default='small,medium,large')
+
+#: Largest number of Tweets estimated to need looking up from the Twitter API for
+#: a build to be 'small' or 'medium' - larger builds are 'large'
+SMALL_BUILD_MAX_LOOKUPS = config('SMALL_BUILD_MAX_LOOKUPS', cast=int, default=10000)
+MEDIUM_BUILD_MAX_LOOKUPS = config('MEDIUM_BUILD_MAX_LOOKUPS', cast=int, default=200000)
+
+#: Number of requested Tweet IDs checked against the cache to estimate the size of a build
+HIT_RATE_SAMPLE_SIZE = config('HIT_RATE_SAMPLE_SIZE', cast=int, default=1000)
+
+#: Seconds after being queued for which an unfinished build lowers the priority of the
+#: same person's later builds
+FAIR_SHARE_WINDOW = config('FAIR_SHARE_WINDOW', cast=int, default=24 * 60 * 60)
+
+#: Port on which a Celery worker serves its metrics for Prometheus - unset to disable
+#: See :mod:`wdra_extender.extract.metrics`
+WORKER_METRICS_PORT = config('WORKER_METRICS_PORT', cast=optional(int), default=None)
+
+#: Number of tasks run at once by a worker serving each stage
+#: Hydration mostly waits on the Twitter API, so can run more builds than there are CPUs
+#: Analysis already runs up to `PLUGIN_MAX_WORKERS` plugins at once within each build
+HYDRATION_WORKER_CONCURRENCY = config('HYDRATION_WORKER_CONCURRENCY',
+                                      cast=int,
+                                      default=8)
+ANALYSIS_WORKER_CONCURRENCY = config('ANALYSIS_WORKER_CONCURRENCY',
+                                     cast=int,
+                                     default=1)
+
+#: Number of tasks reserved in advance by each worker process serving each stage
+HYDRATION_WORKER_PREFETCH = config('HYDRATION_WORKER_PREFETCH', cast=int, default=1)
+ANALYSIS_WORKER_PREFETCH = config('ANALYSIS_WORKER_PREFETCH', cast=int, default=1)
+
+#: Encoding of cached Tweets - see :mod:`wdra_extender.extract.cache_codec`
+#: e.g. 'json+zlib', 'json+zstd', 'msgpack+zstd'
+TWEET_CACHE_CODEC = config('TWEET_CACHE_CODEC', default='json+zlib')
+
+#: Compression level for cached Tweets - unset for the compressor's default
+TWEET_CACHE_COMPRESSION_LEVEL = config('TWEET_CACHE_COMPRESSION_LEVEL',
+                                       cast=optional(int),
+                                       default=None)
+
+#: Path to a shared compression dictionary for cached Tweets
+#: Changing the dictionary makes existing cache entries unreadable
+TWEET_CACHE_DICTIONARY = config('TWEET_CACHE_DICTIONARY',
+                                cast=optional(pathlib.Path),
+                                default=None)
+
 SQLALCHEMY_DATABASE_URI = config(
     'SQLALCHEMY_DATABASE_URI',
     default=f'sqlite:///{BASE_DIR.joinpath("db.sqlite3")}')
 
 TWEET_PROVIDERS = [
     'wdra_extender.extract.tweet_providers.redis_provider',
+    'wdra_extender.extract.tweet_providers.sqlite_provider',
     'wdra_extender.extract.tweet_providers.twarc_provider',
 ]
 
+#: Tweet providers used to build a partial Bundle before full hydration
+#: These should be fast cache providers - they are not expected to find every Tweet
+PARTIAL_TWEET_PROVIDERS = [
+    'wdra_extender.extract.tweet_providers.redis_provider',
+    'wdra_extender.extract.tweet_providers.sqlite_provider',
+]
+
+#: Tweet providers which are not asked for Tweets already being looked up by another build
+#: These should be slow or rate limited providers whose results are saved by `TWEET_CACHE_WRITERS`
+SINGLE_FLIGHT_PROVIDERS = [
+    'wdra_extender.extract.tweet_providers.twarc_provider',
+]
+
+#: Functions to which newly hydrated Tweets are passed to be cached
+TWEET_CACHE_WRITERS = [
+    'wdra_extender.extract.tweet_providers.save_to_redis',
+    'wdra_extender.extract.tweet_providers.save_to_sqlite',
+]
+
+#: Path of the local on-disk Tweet store used by `sqlite_provider`
+TWEET_STORE_PATH = config('TWEET_STORE_PATH',
+                          cast=pathlib.Path,
+                          default=BASE_DIR.joinpath('tweets.sqlite3'))
+
+#: Size in bytes above which least recently used Tweets are evicted from the local store
+TWEET_STORE_MAX_BYTES = config('TWEET_STORE_MAX_BYTES',
+                               cast=int,
+                               default=10 * 1024**3)
+
 TWITTER_CONSUMER_KEY = config('TWITTER_CONSUMER_KEY', default=None)
 TWITTER_CONSUMER_SECRET = config('TWITTER_CONSUMER_SECRET', default=None)
 TWITTER_ACCESS_TOKEN = config('TWITTER_ACCESS_TOKEN', default=None)
 TWITTER_ACCESS_TOKEN_SECRET = config('TWITTER_ACCESS_TOKEN_SECRET', default=None)
 
+#: Path to a JSON file listing further Twitter API credential sets to hydrate Tweets with
+#: Each is an object with keys 'consumer_key', 'consumer_secret', 'access_token' and 'access_token_secret'
+TWITTER_CREDENTIALS_FILE = config('TWITTER_CREDENTIALS_FILE',
+                                  cast=optional(pathlib.Path),
+                                  default=None)
+
+#: Maximum number of Tweet lookups in progress with each set of credentials
+TWITTER_TOKEN_CONCURRENCY = config('TWITTER_TOKEN_CONCURRENCY', cast=int, default=2)
+
+#: URL of the Twitter API Tweet lookup endpoint
+TWITTER_LOOKUP_URL = config('TWITTER_LOOKUP_URL',
+                            default='https://api.twitter.com/1.1/statuses/lookup.json')
+
 SQLALCHEMY_TRACK_MODIFICATIONS = False